@@ -0,0 +1,531 @@
+import re
+import threading
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
+# Tokens del SQL generado. Lo que no calza con ningún patrón (comillas sin cerrar, $, [, ...) se rechaza.
+_PATRON_TOKEN = re.compile(r"""
+    (?P<espacio>\s+)
+  | (?P<comentario>--[^\n]*|/\*.*?\*/)
+  | (?P<cadena>'(?:[^']|'')*')
+  | (?P<citado>"(?:[^"]|"")+")
+  | (?P<numero>(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<palabra>[^\W\d]\w*)
+  | (?P<simbolo>::|<>|!=|>=|<=|\|\||!~\*?|~\*?|[-+*/%=<>(),.;])
+""", re.VERBOSE | re.DOTALL)
+
+# Bloque de código del LLM (```sql ... ```) e inicio de la consulta dentro del texto
+_PATRON_BLOQUE = re.compile(r"```[a-zA-Z]*[ \t]*\n?(.*?)```", re.DOTALL)
+_PATRON_INICIO = re.compile(r"^[ \t(]*(?:SELECT|WITH)\b", re.IGNORECASE | re.MULTILINE)
+# Cadenas e identificadores citados de una línea (sus paréntesis no cuentan)
+_PATRON_CITAS = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"")
+
+# Palabras con las que puede empezar una línea que sigue siendo parte de la consulta
+CONTINUACIONES = {
+    'SELECT', 'FROM', 'WHERE', 'GROUP', 'HAVING', 'ORDER', 'LIMIT', 'OFFSET', 'JOIN', 'INNER', 'LEFT',
+    'RIGHT', 'FULL', 'CROSS', 'ON', 'AND', 'OR', 'UNION', 'INTERSECT', 'EXCEPT', 'CASE', 'WHEN', 'THEN',
+    'ELSE', 'END',
+}
+
+# Palabras con las que una línea deja la consulta incompleta (la siguiente la continúa)
+INCOMPLETAS = CONTINUACIONES - {'END'} | {
+    'BY', 'AS', 'NOT', 'IN', 'IS', 'LIKE', 'ILIKE', 'BETWEEN', 'DISTINCT', 'ALL', 'WITH', 'USING', 'OUTER',
+}
+
+# Nunca permitidas: escritura, DDL, transacciones, sesión y bloqueos (FOR UPDATE / FOR SHARE)
+PROHIBIDAS = {
+    'INSERT', 'UPDATE', 'DELETE', 'MERGE', 'UPSERT', 'CREATE', 'DROP', 'ALTER', 'TRUNCATE', 'GRANT',
+    'REVOKE', 'COPY', 'CALL', 'DO', 'EXECUTE', 'PREPARE', 'DEALLOCATE', 'LOCK', 'VACUUM', 'ANALYZE',
+    'CLUSTER', 'REINDEX', 'REFRESH', 'COMMENT', 'SET', 'RESET', 'SHOW', 'LISTEN', 'NOTIFY', 'UNLISTEN',
+    'BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'INTO', 'SHARE', 'NOWAIT', 'RETURNING', 'LOAD',
+    'DISCARD', 'CHECKPOINT', 'IMPORT',
+}
+
+# Funciones de solo lectura permitidas (cualquier otra llamada se rechaza: pg_sleep, dblink, set_config...)
+FUNCIONES = {
+    'COUNT', 'SUM', 'AVG', 'MIN', 'MAX', 'STDDEV', 'VARIANCE', 'STRING_AGG', 'ARRAY_AGG', 'MODE',
+    'PERCENTILE_CONT', 'PERCENTILE_DISC', 'ROW_NUMBER', 'RANK', 'DENSE_RANK', 'NTILE', 'LAG', 'LEAD',
+    'FIRST_VALUE', 'LAST_VALUE', 'EXTRACT', 'DATE_PART', 'DATE_TRUNC', 'TO_CHAR', 'TO_DATE',
+    'TO_NUMBER', 'MAKE_DATE', 'AGE', 'NOW', 'CAST', 'COALESCE', 'NULLIF', 'GREATEST', 'LEAST',
+    'ROUND', 'TRUNC', 'ABS', 'CEIL', 'CEILING', 'FLOOR', 'LOWER', 'UPPER', 'INITCAP', 'TRIM', 'LTRIM',
+    'RTRIM', 'SUBSTRING', 'SUBSTR', 'LEFT', 'RIGHT', 'LENGTH', 'CHAR_LENGTH', 'CONCAT', 'CONCAT_WS',
+    'REPLACE', 'POSITION', 'SPLIT_PART', 'REGEXP_REPLACE',
+}
+
+# Tipos para CAST(x AS tipo) y x::tipo (algunos admiten modificadores: NUMERIC(10, 2))
+TIPOS = {
+    'INT', 'INTEGER', 'BIGINT', 'SMALLINT', 'NUMERIC', 'DECIMAL', 'REAL', 'FLOAT', 'DOUBLE', 'PRECISION',
+    'TEXT', 'VARCHAR', 'CHAR', 'CHARACTER', 'VARYING', 'DATE', 'TIMESTAMP', 'TIME', 'INTERVAL', 'BOOLEAN',
+}
+
+PALABRAS_CLAVE = {
+    'SELECT', 'FROM', 'WHERE', 'GROUP', 'BY', 'HAVING', 'ORDER', 'LIMIT', 'OFFSET', 'AS', 'ON', 'USING',
+    'JOIN', 'INNER', 'LEFT', 'RIGHT', 'FULL', 'OUTER', 'CROSS', 'NATURAL', 'AND', 'OR', 'NOT', 'IN',
+    'IS', 'NULL', 'LIKE', 'ILIKE', 'SIMILAR', 'TO', 'ESCAPE', 'BETWEEN', 'CASE', 'WHEN', 'THEN', 'ELSE',
+    'END', 'DISTINCT', 'ALL', 'ASC', 'DESC', 'NULLS', 'FIRST', 'LAST', 'UNION', 'INTERSECT', 'EXCEPT',
+    'WITH', 'TRUE', 'FALSE', 'EXISTS', 'ANY', 'SOME', 'FILTER', 'OVER', 'PARTITION', 'ROWS', 'RANGE',
+    'PRECEDING', 'FOLLOWING', 'UNBOUNDED', 'CURRENT', 'ROW', 'WITHIN', 'FOR', 'BOTH', 'LEADING',
+    'TRAILING', 'CURRENT_DATE', 'CURRENT_TIMESTAMP', 'YEAR', 'MONTH', 'DAY', 'HOUR', 'MINUTE', 'SECOND',
+    'WEEK', 'QUARTER', 'DOW', 'ISODOW', 'DOY', 'EPOCH', 'FETCH',
+} | TIPOS
+
+# Cláusulas que cierran la lista FROM de su nivel
+_FIN_FROM = {'WHERE', 'GROUP', 'HAVING', 'ORDER', 'LIMIT', 'OFFSET', 'UNION', 'INTERSECT', 'EXCEPT'}
+
+# Tabla (o alias) de ESTRUCTURA_TABLA: '1. defunciones_principales (id, "ANIO", ...)'
+_PATRON_TABLA = re.compile(r"^\s*\d+\.\s*(\w+)\s*\(([^)]*)\)", re.MULTILINE)
+
+
+def esquema_desde_estructura(estructura: str) -> dict:
+    """Tablas y columnas permitidas a partir de la descripción que recibe el LLM (ESTRUCTURA_TABLA)"""
+    esquema = {}
+    for m in _PATRON_TABLA.finditer(estructura):
+        esquema[m.group(1).lower()] = {c.strip().strip('"') for c in m.group(2).split(",") if c.strip()}
+    return esquema
+
+
+def _linea_continua(linea: str, anterior: str, profundidad: int, tras_blanco: bool) -> bool:
+    """Si la línea sigue siendo parte de la consulta (anterior: última línea de SQL aceptada)"""
+    previa = anterior.rstrip()
+    if previa.endswith(';'):
+        return False
+    if profundidad > 0 or previa.endswith((',', '(', '=', '<', '>', '+', '-', '*', '/', '|')):
+        return True
+    final = re.search(r"(\w*)$", previa).group(1).upper()
+    if final in INCOMPLETAS:
+        return True
+    cabeza = linea.lstrip()
+    palabra = re.match(r"\w*", cabeza).group().upper()
+    if palabra in CONTINUACIONES or cabeza[:1] in "),":
+        return True
+    # Sin palabra clave: solo una línea indentada (no tras un párrafo) continúa la consulta
+    return not tras_blanco and linea[:1] in " \t"
+
+
+def extraer_sql(texto: str) -> Optional[str]:
+    """
+    Aislar la consulta dentro de la salida del LLM: el primer bloque ```sql``` que la contenga
+    o el texto desde la línea donde empieza el SELECT/WITH, hasta la primera línea que ya no la continúa
+    (la explicación que el LLM agrega a continuación, con o sin línea en blanco).
+    """
+    for bloque in _PATRON_BLOQUE.findall(texto):
+        if _PATRON_INICIO.search(bloque):
+            texto = bloque
+            break
+
+    inicio = _PATRON_INICIO.search(texto)
+    if inicio is None:
+        return None
+
+    def parentesis(linea: str) -> int:
+        sin_citas = _PATRON_CITAS.sub("", linea)
+        return sin_citas.count("(") - sin_citas.count(")")
+
+    lineas = texto[inicio.start():].split("\n")
+    partes = [lineas[0]]
+    profundidad = parentesis(lineas[0])
+    tras_blanco = False
+    for linea in lineas[1:]:
+        if not linea.strip():
+            tras_blanco = True
+            continue
+        if not _linea_continua(linea, partes[-1], profundidad, tras_blanco):
+            break
+        partes.append(linea)
+        profundidad += parentesis(linea)
+        tras_blanco = False
+    return "\n".join(partes).strip()
+
+
+@dataclass(frozen=True)
+class Token:
+    tipo: str       # palabra, citado, cadena, numero, simbolo
+    valor: str
+
+    @property
+    def clave(self) -> str:
+        return self.valor.upper() if self.tipo == 'palabra' else ""
+
+    @property
+    def nombre(self) -> str:
+        """Identificador como lo resuelve PostgreSQL: sin comillas se pliega a minúsculas"""
+        if self.tipo == 'citado':
+            return self.valor[1:-1].replace('""', '"')
+        return self.valor.lower()
+
+
+class SQLInvalido(Exception):
+    def __init__(self, motivo: str, detalle: str):
+        super().__init__(detalle)
+        self.motivo = motivo
+
+
+@dataclass(frozen=True)
+class ConsultaSQL:
+    """Resultado del análisis: SQL canónico ejecutable, o el motivo del rechazo"""
+    sql: Optional[str]
+    motivo: Optional[str] = None        # sin_select, sintaxis, sentencias, operacion, funcion, tabla, columna, limite
+    error: Optional[str] = None
+    tablas: frozenset = frozenset()
+    limite: Optional[int] = None
+    limite_ajustado: bool = False       # se agregó o se recortó el LIMIT
+
+    @property
+    def valida(self) -> bool:
+        return self.sql is not None
+
+
+def tokenizar(texto: str) -> list:
+    """Tokens de la primera sentencia; lo que sigue a un ';' solo se tolera si no es otra sentencia"""
+    tokens, pos, nivel = [], 0, 0
+    while pos < len(texto):
+        m = _PATRON_TOKEN.match(texto, pos)
+        if m is None:
+            raise SQLInvalido('sintaxis', f"carácter no permitido cerca de: {texto[pos:pos + 20]!r}")
+        pos = m.end()
+        tipo = m.lastgroup
+        if tipo in ('espacio', 'comentario'):
+            continue
+        valor = m.group()
+        if valor == '(':
+            nivel += 1
+        elif valor == ')':
+            nivel -= 1
+            if nivel < 0:
+                raise SQLInvalido('sintaxis', "paréntesis sin abrir")
+        elif valor == ';':
+            if nivel == 0:
+                # Texto explicativo tras el ';' se descarta; otra sentencia no
+                resto = re.match(r"\s*(\w*)", texto[pos:]).group(1).upper()
+                if resto in PROHIBIDAS or resto in ('SELECT', 'WITH'):
+                    raise SQLInvalido('sentencias', "solo se permite una sentencia")
+                break
+            raise SQLInvalido('sintaxis', "';' dentro de paréntesis")
+        tokens.append(Token(tipo, valor))
+    if nivel != 0:
+        raise SQLInvalido('sintaxis', "paréntesis sin cerrar")
+    return tokens
+
+
+def canonizar(tokens: list, funciones: set) -> str:
+    """Texto canónico: espacios normalizados, palabras clave y funciones en mayúsculas, identificadores plegados"""
+    partes = []
+    previo = None
+    for i, t in enumerate(tokens):
+        if t.tipo == 'palabra':
+            texto = t.valor.upper() if (t.clave in PALABRAS_CLAVE or i in funciones) else t.valor.lower()
+        else:
+            texto = t.valor
+        if previo is not None:
+            pegado = (
+                texto in (',', ')', '.', '::')
+                or previo.valor in ('(', '.', '::')
+                or (texto == '(' and (i - 1) in funciones)
+                or (previo.valor == '-' and _es_unario(tokens, i - 1))
+            )
+            if not pegado:
+                partes.append(" ")
+        partes.append(texto)
+        previo = t
+    return "".join(partes)
+
+
+def _es_unario(tokens: list, i: int) -> bool:
+    if i == 0:
+        return True
+    anterior = tokens[i - 1]
+    return anterior.tipo == 'simbolo' and anterior.valor != ')' or (
+        anterior.tipo == 'palabra' and anterior.clave in PALABRAS_CLAVE and anterior.clave not in ('END', 'NULL')
+    )
+
+
+def _termina_expresion(t: Optional[Token]) -> bool:
+    """Si un identificador tras este token es un alias implícito (COUNT(*) total)"""
+    if t is None:
+        return False
+    if t.tipo in ('citado', 'cadena', 'numero'):
+        return True
+    if t.tipo == 'simbolo':
+        return t.valor in (')', '*')
+    return t.clave == 'END' or t.clave not in PALABRAS_CLAVE
+
+
+class AnalizadorSQL:
+    """
+    Valida el SQL generado antes de ejecutarlo: una sola sentencia SELECT de solo lectura, sobre las
+    tablas y columnas de ESTRUCTURA_TABLA y con funciones conocidas; agrega o recorta el LIMIT y entrega
+    la forma canónica, que es la que se ejecuta y la que se usa como clave de cache.
+    El análisis se memoiza por texto: la misma salida del LLM o plantilla no se vuelve a analizar.
+    """
+
+    def __init__(self, esquema: dict, limite_filas: int = 1000, max_entradas: int = 2048):
+        self.esquema = {tabla: set(columnas) for tabla, columnas in esquema.items()}
+        self.columnas = set().union(*self.esquema.values()) if self.esquema else set()
+        self.limite_filas = limite_filas
+        self._analizar_cacheado = lru_cache(maxsize=max_entradas)(self._analizar)
+        self._lock = threading.Lock()
+        self.validas = 0
+        self.limites_ajustados = 0
+        self.rechazos = {}
+
+    def analizar(self, texto: str) -> ConsultaSQL:
+        consulta = self._analizar_cacheado(texto)
+        with self._lock:
+            if consulta.valida:
+                self.validas += 1
+                if consulta.limite_ajustado:
+                    self.limites_ajustados += 1
+            else:
+                self.rechazos[consulta.motivo] = self.rechazos.get(consulta.motivo, 0) + 1
+        return consulta
+
+    def limite(self, texto: str) -> Optional[int]:
+        """LIMIT con el que se ejecuta el SQL (None si no es válido); no cuenta en la telemetría"""
+        return self._analizar_cacheado(texto).limite
+
+    def _analizar(self, texto: str) -> ConsultaSQL:
+        sql = extraer_sql(texto)
+        if sql is None:
+            return ConsultaSQL(None, 'sin_select', "la respuesta no contiene un SELECT")
+        try:
+            tokens = tokenizar(sql)
+            if not tokens or tokens[0].clave not in ('SELECT', 'WITH') and tokens[0].valor != '(':
+                raise SQLInvalido('sin_select', "solo se permiten consultas SELECT")
+            funciones, tablas, posicion_limite = self._validar(tokens)
+            tokens, limite, ajustado = self._acotar_limite(tokens, posicion_limite)
+        except SQLInvalido as err:
+            return ConsultaSQL(None, err.motivo, str(err))
+        return ConsultaSQL(canonizar(tokens, funciones), tablas=frozenset(tablas), limite=limite,
+                           limite_ajustado=ajustado)
+
+    def _validar(self, tokens: list):
+        """Recorrer la consulta por niveles de paréntesis; retorna (índices de funciones, tablas, LIMIT externo)"""
+        # Cada nivel: 'consulta' (SELECT o subconsulta), 'funcion' o 'grupo' (expresión entre paréntesis)
+        pila = [{'tipo': 'consulta', 'clausula': None, 'esperando_tabla': False, 'tras_tabla': False,
+                 'tabla': None, 'en_from': False}]
+        funciones, tablas, ctes = set(), set(), set()
+        alias_tabla, alias_columna, referencias = {}, set(), []
+        posicion_limite = None
+        definir_alias = saltar_tipo = False
+        n = len(tokens)
+        i = 0
+        while i < n:
+            t = tokens[i]
+            sig = tokens[i + 1] if i + 1 < n else None
+            nivel = pila[-1]
+
+            if t.tipo == 'simbolo':
+                if t.valor == '(':
+                    if (i - 1) in funciones:
+                        tipo = 'funcion'
+                    elif sig is not None and sig.clave in ('SELECT', 'WITH'):
+                        tipo = 'consulta'
+                    else:
+                        tipo = 'grupo'
+                    en_from = nivel['esperando_tabla'] and tipo == 'consulta'
+                    if nivel['esperando_tabla'] and not en_from:
+                        raise SQLInvalido('sintaxis', "se esperaba una tabla después de FROM/JOIN")
+                    nivel['esperando_tabla'] = False
+                    pila.append({'tipo': tipo, 'clausula': None, 'esperando_tabla': False, 'tras_tabla': False,
+                                 'tabla': None, 'en_from': en_from})
+                elif t.valor == ')':
+                    cerrado = pila.pop()
+                    if cerrado['en_from']:
+                        pila[-1]['tras_tabla'] = True
+                        pila[-1]['tabla'] = None
+                elif t.valor == ',' and nivel['clausula'] == 'from':
+                    nivel['esperando_tabla'] = True
+                    nivel['tras_tabla'] = False
+                elif t.valor == '::':
+                    saltar_tipo = True
+                else:
+                    nivel['tras_tabla'] = False
+                definir_alias = False
+                i += 1
+                continue
+
+            if t.tipo in ('cadena', 'numero'):
+                nivel['tras_tabla'] = definir_alias = False
+                i += 1
+                continue
+
+            clave = t.clave
+            if clave in PROHIBIDAS:
+                raise SQLInvalido('operacion', f"operación no permitida: {clave}")
+
+            # Nombre de tipo tras '::' o CAST(... AS tipo)
+            if saltar_tipo or (definir_alias and nivel['tipo'] == 'funcion'):
+                saltar_tipo = definir_alias = False
+                if sig is not None and sig.valor == '(' and clave in TIPOS:
+                    funciones.add(i)
+                i += 1
+                continue
+
+            if definir_alias:
+                definir_alias = False
+                if nivel['clausula'] == 'from':
+                    alias_tabla[t.nombre] = nivel['tabla']
+                    nivel['tras_tabla'] = False
+                else:
+                    alias_columna.add(t.nombre)
+                i += 1
+                continue
+
+            # Llamada a función: solo las de la lista
+            if t.tipo == 'palabra' and sig is not None and sig.valor == '(' and (
+                    clave in FUNCIONES or clave not in PALABRAS_CLAVE):
+                if clave not in FUNCIONES:
+                    raise SQLInvalido('funcion', f"función no permitida: {t.valor}")
+                funciones.add(i)
+                nivel['tras_tabla'] = False
+                i += 1
+                continue
+
+            if t.tipo == 'palabra' and clave in PALABRAS_CLAVE:
+                nivel['tras_tabla'] = False
+                if nivel['tipo'] == 'consulta':
+                    if clave == 'SELECT':
+                        nivel['clausula'] = 'select'
+                    elif clave == 'FROM':
+                        nivel['clausula'] = 'from'
+                        nivel['esperando_tabla'] = True
+                    elif clave == 'JOIN':
+                        nivel['esperando_tabla'] = True
+                    elif clave in ('ON', 'USING'):
+                        nivel['esperando_tabla'] = False
+                        nivel['clausula'] = 'from'
+                    elif clave in _FIN_FROM:
+                        nivel['clausula'] = clave.lower()
+                        nivel['esperando_tabla'] = False
+                        if clave == 'LIMIT' and len(pila) == 1:
+                            posicion_limite = i
+                    elif clave == 'FETCH' and len(pila) == 1:
+                        raise SQLInvalido('limite', "usar LIMIT en lugar de FETCH")
+                if clave == 'AS':
+                    # WITH nombre AS (...) ya registró el nombre; aquí solo alias de columnas o tablas
+                    definir_alias = sig is not None and sig.tipo in ('palabra', 'citado')
+                i += 1
+                continue
+
+            # Identificador (palabra o "citado")
+            nombre = t.nombre
+            if nivel['esperando_tabla']:
+                if sig is not None and sig.valor == '.':
+                    if nombre != 'public' or i + 2 >= n:
+                        raise SQLInvalido('tabla', f"esquema no permitido: {t.valor}")
+                    i += 2
+                    nombre = tokens[i].nombre
+                if nombre not in self.esquema and nombre not in ctes:
+                    raise SQLInvalido('tabla', f"tabla no permitida: {tokens[i].valor}")
+                tablas.add(nombre)
+                nivel.update(esperando_tabla=False, tras_tabla=True, tabla=nombre)
+                i += 1
+                continue
+
+            if nivel['tras_tabla']:
+                # Alias implícito de tabla o subconsulta: FROM defunciones_principales d
+                alias_tabla[nombre] = nivel['tabla']
+                nivel['tras_tabla'] = False
+                i += 1
+                continue
+
+            if sig is not None and sig.clave == 'AS' and i + 2 < n and tokens[i + 2].valor == '(':
+                # WITH nombre AS (SELECT ...)
+                ctes.add(nombre)
+                i += 2
+                continue
+
+            if sig is not None and sig.valor == '.':
+                if i + 2 >= n:
+                    raise SQLInvalido('sintaxis', "referencia incompleta")
+                columna = tokens[i + 2]
+                referencias.append((t, columna))
+                i += 3
+                continue
+
+            if nivel['tipo'] == 'consulta' and nivel['clausula'] == 'select' and _termina_expresion(tokens[i - 1]):
+                alias_columna.add(nombre)
+            else:
+                referencias.append((None, t))
+            i += 1
+
+        self._validar_referencias(referencias, alias_tabla, alias_columna, ctes)
+        return funciones, tablas, posicion_limite
+
+    def _validar_referencias(self, referencias, alias_tabla, alias_columna, ctes):
+        for calificador, columna in referencias:
+            nombre = columna.nombre
+            if calificador is None:
+                if nombre not in self.columnas and nombre not in alias_columna:
+                    raise SQLInvalido('columna', f"columna desconocida: {columna.valor}")
+                continue
+
+            origen = calificador.nombre
+            if origen in alias_tabla:
+                tabla = alias_tabla[origen]
+            elif origen in self.esquema or origen in ctes:
+                tabla = origen
+            else:
+                raise SQLInvalido('columna', f"tabla o alias desconocido: {calificador.valor}")
+
+            if columna.valor == '*':
+                continue
+            if columna.tipo not in ('palabra', 'citado'):
+                raise SQLInvalido('sintaxis', f"referencia inválida: {calificador.valor}.{columna.valor}")
+            if tabla in self.esquema:
+                if nombre not in self.esquema[tabla]:
+                    raise SQLInvalido('columna', f"columna desconocida: {tabla}.{columna.valor}")
+            elif nombre not in self.columnas and nombre not in alias_columna:
+                # Subconsulta o CTE: sus columnas salen de las tablas base o de alias
+                raise SQLInvalido('columna', f"columna desconocida: {calificador.valor}.{columna.valor}")
+
+    def _acotar_limite(self, tokens: list, posicion: Optional[int]):
+        """Agregar LIMIT si la consulta externa no tiene, o recortarlo al máximo; retorna (tokens, límite, ajustado)"""
+        maximo = Token('numero', str(self.limite_filas))
+        if posicion is None:
+            return tokens + [Token('palabra', 'LIMIT'), maximo], self.limite_filas, True
+
+        valor = tokens[posicion + 1] if posicion + 1 < len(tokens) else None
+        if valor is not None and valor.clave == 'ALL':
+            return tokens[:posicion + 1] + [maximo] + tokens[posicion + 2:], self.limite_filas, True
+        if valor is None or valor.tipo != 'numero' or not valor.valor.isdigit():
+            raise SQLInvalido('limite', "LIMIT debe ser un número entero")
+        limite = int(valor.valor)
+        if limite > self.limite_filas:
+            return tokens[:posicion + 1] + [maximo] + tokens[posicion + 2:], self.limite_filas, True
+        return tokens, limite, False
+
+    def estadisticas(self) -> dict:
+        info = self._analizar_cacheado.cache_info()
+        with self._lock:
+            return {
+                "validas": self.validas,
+                "rechazadas": sum(self.rechazos.values()),
+                "rechazos": dict(self.rechazos),
+                "limites_ajustados": self.limites_ajustados,
+                "limite_filas": self.limite_filas,
+                "memo_aciertos": info.hits,
+                "memo_fallos": info.misses,
+                "memo_entradas": info.currsize,
+                "tablas": sorted(self.esquema)
+            }
+
+
+_analizador = AnalizadorSQL({})
+
+
+def configurar_analizador(estructura: str, limite_filas: int = 1000) -> AnalizadorSQL:
+    """Crear el analizador con las tablas y columnas de la estructura que se entrega al LLM"""
+    global _analizador
+    _analizador = AnalizadorSQL(esquema_desde_estructura(estructura), limite_filas)
+    return _analizador
+
+
+def analizador_activo() -> AnalizadorSQL:
+    return _analizador
+
+
+def analizar_sql(texto: str) -> ConsultaSQL:
+    """Extraer, validar y canonizar el SQL generado (memoizado por texto)"""
+    return _analizador.analizar(texto)
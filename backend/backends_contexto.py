@@ -0,0 +1,157 @@
+import json
+from typing import Optional
+
+# Redis es opcional: solo se necesita con CONTEXTO_BACKEND=redis
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class ConflictoVersion(Exception):
+    """Otro worker modificó el contexto después de que lo leímos"""
+
+
+class BackendContexto:
+    """
+    Almacenamiento compartido de contextos serializados, con versión por clave
+    para concurrencia optimista. Las versiones empiezan en 1; 0 significa "no existe".
+    """
+    nombre = "base"
+
+    def leer(self, clave: str, version_conocida: int = 0) -> Optional[tuple]:
+        """(datos, versión); (None, versión) si no cambió desde version_conocida; None si no existe"""
+        raise NotImplementedError
+
+    def escribir(self, clave: str, datos: dict, version_esperada: int) -> int:
+        """Guardar si la versión sigue siendo version_esperada; retorna la nueva versión"""
+        raise NotImplementedError
+
+    def eliminar(self, clave: str):
+        raise NotImplementedError
+
+
+class BackendPostgres(BackendContexto):
+    """Tabla contextos_conversacion (ver database.py), usando el pool compartido"""
+    nombre = "postgres"
+
+    def __init__(self, pool, ttl: float = 7200.0, purgar_cada: int = 500):
+        self.pool = pool
+        self.ttl = ttl
+        self.purgar_cada = purgar_cada
+        self._escrituras = 0
+
+    def leer(self, clave, version_conocida=0):
+        with self.pool.conexion() as conn:
+            cur = conn.cursor()
+            # Si la versión no cambió no se transfiere el contenido
+            cur.execute("""
+                SELECT CASE WHEN version = %s THEN NULL ELSE datos END, version
+                FROM contextos_conversacion
+                WHERE clave = %s AND updated_at > CURRENT_TIMESTAMP - make_interval(secs => %s)
+            """, (version_conocida, clave, self.ttl))
+            fila = cur.fetchone()
+            cur.close()
+        if fila is None:
+            return None
+        datos, version = fila
+        return (json.loads(datos) if datos is not None else None), version
+
+    def escribir(self, clave, datos, version_esperada):
+        with self.pool.conexion() as conn:
+            cur = conn.cursor()
+            if version_esperada == 0:
+                # También reemplaza filas expiradas que nadie leyó
+                cur.execute("""
+                    INSERT INTO contextos_conversacion (clave, datos, version, updated_at)
+                    VALUES (%s, %s, 1, CURRENT_TIMESTAMP)
+                    ON CONFLICT (clave) DO UPDATE SET datos = EXCLUDED.datos, version = contextos_conversacion.version + 1,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE contextos_conversacion.updated_at <= CURRENT_TIMESTAMP - make_interval(secs => %s)
+                    RETURNING version
+                """, (clave, json.dumps(datos), self.ttl))
+            else:
+                cur.execute("""
+                    UPDATE contextos_conversacion
+                    SET datos = %s, version = version + 1, updated_at = CURRENT_TIMESTAMP
+                    WHERE clave = %s AND version = %s
+                    RETURNING version
+                """, (json.dumps(datos), clave, version_esperada))
+            fila = cur.fetchone()
+
+            self._escrituras += 1
+            if self._escrituras % self.purgar_cada == 0:
+                cur.execute(
+                    "DELETE FROM contextos_conversacion WHERE updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s)",
+                    (self.ttl,)
+                )
+            conn.commit()
+            cur.close()
+        if fila is None:
+            raise ConflictoVersion(clave)
+        return fila[0]
+
+    def eliminar(self, clave):
+        with self.pool.conexion() as conn:
+            cur = conn.cursor()
+            cur.execute("DELETE FROM contextos_conversacion WHERE clave = %s", (clave,))
+            conn.commit()
+            cur.close()
+
+
+class BackendRedis(BackendContexto):
+    """
+    Servidor compatible con Redis (Redis, Valkey, KeyDB...): un hash por contexto
+    con los campos datos/version; WATCH/MULTI para la concurrencia optimista
+    """
+    nombre = "redis"
+
+    def __init__(self, url: str, ttl: float = 7200.0, prefijo: str = "contexto:"):
+        if redis is None:
+            raise RuntimeError("CONTEXTO_BACKEND=redis requiere el paquete 'redis'")
+        self.cliente = redis.Redis.from_url(url)
+        self.ttl = int(ttl)
+        self.prefijo = prefijo
+
+    def leer(self, clave, version_conocida=0):
+        llave = self.prefijo + clave
+        version = self.cliente.hget(llave, "version")
+        if version is None:
+            return None
+        if int(version) == version_conocida:
+            return None, version_conocida
+        datos, version = self.cliente.hmget(llave, "datos", "version")
+        if datos is None:
+            return None
+        return json.loads(datos), int(version)
+
+    def escribir(self, clave, datos, version_esperada):
+        llave = self.prefijo + clave
+        with self.cliente.pipeline() as pipe:
+            try:
+                pipe.watch(llave)
+                actual = pipe.hget(llave, "version")
+                if int(actual or 0) != version_esperada:
+                    raise ConflictoVersion(clave)
+                nueva = version_esperada + 1
+                pipe.multi()
+                pipe.hset(llave, mapping={"datos": json.dumps(datos), "version": nueva})
+                pipe.expire(llave, self.ttl)
+                pipe.execute()
+                return nueva
+            except redis.WatchError:
+                raise ConflictoVersion(clave)
+
+    def eliminar(self, clave):
+        self.cliente.delete(self.prefijo + clave)
+
+
+def crear_backend(tipo: str, pool=None, ttl: float = 7200.0, url_redis: str = "") -> Optional[BackendContexto]:
+    """Backend según CONTEXTO_BACKEND: 'memoria' (None, solo en proceso), 'postgres' o 'redis'"""
+    if tipo in ("", "memoria"):
+        return None
+    if tipo == "postgres":
+        return BackendPostgres(pool, ttl=ttl)
+    if tipo == "redis":
+        return BackendRedis(url_redis, ttl=ttl)
+    raise ValueError(f"CONTEXTO_BACKEND desconocido: {tipo}")
@@ -0,0 +1,203 @@
+"""
+Benchmark de carga de la API sin gastar cuota del LLM ni tocar la base de producción:
+main.client se reemplaza por un LLM falso determinista (llm_falso.py) y la base se apunta
+con DB_* a un PostgreSQL local, opcionalmente sembrado con datos sintéticos (datos_sinteticos.py).
+Reporta throughput y percentiles p50/p95/p99 por endpoint, y las etapas de /chat (Server-Timing).
+
+    DB_HOST=localhost DB_NAME=bench python benchmarks/bench_chat.py --sembrar 300000
+    DB_HOST=localhost DB_NAME=bench python benchmarks/bench_chat.py --concurrencia 64 --solicitudes 5000 \\
+        --latencia-llm 0.5 --env INTENCIONES_ACTIVAS=0
+
+La app corre en este proceso con httpx.ASGITransport (requiere httpx): se mide la aplicación
+completa (auth, pipeline, BD) pero no el servidor HTTP.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Conversaciones de ejemplo: plantillas (intenciones), seguimientos locales y preguntas que van al LLM falso
+CONVERSACIONES = [
+    ["¿Cuántas muertes hubo en 2024?", "y en hombres", "y en mujeres"],
+    ["muertes por región", "cuál es la principal causa", "suma"],
+    ["¿Cuántas defunciones hubo en Valparaíso en marzo de 2023?", "y en 2024", "y en hombres"],
+    ["cuál es la edad promedio de muerte", "y en mujeres"],
+    ["muertes por lugar de defunción", "cuál es el mayor"],
+    ["muertes por comuna", "cuál es la mayor", "cuántas son"],
+    ["¿Qué mes tuvo más muertes en 2025?", "y en el Biobío"],
+    ["cuántas muertes naturales hubo", "muertes por sexo"],
+]
+
+_PATRON_ETAPA = re.compile(r"([\w-]+);dur=([\d.]+)")
+
+
+def percentil(valores: list, p: float) -> float:
+    """Percentil por rango más cercano"""
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[max(0, math.ceil(p / 100 * len(ordenados)) - 1)]
+
+
+class Resultados:
+    def __init__(self):
+        self.latencias = {}     # endpoint -> [segundos]
+        self.errores = {}       # endpoint -> cantidad
+        self.etapas = {}        # etapa de /chat -> [milisegundos]
+
+    def registrar(self, endpoint: str, segundos: float, respuesta):
+        self.latencias.setdefault(endpoint, []).append(segundos)
+        if respuesta is None or respuesta.status_code >= 400:
+            self.errores[endpoint] = self.errores.get(endpoint, 0) + 1
+            return
+        if endpoint == "/chat":
+            for etapa, duracion in _PATRON_ETAPA.findall(respuesta.headers.get("server-timing", "")):
+                self.etapas.setdefault(etapa, []).append(float(duracion))
+
+    def reporte(self, segundos: float) -> dict:
+        endpoints = {}
+        for endpoint, latencias in sorted(self.latencias.items()):
+            endpoints[endpoint] = {
+                "solicitudes": len(latencias),
+                "errores": self.errores.get(endpoint, 0),
+                "rps": round(len(latencias) / segundos, 2),
+                "p50_ms": round(percentil(latencias, 50) * 1000, 2),
+                "p95_ms": round(percentil(latencias, 95) * 1000, 2),
+                "p99_ms": round(percentil(latencias, 99) * 1000, 2),
+            }
+        etapas = {
+            etapa: {"p50_ms": round(percentil(d, 50), 2), "p95_ms": round(percentil(d, 95), 2), "muestras": len(d)}
+            for etapa, d in sorted(self.etapas.items())
+        }
+        total = sum(len(l) for l in self.latencias.values())
+        return {"segundos": round(segundos, 2), "solicitudes": total, "rps": round(total / segundos, 2),
+                "endpoints": endpoints, "etapas_chat": etapas}
+
+
+async def medir(cliente, resultados: Resultados, endpoint: str, metodo: str, url: str, **kwargs):
+    inicio = time.perf_counter()
+    respuesta = None
+    try:
+        respuesta = await cliente.request(metodo, url, **kwargs)
+    except Exception as e:
+        print(f"⚠️ {metodo} {url}: {e}")
+    resultados.registrar(endpoint, time.perf_counter() - inicio, respuesta)
+    return respuesta
+
+
+async def obtener_token(cliente, n: int) -> str:
+    datos = {"username": f"bench_{n}", "email": f"bench_{n}@bench.local", "password": "bench123"}
+    await cliente.post("/register", json=datos)      # 400 si ya existe
+    respuesta = await cliente.post("/login", json={"username": datos["username"], "password": datos["password"]})
+    respuesta.raise_for_status()
+    return respuesta.json()["access_token"]
+
+
+async def trabajador(cliente, token: str, azar: random.Random, mezcla: list, pendientes: list, resultados: Resultados):
+    """Usuario virtual: conversa siguiendo un guion y a veces lista conversaciones o abre detalles"""
+    encabezados = {"Authorization": f"Bearer {token}"}
+    operaciones, pesos = zip(*mezcla)
+    conversacion, guion, turno = None, [], 0
+    while pendientes[0] > 0:
+        pendientes[0] -= 1
+        operacion = azar.choices(operaciones, pesos)[0]
+
+        if operacion == "details" and conversacion:
+            mensajes = await medir(cliente, resultados, "/conversations/{id}/messages", "GET",
+                                   f"/conversations/{conversacion}/messages", headers=encabezados)
+            ids = [m["id"] for m in mensajes.json().get("messages", [])] if mensajes is not None and mensajes.is_success else []
+            if ids:
+                await medir(cliente, resultados, "/chat/details", "GET", f"/chat/details/{azar.choice(ids)}",
+                            headers=encabezados)
+        elif operacion == "conversations":
+            await medir(cliente, resultados, "/conversations", "GET", "/conversations", headers=encabezados)
+        else:
+            if turno >= len(guion):
+                conversacion, guion, turno = None, azar.choice(CONVERSACIONES), 0
+            respuesta = await medir(cliente, resultados, "/chat", "POST", "/chat", headers=encabezados,
+                                    json={"message": guion[turno], "conversation_id": conversacion})
+            turno += 1
+            if respuesta is not None and respuesta.is_success:
+                conversacion = respuesta.json()["conversation_id"]
+
+
+async def ejecutar(args) -> dict:
+    import httpx
+    import main
+    from llm_falso import ClienteLLMFalso
+
+    main.client = ClienteLLMFalso(args.latencia_llm, args.variacion_llm, args.semilla)
+    aplicacion = main.app
+    await aplicacion.router.startup()
+    try:
+        transporte = httpx.ASGITransport(app=aplicacion)
+        async with httpx.AsyncClient(transport=transporte, base_url="http://bench", timeout=120) as cliente:
+            tokens = [await obtener_token(cliente, n) for n in range(args.usuarios)]
+            mezcla = [(nombre, float(peso)) for nombre, peso in (p.split("=") for p in args.mezcla.split(","))]
+            resultados = Resultados()
+            pendientes = [args.solicitudes]
+            inicio = time.perf_counter()
+            await asyncio.gather(*(
+                trabajador(cliente, tokens[i % len(tokens)], random.Random(args.semilla + i), mezcla, pendientes, resultados)
+                for i in range(args.concurrencia)
+            ))
+            reporte = resultados.reporte(time.perf_counter() - inicio)
+            reporte["llamadas_llm"] = main.client.messages.llamadas
+            return reporte
+    finally:
+        await aplicacion.router.shutdown()
+
+
+def imprimir(reporte: dict):
+    print(f"\n📊 {reporte['solicitudes']:,} solicitudes en {reporte['segundos']}s "
+          f"({reporte['rps']} req/s, {reporte['llamadas_llm']} llamadas al LLM falso)\n")
+    print(f"{'endpoint':<32}{'n':>7}{'err':>6}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for endpoint, d in reporte["endpoints"].items():
+        print(f"{endpoint:<32}{d['solicitudes']:>7}{d['errores']:>6}{d['rps']:>9}"
+              f"{d['p50_ms']:>10}{d['p95_ms']:>10}{d['p99_ms']:>10}")
+    if reporte["etapas_chat"]:
+        print(f"\n{'etapa de /chat':<32}{'n':>7}{'p50 ms':>10}{'p95 ms':>10}")
+        for etapa, d in reporte["etapas_chat"].items():
+            print(f"{etapa:<32}{d['muestras']:>7}{d['p50_ms']:>10}{d['p95_ms']:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrencia", type=int, default=16, help="usuarios virtuales simultáneos")
+    parser.add_argument("--solicitudes", type=int, default=1000, help="operaciones en total")
+    parser.add_argument("--usuarios", type=int, default=8, help="cuentas bench_N a crear/usar")
+    parser.add_argument("--latencia-llm", type=float, default=0.3, help="segundos por llamada al LLM falso")
+    parser.add_argument("--variacion-llm", type=float, default=0.05, help="± segundos aleatorios (con semilla)")
+    parser.add_argument("--mezcla", default="chat=6,conversations=2,details=2", help="pesos por operación")
+    parser.add_argument("--sembrar", type=int, default=0, help="sembrar N defunciones sintéticas antes de medir")
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--env", action="append", default=[], metavar="CLAVE=VALOR",
+                        help="variables de entorno para main (ej. INTENCIONES_ACTIVAS=0); repetible")
+    parser.add_argument("--json", help="guardar el reporte en este archivo")
+    args = parser.parse_args()
+
+    if not os.getenv("DB_HOST"):
+        sys.exit("❌ Definir DB_HOST (y DB_NAME, DB_USER, DB_PASSWORD) de la base de benchmark")
+    for asignacion in args.env:
+        clave, _, valor = asignacion.partition("=")
+        os.environ[clave] = valor
+    os.environ.setdefault("LOG_NIVEL", "WARNING")
+
+    if args.sembrar:
+        from datos_sinteticos import sembrar
+        if not sembrar(args.sembrar, args.semilla):
+            sys.exit(1)
+
+    reporte = asyncio.run(ejecutar(args))
+    imprimir(reporte)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as archivo:
+            json.dump(reporte, archivo, ensure_ascii=False, indent=2)
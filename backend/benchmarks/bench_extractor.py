@@ -0,0 +1,147 @@
+"""
+Micro-benchmark del extractor de slots: costo por pregunta de los bucles de subcadenas
+originales frente al extractor compilado (con y sin las comunas).
+
+    python benchmarks/bench_extractor.py            # comunas sintéticas (346)
+    python benchmarks/bench_extractor.py --bd       # comunas reales desde ubicaciones
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from slots import REGIONES_MAP, AÑOS, MESES_MAP, ExtractorSlots
+from contexto import ContextoConversacion, PALABRAS_CONTINUACION
+
+PREGUNTAS = [
+    "¿Cuántas defunciones hubo en Valparaíso en marzo de 2024?",
+    "cuantas muertes por cancer hubo en 2023 en mujeres",
+    "y en hombres?",
+    "¿Cuál es la principal causa de muerte en la región de O'Higgins?",
+    "muertes por enfermedades del corazón en el Biobío durante diciembre",
+    "lista de regiones con más defunciones",
+    "¿Qué mes tuvo más muertes en 2025?",
+    "cuántas personas fallecieron en Puente Alto",
+    "dame la cantidad total de defunciones",
+    "defunciones de mujeres por diabetes en la Araucanía en julio de 2024",
+]
+
+
+def extraer_slots_original(pregunta: str) -> dict:
+    """Implementación anterior (bucles de subcadenas), como referencia"""
+    pregunta_lower = pregunta.lower()
+    slots = {}
+    for key, region in REGIONES_MAP.items():
+        if key in pregunta_lower:
+            slots['region'] = region
+            break
+    for año in AÑOS:
+        if año in pregunta:
+            slots['año'] = año
+            break
+    for mes_nombre, mes_num in MESES_MAP.items():
+        if mes_nombre in pregunta_lower:
+            slots['mes'] = mes_nombre
+            slots['mes_num'] = mes_num
+            break
+    if 'hombre' in pregunta_lower or 'masculino' in pregunta_lower:
+        slots['sexo'] = 'Hombre'
+    elif 'mujer' in pregunta_lower or 'femenino' in pregunta_lower:
+        slots['sexo'] = 'Mujer'
+    if 'cáncer' in pregunta_lower or 'tumor' in pregunta_lower:
+        slots['causa'] = 'cáncer'
+    elif 'cardiovascular' in pregunta_lower or 'corazón' in pregunta_lower:
+        slots['causa'] = 'cardiovascular'
+    elif 'respiratorio' in pregunta_lower or 'pulmón' in pregunta_lower:
+        slots['causa'] = 'respiratorio'
+    elif 'diabetes' in pregunta_lower:
+        slots['causa'] = 'diabetes'
+    return slots
+
+
+def extraer_comunas_original(pregunta: str, comunas: list):
+    """Lo que costaría agregar las comunas con el mismo estilo de bucle"""
+    pregunta_lower = pregunta.lower()
+    for comuna in comunas:
+        if comuna.lower() in pregunta_lower:
+            return comuna
+    return None
+
+
+def continuacion_original(pregunta: str) -> bool:
+    pregunta_lower = pregunta.lower()
+    return any(palabra in pregunta_lower for palabra in PALABRAS_CONTINUACION)
+
+
+def comunas_sinteticas(cantidad: int = 346) -> list:
+    aleatorio = random.Random(42)
+    nombres = []
+    for _ in range(cantidad):
+        palabras = aleatorio.randint(1, 3)
+        nombres.append(" ".join(
+            "".join(aleatorio.choices(string.ascii_lowercase, k=aleatorio.randint(4, 9))).capitalize()
+            for _ in range(palabras)
+        ))
+    # Algunas reales para que las preguntas de ejemplo encuentren comuna
+    return nombres + ["Puente Alto", "La Florida", "Maipú", "Ñuñoa", "Los Ángeles"]
+
+
+def comunas_bd() -> list:
+    import psycopg2
+    from database import db_config
+    conn = psycopg2.connect(**db_config)
+    cur = conn.cursor()
+    cur.execute('SELECT DISTINCT "COMUNA" FROM ubicaciones WHERE "COMUNA" IS NOT NULL')
+    comunas = [fila[0] for fila in cur.fetchall()]
+    conn.close()
+    return comunas
+
+
+def medir(nombre: str, funcion, repeticiones: int):
+    total = min(timeit.repeat(lambda: [funcion(p) for p in PREGUNTAS], number=repeticiones, repeat=5))
+    por_pregunta = total / (repeticiones * len(PREGUNTAS)) * 1e6
+    print(f"  {nombre:<45} {por_pregunta:8.2f} µs/pregunta")
+    return por_pregunta
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bd", action="store_true", help="leer las comunas desde ubicaciones")
+    parser.add_argument("--repeticiones", type=int, default=2000)
+    args = parser.parse_args()
+
+    comunas = comunas_bd() if args.bd else comunas_sinteticas()
+    sin_comunas = ExtractorSlots()
+    con_comunas = ExtractorSlots(comunas)
+    contexto = ContextoConversacion()
+    print(f"📊 {len(PREGUNTAS)} preguntas, {len(comunas)} comunas ({'BD' if args.bd else 'sintéticas'})")
+
+    print("\nSlots (región, año, mes, sexo, causa):")
+    antes = medir("bucles originales", extraer_slots_original, args.repeticiones)
+    despues = medir("extractor compilado", sin_comunas.extraer, args.repeticiones)
+    print(f"  {'':<45} x{antes / despues:.2f}")
+
+    print("\nSlots + comunas:")
+    antes = medir("bucles originales + bucle de comunas",
+                  lambda p: (extraer_slots_original(p), extraer_comunas_original(p, comunas)), args.repeticiones)
+    despues = medir("extractor compilado con comunas", con_comunas.extraer, args.repeticiones)
+    print(f"  {'':<45} x{antes / despues:.2f}")
+
+    print("\nPregunta de continuación:")
+    antes = medir("bucle de frases original", continuacion_original, args.repeticiones)
+    despues = medir("patrón compilado", contexto.es_pregunta_continuacion, args.repeticiones)
+    print(f"  {'':<45} x{antes / despues:.2f}")
+
+    print("\nDiferencias de slots (original -> compilado):")
+    for pregunta in PREGUNTAS:
+        original, nuevo = extraer_slots_original(pregunta), sin_comunas.extraer(pregunta)
+        if original != nuevo:
+            print(f"  {pregunta!r}: {original} -> {nuevo}")
+
+
+if __name__ == "__main__":
+    main()
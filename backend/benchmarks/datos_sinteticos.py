@@ -0,0 +1,149 @@
+"""
+Dataset sintético con la forma de las tablas DEIS (defunciones_principales, ubicaciones, diagnosticos)
+para benchmarks sobre un PostgreSQL local. Reemplaza esas tablas: no usar contra la base real.
+
+    DB_HOST=localhost DB_NAME=bench python benchmarks/datos_sinteticos.py --filas 500000
+"""
+import argparse
+import os
+import random
+import sys
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+
+import database
+from slots import REGIONES_MAP
+
+COMUNAS_POR_REGION = 20
+AÑOS = (2023, 2024, 2025)
+LUGARES = ('Hospital o Clínica', 'Casa habitación', 'Otro')
+
+# Capítulos CIE-10 (letra, capítulo, descripción) y su peso aproximado en las defunciones
+CAPITULOS = [
+    ('C', 'II', 'Tumores [Neoplasias]', 26),
+    ('I', 'IX', 'Enfermedades del sistema circulatorio', 26),
+    ('J', 'X', 'Enfermedades del sistema respiratorio', 11),
+    ('K', 'XI', 'Enfermedades del sistema digestivo', 7),
+    ('E', 'IV', 'Enfermedades endocrinas, nutricionales y metabólicas', 6),
+    ('G', 'VI', 'Enfermedades del sistema nervioso', 6),
+    ('V', 'XX', 'Causas externas de morbilidad y de mortalidad', 6),
+    ('N', 'XIV', 'Enfermedades del sistema genitourinario', 4),
+    ('F', 'V', 'Trastornos mentales y del comportamiento', 4),
+    ('A', 'I', 'Ciertas enfermedades infecciosas y parasitarias', 4),
+]
+
+TABLAS = """
+DROP TABLE IF EXISTS defunciones_principales, ubicaciones, diagnosticos CASCADE;
+CREATE TABLE ubicaciones (
+    "COD_COMUNA" INTEGER PRIMARY KEY,
+    "COMUNA" VARCHAR(100) NOT NULL,
+    "NOMBRE_REGION" VARCHAR(100) NOT NULL
+);
+CREATE TABLE diagnosticos (
+    codigo_diagnostico VARCHAR(10) PRIMARY KEY,
+    capitulo VARCHAR(10),
+    descripcion_capitulo VARCHAR(200),
+    subcategoria VARCHAR(10),
+    descripcion_subcategoria VARCHAR(200)
+);
+CREATE TABLE defunciones_principales (
+    id SERIAL PRIMARY KEY,
+    "ANIO" INTEGER NOT NULL,
+    "FECHA_DEF" DATE,
+    "SEXO_NOMBRE" VARCHAR(20),
+    "EDAD_TIPO" INTEGER,
+    "EDAD_CANT" INTEGER,
+    "COD_COMUNA" INTEGER,
+    "DIAG1" VARCHAR(10),
+    "DIAG2" VARCHAR(10),
+    "LUGAR_DEFUNCION" VARCHAR(50)
+);
+"""
+
+INDICES = """
+CREATE INDEX idx_bench_defunciones_anio ON defunciones_principales ("ANIO");
+CREATE INDEX idx_bench_defunciones_comuna ON defunciones_principales ("COD_COMUNA");
+CREATE INDEX idx_bench_defunciones_diag1 ON defunciones_principales ("DIAG1");
+"""
+
+
+def generar_ubicaciones():
+    regiones = sorted(set(REGIONES_MAP.values()))
+    filas = []
+    for r, region in enumerate(regiones, start=1):
+        for c in range(COMUNAS_POR_REGION):
+            filas.append((r * 1000 + c, f"Comuna {r:02d}-{c:02d}", region))
+    return filas
+
+
+def generar_diagnosticos():
+    filas = []
+    for letra, capitulo, descripcion, _ in CAPITULOS:
+        for n in range(100):
+            codigo = f"{letra}{n:02d}{n % 10}"
+            filas.append((codigo, capitulo, descripcion, f"{letra}{n:02d}", f"Subcategoría {letra}{n:02d}"))
+    return filas
+
+
+def generar_defunciones(cantidad: int, comunas: list, azar: random.Random):
+    letras = [c[0] for c in CAPITULOS]
+    pesos = [c[3] for c in CAPITULOS]
+    for _ in range(cantidad):
+        anio = azar.choice(AÑOS)
+        fecha = date(anio, 1, 1) + timedelta(days=azar.randrange(365))
+        letra = azar.choices(letras, pesos)[0]
+        n = azar.randrange(100)
+        diag2 = f"X{azar.randrange(100):02d}0" if letra == 'V' else None
+        yield (
+            anio, fecha, azar.choice(('Hombre', 'Mujer')), 1, min(110, max(0, int(azar.gauss(74, 15)))),
+            azar.choice(comunas), f"{letra}{n:02d}{n % 10}", diag2, azar.choice(LUGARES)
+        )
+
+
+def sembrar(filas: int, semilla: int = 42, lote: int = 100_000):
+    """Crear y poblar las tablas DEIS sintéticas, con índices, versión del dataset y cubos"""
+    azar = random.Random(semilla)
+    conn = psycopg2.connect(**database.db_config)
+    cur = conn.cursor()
+    cur.execute(TABLAS)
+
+    # Tablas creadas en esta transacción: COPY con FREEZE
+    ubicaciones = generar_ubicaciones()
+    database.copiar_filas(cur, "ubicaciones", '"COD_COMUNA", "COMUNA", "NOMBRE_REGION"', ubicaciones, congelar=True)
+    database.copiar_filas(cur, "diagnosticos",
+                          "codigo_diagnostico, capitulo, descripcion_capitulo, subcategoria, descripcion_subcategoria",
+                          generar_diagnosticos(), congelar=True)
+
+    comunas = [u[0] for u in ubicaciones]
+    columnas = '"ANIO", "FECHA_DEF", "SEXO_NOMBRE", "EDAD_TIPO", "EDAD_CANT", "COD_COMUNA", "DIAG1", "DIAG2", "LUGAR_DEFUNCION"'
+    generador = generar_defunciones(filas, comunas, azar)
+    for inicio in range(0, filas, lote):
+        database.copiar_filas(cur, "defunciones_principales", columnas,
+                              (next(generador) for _ in range(min(lote, filas - inicio))), congelar=True)
+        print(f"   📥 {min(inicio + lote, filas):,} / {filas:,} defunciones")
+
+    cur.execute(INDICES)
+    cur.execute("ANALYZE defunciones_principales, ubicaciones, diagnosticos")
+    conn.commit()
+    cur.close()
+    conn.close()
+
+    # Tablas de la aplicación, versión del dataset (triggers) y cubos sobre los datos nuevos
+    return (database.crear_tablas_evaluacion3() and database.crear_version_dataset()
+            and database.crear_rollups() and database.crear_usuario_admin())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filas", type=int, default=300_000, help="defunciones a generar")
+    parser.add_argument("--semilla", type=int, default=42)
+    args = parser.parse_args()
+    if not os.getenv("DB_HOST"):
+        sys.exit("❌ Definir DB_HOST (y DB_NAME, DB_USER, DB_PASSWORD) de la base de benchmark: se reemplazan las tablas DEIS")
+    print(f"🧪 Sembrando {args.filas:,} defunciones sintéticas en {database.db_config['host']}/{database.db_config['database']}")
+    if not sembrar(args.filas, args.semilla):
+        sys.exit(1)
+    print("✅ Dataset sintético listo")
@@ -0,0 +1,116 @@
+"""
+Cliente LLM determinista para benchmarks: reemplaza a main.client (anthropic.AsyncAnthropic)
+sin gastar cuota. Devuelve SQL fijo según palabras de la pregunta y una respuesta corta
+construida con los resultados, con latencia configurable.
+"""
+import asyncio
+import random
+import re
+from types import SimpleNamespace
+
+# (palabras que deben aparecer en la pregunta, SQL); se usa la primera que calce
+RESPUESTAS_SQL = [
+    (("edad", "promedio"),
+     'SELECT ROUND(AVG("EDAD_CANT"), 1) AS edad_promedio FROM defunciones_principales WHERE "EDAD_TIPO" = 1'),
+    (("lugar",),
+     'SELECT "LUGAR_DEFUNCION", COUNT(*) AS total FROM defunciones_principales '
+     'GROUP BY "LUGAR_DEFUNCION" ORDER BY total DESC'),
+    (("naturales",),
+     'SELECT COUNT(*) AS total FROM defunciones_principales WHERE "DIAG2" IS NULL'),
+    (("comuna",),
+     'SELECT u."COMUNA", COUNT(*) AS total FROM defunciones_principales d '
+     'JOIN ubicaciones u ON d."COD_COMUNA" = u."COD_COMUNA" GROUP BY u."COMUNA" ORDER BY total DESC LIMIT 10'),
+    (("causa",),
+     'SELECT diag.descripcion_capitulo, COUNT(*) FROM defunciones_principales d '
+     'JOIN diagnosticos diag ON d."DIAG1" = diag.codigo_diagnostico '
+     'GROUP BY diag.descripcion_capitulo ORDER BY COUNT(*) DESC LIMIT 10'),
+    (("región",),
+     'SELECT u."NOMBRE_REGION", COUNT(*) FROM defunciones_principales d '
+     'JOIN ubicaciones u ON d."COD_COMUNA" = u."COD_COMUNA" GROUP BY u."NOMBRE_REGION" ORDER BY COUNT(*) DESC'),
+    (("año",),
+     'SELECT "ANIO", COUNT(*) FROM defunciones_principales GROUP BY "ANIO" ORDER BY "ANIO"'),
+    (("sexo",),
+     'SELECT "SEXO_NOMBRE", COUNT(*) FROM defunciones_principales GROUP BY "SEXO_NOMBRE"'),
+    (("muertes",),
+     'SELECT COUNT(*) AS total_defunciones FROM defunciones_principales'),
+]
+
+_PATRON_PREGUNTA_SQL = re.compile(r'Nueva pregunta: "(.*?)"', re.DOTALL)
+_PATRON_PREGUNTA_RESPUESTA = re.compile(r'Pregunta: "(.*?)"\s*Resultados SQL: (.*?)\n', re.DOTALL)
+
+
+def sql_para(pregunta: str) -> str:
+    pregunta = pregunta.lower()
+    for palabras, sql in RESPUESTAS_SQL:
+        if all(p in pregunta for p in palabras):
+            return sql
+    return "NO_SE_PUEDE_GENERAR"
+
+
+def responder(prompt: str) -> str:
+    """Texto que devolvería el LLM para el prompt (generación de SQL o respuesta final)"""
+    m = _PATRON_PREGUNTA_SQL.search(prompt)
+    if m:
+        return sql_para(m.group(1))
+    m = _PATRON_PREGUNTA_RESPUESTA.search(prompt)
+    if m:
+        return f"Resultado: {m.group(2)[:120]}"
+    return "Sin información"
+
+
+def _uso(prompt: str, texto: str):
+    # Aproximación de ~4 caracteres por token
+    return SimpleNamespace(input_tokens=len(prompt) // 4, output_tokens=max(1, len(texto) // 4))
+
+
+class _Stream:
+    def __init__(self, mensajes, prompt: str, texto: str):
+        self._mensajes = mensajes
+        self._prompt = prompt
+        self._texto = texto
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    @property
+    async def text_stream(self):
+        await self._mensajes.esperar()
+        for palabra in re.findall(r"\S+\s*", self._texto):
+            yield palabra
+
+    async def get_final_message(self):
+        return SimpleNamespace(content=[SimpleNamespace(text=self._texto)], usage=_uso(self._prompt, self._texto))
+
+
+class _Mensajes:
+    def __init__(self, latencia: float, variacion: float, semilla: int):
+        self.latencia = latencia
+        self.variacion = variacion
+        self._azar = random.Random(semilla)
+        self.llamadas = 0
+
+    async def esperar(self):
+        self.llamadas += 1
+        demora = self.latencia + self._azar.uniform(-self.variacion, self.variacion)
+        if demora > 0:
+            await asyncio.sleep(demora)
+
+    async def create(self, model: str, max_tokens: int, temperature: float, messages: list):
+        prompt = messages[-1]["content"]
+        texto = responder(prompt)
+        await self.esperar()
+        return SimpleNamespace(content=[SimpleNamespace(text=texto)], usage=_uso(prompt, texto))
+
+    def stream(self, model: str, max_tokens: int, temperature: float, messages: list):
+        prompt = messages[-1]["content"]
+        return _Stream(self, prompt, responder(prompt))
+
+
+class ClienteLLMFalso:
+    """Mismo uso que anthropic.AsyncAnthropic para messages.create y messages.stream"""
+
+    def __init__(self, latencia: float = 0.3, variacion: float = 0.0, semilla: int = 42):
+        self.messages = _Mensajes(latencia, variacion, semilla)
@@ -0,0 +1,245 @@
+"""
+Reproduce el corpus de conversaciones de referencia (corpus_conversaciones.json) por el mismo camino
+que /chat, sin BD ni LLM: seguimiento local, detección de slots y expansión en ContextoConversacion,
+plantillas de intención o LLM falso, y validación/canonización del SQL. Compara cada turno con lo
+esperado (expansión, regla, ruta, forma del SQL) y reporta latencia por turno, aciertos y llamadas
+al LLM evitadas.
+
+    python benchmarks/replay_corpus.py                         # reporte; código 1 si hay diferencias
+    python benchmarks/replay_corpus.py --repeticiones 200 --json reporte.json
+    python benchmarks/replay_corpus.py --actualizar            # regrabar lo esperado con el comportamiento actual
+
+Formato del corpus: {"comunas": [...], "conversaciones": [{"id", "descripcion", "turnos": [turno, ...]}]}
+Cada turno: {"pregunta", "expansion" (null si no se expande), "regla", "ruta" (local|plantilla|llm),
+"operacion" (solo ruta local), "sql": {"intencion", "tablas", "contiene": [...]} o null,
+"filas" (opcional: resultado simulado del turno, habilita seguimientos locales)}.
+"""
+import argparse
+import ast
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from analizador_sql import configurar_analizador
+from bench_chat import percentil
+from contexto import ContextoConversacion
+from formateador import responder_seguimiento
+from intenciones import MotorIntenciones
+from llm_falso import sql_para
+from reglas_expansion import cargar_reglas, configurar_reglas
+from slots import configurar_comunas, extraer_slots
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus_conversaciones.json")
+SEGUIMIENTO_MAX_FILAS = 100
+CAMPOS = ("expansion", "regla", "ruta", "operacion", "sql")
+
+
+def estructura_tabla() -> str:
+    """ESTRUCTURA_TABLA de main.py sin importar main (FastAPI, anthropic, pool de conexiones)"""
+    with open(os.path.join(BACKEND, "main.py"), encoding="utf-8") as archivo:
+        arbol = ast.parse(archivo.read())
+    for nodo in arbol.body:
+        if isinstance(nodo, ast.Assign) and any(getattr(d, "id", None) == "ESTRUCTURA_TABLA" for d in nodo.targets):
+            return ast.literal_eval(nodo.value)
+    raise RuntimeError("ESTRUCTURA_TABLA no encontrada en main.py")
+
+
+class Reproductor:
+    """Un turno por el mismo camino que /chat (seguimiento local, hilado y etapa SQL), sin BD ni LLM"""
+
+    def __init__(self, umbral: float):
+        self.motor_intenciones = MotorIntenciones(umbral=umbral)
+        self.analizador = configurar_analizador(estructura_tabla())
+
+    def turno(self, contexto: ContextoConversacion, turno: dict, es_nueva: bool) -> dict:
+        pregunta = turno["pregunta"]
+
+        # 1. Seguimiento con las filas de la respuesta anterior (como responder_con_resultado_anterior)
+        anterior = None if es_nueva or extraer_slots(pregunta) else contexto.resultado_anterior()
+        if anterior is not None:
+            completo = anterior.get('completo', False)
+            local = responder_seguimiento(anterior['resultado'], pregunta, completo)
+            if local is not None:
+                contexto.agregar_interaccion(pregunta, anterior['sql'], anterior['resultado'], completo)
+                return {"expansion": None, "regla": None, "ruta": "local", "operacion": local[0], "sql": None}
+
+        # 2. Contexto y expansión (como obtener_consulta_sql_con_hilado)
+        contexto.detectar_contexto_en_pregunta(pregunta)
+        expandida, regla = contexto.expandir_con_regla(pregunta)
+        intencion = self.motor_intenciones.resolver(expandida, original=pregunta)
+        if intencion is not None:
+            ruta, sql = "plantilla", intencion.sql
+        else:
+            ruta, sql = "llm", sql_para(expandida)
+        contexto.agregar_interaccion(pregunta, sql)
+
+        # 3. Etapa SQL: extracción, validación y forma canónica
+        forma = None
+        consulta = self.analizador.analizar(sql)
+        if consulta.valida:
+            forma = {"intencion": intencion.nombre if intencion else None, "tablas": sorted(consulta.tablas),
+                     "sql": consulta.sql}
+            if turno.get("filas") is not None:
+                contexto.registrar_resultado(sql, turno["filas"], SEGUIMIENTO_MAX_FILAS, consulta.limite)
+
+        return {
+            "expansion": expandida if expandida != pregunta else None,
+            "regla": regla,
+            "ruta": ruta,
+            "operacion": None,
+            "sql": forma,
+        }
+
+
+def comparar(esperado: dict, obtenido: dict) -> list:
+    """Campos del turno que no coinciden con lo esperado: [(campo, esperado, obtenido)]"""
+    diferencias = []
+    for campo in ("expansion", "regla", "ruta", "operacion"):
+        if esperado.get(campo) != obtenido[campo]:
+            diferencias.append((campo, esperado.get(campo), obtenido[campo]))
+
+    forma, sql = esperado.get("sql"), obtenido["sql"]
+    if forma is None:
+        return diferencias
+    if sql is None:
+        diferencias.append(("sql", forma, None))
+        return diferencias
+    if "intencion" in forma and forma["intencion"] != sql["intencion"]:
+        diferencias.append(("sql.intencion", forma["intencion"], sql["intencion"]))
+    if "tablas" in forma and sorted(forma["tablas"]) != sql["tablas"]:
+        diferencias.append(("sql.tablas", forma["tablas"], sql["tablas"]))
+    for fragmento in forma.get("contiene", ()):
+        if fragmento not in sql["sql"]:
+            diferencias.append(("sql.contiene", fragmento, sql["sql"]))
+    return diferencias
+
+
+def reproducir(corpus: dict, reproductor: Reproductor, repeticiones: int):
+    """Reproducir todas las conversaciones; retorna (resultados del último pase, latencias por turno en segundos)"""
+    latencias = []
+    resultados = []
+    for _ in range(repeticiones):
+        resultados = []
+        for conversacion in corpus["conversaciones"]:
+            contexto = ContextoConversacion()
+            obtenidos = []
+            for i, turno in enumerate(conversacion["turnos"]):
+                inicio = time.perf_counter()
+                obtenido = reproductor.turno(contexto, turno, es_nueva=(i == 0))
+                latencias.append(time.perf_counter() - inicio)
+                obtenidos.append(obtenido)
+            resultados.append((conversacion, obtenidos))
+    return resultados, latencias
+
+
+def revision_git() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "desconocida"
+
+
+def reporte(resultados: list, latencias: list) -> dict:
+    turnos = diferentes = 0
+    aciertos = {campo: 0 for campo in CAMPOS}
+    por_ruta = {}
+    fallas = []
+    for conversacion, obtenidos in resultados:
+        for i, (turno, obtenido) in enumerate(zip(conversacion["turnos"], obtenidos)):
+            turnos += 1
+            por_ruta[obtenido["ruta"]] = por_ruta.get(obtenido["ruta"], 0) + 1
+            diferencias = comparar(turno, obtenido)
+            campos_fallidos = {d[0].split(".")[0] for d in diferencias}
+            for campo in CAMPOS:
+                aciertos[campo] += campo not in campos_fallidos
+            if diferencias:
+                diferentes += 1
+                fallas.append({"conversacion": conversacion["id"], "turno": i, "pregunta": turno["pregunta"],
+                               "diferencias": [{"campo": c, "esperado": e, "obtenido": o} for c, e, o in diferencias]})
+
+    return {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "revision": revision_git(),
+        "conversaciones": len(resultados),
+        "turnos": turnos,
+        "turnos_correctos": turnos - diferentes,
+        "precision": {campo: round(valor / turnos, 4) if turnos else 0.0 for campo, valor in aciertos.items()},
+        "rutas": por_ruta,
+        "llm_evitadas": round(1 - por_ruta.get("llm", 0) / turnos, 4) if turnos else 0.0,
+        "latencia_turno_us": {
+            "p50": round(percentil(latencias, 50) * 1e6, 1),
+            "p95": round(percentil(latencias, 95) * 1e6, 1),
+            "p99": round(percentil(latencias, 99) * 1e6, 1),
+            "muestras": len(latencias),
+        },
+        "fallas": fallas,
+    }
+
+
+def actualizar(corpus: dict, resultados: list):
+    """Regrabar lo esperado de cada turno con lo obtenido (conservando los fragmentos 'contiene' que sigan presentes)"""
+    for conversacion, obtenidos in resultados:
+        for turno, obtenido in zip(conversacion["turnos"], obtenidos):
+            for campo in ("expansion", "regla", "ruta", "operacion"):
+                turno[campo] = obtenido[campo]
+            sql = obtenido["sql"]
+            # El SQL del LLM falso no dice nada del sistema: solo se fija la forma de las plantillas
+            if sql is None or obtenido["ruta"] == "llm":
+                turno["sql"] = None
+            else:
+                contiene = [f for f in (turno.get("sql") or {}).get("contiene", ()) if f in sql["sql"]]
+                turno["sql"] = {"intencion": sql["intencion"], "tablas": sql["tablas"], "contiene": contiene}
+
+
+def imprimir(datos: dict):
+    print(f"📚 {datos['conversaciones']} conversaciones, {datos['turnos']} turnos "
+          f"({datos['turnos_correctos']} correctos) - revisión {datos['revision']}")
+    print("   precisión: " + ", ".join(f"{c} {v:.1%}" for c, v in datos["precision"].items()))
+    print("   rutas: " + ", ".join(f"{r} {n}" for r, n in sorted(datos["rutas"].items()))
+          + f" - llamadas al LLM evitadas {datos['llm_evitadas']:.1%}")
+    lat = datos["latencia_turno_us"]
+    print(f"   latencia por turno: p50 {lat['p50']} µs, p95 {lat['p95']} µs, p99 {lat['p99']} µs ({lat['muestras']} muestras)")
+    for falla in datos["fallas"]:
+        print(f"❌ {falla['conversacion']}#{falla['turno']} '{falla['pregunta']}'")
+        for d in falla["diferencias"]:
+            print(f"      {d['campo']}: esperado {d['esperado']!r}, obtenido {d['obtenido']!r}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=CORPUS)
+    parser.add_argument("--repeticiones", type=int, default=50, help="pases completos para medir latencia")
+    parser.add_argument("--umbral", type=float, default=float(os.getenv("INTENCION_UMBRAL", "0.8")))
+    parser.add_argument("--reglas", help="reglas de expansión adicionales (JSON, como REGLAS_EXPANSION_ARCHIVO)")
+    parser.add_argument("--json", help="guardar el reporte en este archivo (para seguirlo en el tiempo)")
+    parser.add_argument("--actualizar", action="store_true", help="regrabar lo esperado en el corpus")
+    args = parser.parse_args()
+
+    with open(args.corpus, encoding="utf-8") as archivo:
+        corpus = json.load(archivo)
+    configurar_comunas(corpus.get("comunas", ()))
+    if args.reglas:
+        configurar_reglas(cargar_reglas(args.reglas))
+
+    resultados, latencias = reproducir(corpus, Reproductor(args.umbral), max(1, args.repeticiones))
+    if args.actualizar:
+        actualizar(corpus, resultados)
+        with open(args.corpus, "w", encoding="utf-8") as archivo:
+            json.dump(corpus, archivo, ensure_ascii=False, indent=2)
+            archivo.write("\n")
+        print(f"✍️ Corpus actualizado: {args.corpus}")
+
+    datos = reporte(resultados, latencias)
+    imprimir(datos)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as archivo:
+            json.dump(datos, archivo, ensure_ascii=False, indent=2)
+    sys.exit(1 if datos["fallas"] and not args.actualizar else 0)
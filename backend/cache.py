@@ -0,0 +1,121 @@
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+_SIN_VALOR = object()
+
+
+def normalizar_texto(texto: str) -> str:
+    """Minúsculas, sin tildes, sin signos de puntuación y con espacios colapsados"""
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r"[¿?¡!.,;:\"']", " ", texto)
+    return " ".join(texto.split())
+
+
+def hash_config(config: dict) -> str:
+    """Hash estable de una configuración de prompts"""
+    return hashlib.sha256(json.dumps(config or {}, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def tamano_aproximado(valor) -> int:
+    """Tamaño aproximado en bytes de un valor serializable"""
+    return len(json.dumps(valor, default=str).encode())
+
+
+def clave_cache(*partes) -> str:
+    """Construir una clave compacta a partir de varias partes de texto"""
+    return hashlib.sha256("\x1f".join(str(p) for p in partes).encode()).hexdigest()
+
+
+class CacheLRU:
+    """Cache en memoria con expulsión LRU y expiración por TTL, segura entre hilos.
+    Opcionalmente limitada por el total de bytes almacenados (max_bytes)."""
+
+    def __init__(self, nombre: str, max_entradas: int = 512, ttl: float = 3600.0, max_bytes: int = None):
+        self.nombre = nombre
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._datos = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+        self.expiraciones = 0
+        self.invalidaciones = 0
+
+    def obtener(self, clave, defecto=None):
+        """Obtener valor si existe y no expiró"""
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._datos.get(clave, _SIN_VALOR)
+            if entrada is _SIN_VALOR:
+                self.fallos += 1
+                return defecto
+            valor, expira, tamano = entrada
+            if expira < ahora:
+                del self._datos[clave]
+                self._bytes -= tamano
+                self.expiraciones += 1
+                self.fallos += 1
+                return defecto
+            self._datos.move_to_end(clave)
+            self.aciertos += 1
+            return valor
+
+    def guardar(self, clave, valor):
+        """Guardar valor, expulsando los menos usados si se excede la capacidad"""
+        tamano = tamano_aproximado(valor) if self.max_bytes else 0
+        if self.max_bytes and tamano > self.max_bytes:
+            return False
+        with self._lock:
+            anterior = self._datos.pop(clave, None)
+            if anterior is not None:
+                self._bytes -= anterior[2]
+            self._datos[clave] = (valor, time.monotonic() + self.ttl, tamano)
+            self._bytes += tamano
+            while len(self._datos) > self.max_entradas or (self.max_bytes and self._bytes > self.max_bytes):
+                _, (_, _, tamano_expulsado) = self._datos.popitem(last=False)
+                self._bytes -= tamano_expulsado
+                self.expulsiones += 1
+        return True
+
+    def eliminar(self, clave):
+        with self._lock:
+            entrada = self._datos.pop(clave, None)
+            if entrada is not None:
+                self._bytes -= entrada[2]
+
+    def invalidar(self):
+        """Vaciar completamente la cache"""
+        with self._lock:
+            self._datos.clear()
+            self._bytes = 0
+            self.invalidaciones += 1
+
+    def __len__(self):
+        return len(self._datos)
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                "nombre": self.nombre,
+                "entradas": len(self._datos),
+                "max_entradas": self.max_entradas,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_segundos": self.ttl,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "tasa_aciertos": round(self.aciertos / consultas, 4) if consultas else 0.0,
+                "expulsiones": self.expulsiones,
+                "expiraciones": self.expiraciones,
+                "invalidaciones": self.invalidaciones
+            }
@@ -0,0 +1,56 @@
+import asyncio
+
+
+class Coalescedor:
+    """
+    Single-flight: si ya hay una ejecución en curso para la misma clave,
+    los llamadores concurrentes esperan ese resultado en vez de repetir el trabajo
+    """
+
+    def __init__(self, nombre: str):
+        self.nombre = nombre
+        self._en_vuelo = {}
+        self.ejecutadas = 0
+        self.coalescidas = 0
+
+    async def ejecutar(self, clave, fabrica, copiar=None):
+        """
+        Ejecutar `await fabrica()` una sola vez por clave en vuelo.
+        `copiar` se aplica al resultado entregado a quienes esperaban, para que no compartan objetos mutables.
+        La fábrica corre en su propia tarea: si se cancela quien la inició, los demás siguen esperándola.
+        """
+        tarea = self._en_vuelo.get(clave)
+        if tarea is not None:
+            self.coalescidas += 1
+            _, compartido = await asyncio.shield(tarea)
+            return copiar(compartido) if copiar else compartido
+
+        tarea = asyncio.ensure_future(self._producir(fabrica, copiar))
+        self._en_vuelo[clave] = tarea
+        tarea.add_done_callback(lambda t: self._terminar(clave, t))
+        self.ejecutadas += 1
+        resultado, _ = await asyncio.shield(tarea)
+        return resultado
+
+    @staticmethod
+    async def _producir(fabrica, copiar):
+        """(resultado para quien inició, copia para quienes esperaban)"""
+        resultado = await fabrica()
+        return resultado, (copiar(resultado) if copiar else resultado)
+
+    def _terminar(self, clave, tarea):
+        if self._en_vuelo.get(clave) is tarea:
+            del self._en_vuelo[clave]
+        # Evitar el aviso "exception was never retrieved" si nadie esperaba
+        if not tarea.cancelled():
+            tarea.exception()
+
+    def estadisticas(self) -> dict:
+        total = self.ejecutadas + self.coalescidas
+        return {
+            "nombre": self.nombre,
+            "ejecutadas": self.ejecutadas,
+            "coalescidas": self.coalescidas,
+            "en_vuelo": len(self._en_vuelo),
+            "tasa_coalescencia": round(self.coalescidas / total, 4) if total else 0.0
+        }
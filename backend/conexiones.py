@@ -0,0 +1,221 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Optional
+
+import psycopg2
+import psycopg2.extensions
+
+from metricas import Histograma
+
+
+class PoolAgotadoError(psycopg2.OperationalError):
+    """No se obtuvo una conexión del pool dentro del tiempo de espera"""
+
+
+class PoolConexiones:
+    """Pool de conexiones PostgreSQL compartido por todo el proceso"""
+
+    def __init__(self, db_config: dict, minimo: int = 2, maximo: int = 10,
+                 timeout_adquirir: float = 5.0, chequeo_inactividad: float = 30.0):
+        if minimo < 0 or maximo < 1 or minimo > maximo:
+            raise ValueError("Tamaño de pool inválido")
+
+        self.db_config = db_config
+        self.minimo = minimo
+        self.maximo = maximo
+        self.timeout_adquirir = timeout_adquirir
+        self.chequeo_inactividad = chequeo_inactividad
+
+        # Conexiones libres como (conexion, momento de devolución)
+        self._libres = deque()
+        self._total = 0
+        self._en_uso = 0
+        self._esperando = 0
+        self._cerrado = False
+        self._condicion = threading.Condition()
+
+        # Métricas
+        self.histograma_espera = Histograma()
+        self._adquisiciones = 0
+        self._timeouts = 0
+        self._descartadas = 0
+        self._creadas = 0
+
+    def _crear_conexion(self):
+        conn = psycopg2.connect(**self.db_config)
+        with self._condicion:
+            self._creadas += 1
+        return conn
+
+    def _esta_sana(self, conn, ultimo_uso: float) -> bool:
+        """Verificar conexión inactiva antes de entregarla"""
+        if conn.closed:
+            return False
+        if time.monotonic() - ultimo_uso < self.chequeo_inactividad:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.fetchone()
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _descartar(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self._condicion:
+            self._total -= 1
+            self._descartadas += 1
+            self._condicion.notify()
+
+    def abrir(self):
+        """Crear las conexiones mínimas del pool"""
+        while True:
+            with self._condicion:
+                if self._cerrado or self._total >= self.minimo:
+                    return
+                self._total += 1
+            try:
+                conn = self._crear_conexion()
+            except psycopg2.Error:
+                with self._condicion:
+                    self._total -= 1
+                    self._condicion.notify()
+                raise
+            with self._condicion:
+                self._libres.append((conn, time.monotonic()))
+                self._condicion.notify()
+
+    def adquirir(self, timeout: Optional[float] = None):
+        """Obtener una conexión del pool, esperando hasta el timeout"""
+        timeout = self.timeout_adquirir if timeout is None else timeout
+        inicio = time.monotonic()
+        limite = inicio + timeout
+
+        while True:
+            crear = False
+            with self._condicion:
+                if self._cerrado:
+                    raise PoolAgotadoError("El pool de conexiones está cerrado")
+
+                while not self._libres and self._total >= self.maximo:
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        self._timeouts += 1
+                        raise PoolAgotadoError(
+                            f"Sin conexiones disponibles tras {timeout:.1f}s "
+                            f"(máximo {self.maximo})"
+                        )
+                    self._esperando += 1
+                    try:
+                        self._condicion.wait(restante)
+                    finally:
+                        self._esperando -= 1
+
+                if self._libres:
+                    conn, ultimo_uso = self._libres.pop()
+                else:
+                    conn, ultimo_uso = None, None
+                    self._total += 1
+                    crear = True
+
+            if crear:
+                try:
+                    conn = self._crear_conexion()
+                except psycopg2.Error:
+                    with self._condicion:
+                        self._total -= 1
+                        self._condicion.notify()
+                    raise
+            elif not self._esta_sana(conn, ultimo_uso):
+                self._descartar(conn)
+                continue
+
+            with self._condicion:
+                self._en_uso += 1
+                self._adquisiciones += 1
+            self.histograma_espera.observar(time.monotonic() - inicio)
+            return conn
+
+    def liberar(self, conn, descartar: bool = False):
+        """Devolver una conexión al pool"""
+        with self._condicion:
+            self._en_uso -= 1
+
+        if descartar or conn.closed or self._cerrado:
+            self._descartar(conn)
+            return
+
+        try:
+            # No devolver conexiones con transacciones abiertas
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.Error:
+            self._descartar(conn)
+            return
+
+        with self._condicion:
+            self._libres.append((conn, time.monotonic()))
+            self._condicion.notify()
+
+    @contextmanager
+    def conexion(self, timeout: Optional[float] = None):
+        """Context manager: adquirir conexión y devolverla al terminar"""
+        conn = self.adquirir(timeout)
+        descartar = False
+        try:
+            yield conn
+        except psycopg2.InterfaceError:
+            descartar = True
+            raise
+        except BaseException:
+            try:
+                if not conn.closed:
+                    conn.rollback()
+            except psycopg2.Error:
+                descartar = True
+            raise
+        finally:
+            self.liberar(conn, descartar=descartar)
+
+    def cerrar(self):
+        """Cerrar todas las conexiones libres y rechazar nuevas adquisiciones"""
+        with self._condicion:
+            self._cerrado = True
+            libres = list(self._libres)
+            self._libres.clear()
+            self._condicion.notify_all()
+        for conn, _ in libres:
+            self._descartar(conn)
+
+    def holgura(self) -> int:
+        """Conexiones que aún se pueden entregar sin hacer esperar a nadie"""
+        with self._condicion:
+            if self._esperando:
+                return 0
+            return self.maximo - self._en_uso
+
+    def estadisticas(self) -> dict:
+        """Métricas actuales del pool"""
+        with self._condicion:
+            datos = {
+                "minimo": self.minimo,
+                "maximo": self.maximo,
+                "total": self._total,
+                "libres": len(self._libres),
+                "en_uso": self._en_uso,
+                "esperando": self._esperando,
+                "adquisiciones": self._adquisiciones,
+                "timeouts": self._timeouts,
+                "conexiones_creadas": self._creadas,
+                "conexiones_descartadas": self._descartadas
+            }
+        datos["tiempo_espera"] = self.histograma_espera.resumen()
+        return datos
@@ -0,0 +1,104 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass
+
+from cache import hash_config
+
+log = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ConfiguracionPrompt:
+    """Configuración de prompts activa, ya procesada para el pipeline de chat"""
+    datos: dict
+    version: int                        # Se incrementa en cada cambio detectado (local al worker)
+    huella: str                         # hash_config(datos), parte de la clave de cache_sql
+    sufijo_prompt: str                  # Bloques RESTRICCIONES / INSTRUCCIONES precompilados
+    max_tokens: int
+    temperature: float
+
+
+def compilar_configuracion(datos: dict, version: int) -> ConfiguracionPrompt:
+    """Precalcular lo que antes se armaba en cada request"""
+    if not isinstance(datos, dict):
+        datos = {}
+
+    sufijo = ""
+    if datos.get('restricciones'):
+        sufijo += "\n\nRESTRICCIONES ADICIONALES:\n" + "\n".join([f"- {r}" for r in datos['restricciones']])
+    if datos.get('instrucciones_adicionales'):
+        sufijo += f"\n\nINSTRUCCIONES ESPECIALES: {datos['instrucciones_adicionales']}"
+
+    return ConfiguracionPrompt(
+        datos=datos,
+        version=version,
+        huella=hash_config(datos),
+        sufijo_prompt=sufijo,
+        max_tokens=datos.get('max_tokens', 1000),
+        temperature=datos.get('temperature', 0)
+    )
+
+
+class CacheConfiguracion:
+    """
+    Configuración de prompts en memoria. Se refresca al recibir NOTIFY y,
+    como respaldo, cuando pasan `intervalo` segundos desde la última lectura.
+    """
+
+    def __init__(self, cargar, intervalo: float = 300.0, al_cambiar=None):
+        # cargar() -> dict: lee la configuración activa desde la BD
+        self._cargar = cargar
+        self.intervalo = intervalo
+        self._al_cambiar = al_cambiar
+        self._lock = threading.Lock()
+        self._actual = compilar_configuracion({}, 0)
+        self._revisado = float('-inf')
+        self.lecturas = 0
+        self.cambios = 0
+        self.errores = 0
+
+    def actual(self) -> ConfiguracionPrompt:
+        return self._actual
+
+    def vencida(self) -> bool:
+        return time.monotonic() - self._revisado >= self.intervalo
+
+    def refrescar(self, forzar: bool = True) -> ConfiguracionPrompt:
+        """Leer la configuración desde la BD y reemplazarla si cambió"""
+        with self._lock:
+            # Otro hilo pudo haberla refrescado mientras esperábamos
+            if not forzar and not self.vencida():
+                return self._actual
+            try:
+                datos = self._cargar()
+            except Exception as e:
+                self.errores += 1
+                log.warning("⚠️ No se pudo leer la configuración de prompts: %s", e)
+                return self._actual
+            finally:
+                self.lecturas += 1
+                self._revisado = time.monotonic()
+
+            anterior = self._actual
+            nueva = compilar_configuracion(datos, anterior.version + 1)
+            if nueva.huella == anterior.huella and anterior.version > 0:
+                return anterior
+
+            self._actual = nueva
+            if anterior.version > 0:
+                self.cambios += 1
+                log.info("⚙️ Configuración de prompts actualizada (versión %s)", nueva.version)
+                if self._al_cambiar:
+                    self._al_cambiar()
+            return nueva
+
+    def estadisticas(self) -> dict:
+        return {
+            "version": self._actual.version,
+            "huella": self._actual.huella,
+            "intervalo": self.intervalo,
+            "lecturas": self.lecturas,
+            "cambios": self.cambios,
+            "errores": self.errores
+        }
@@ -0,0 +1,478 @@
+import logging
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Optional
+
+from backends_contexto import ConflictoVersion
+from slots import extraer_slots, normalizar_slots, patron_trie
+from reglas_expansion import motor_activo
+
+log = logging.getLogger(__name__)
+
+# Frases que indican una pregunta de continuación (subcadenas, sin importar tildes)
+PALABRAS_CONTINUACION = [
+    'cuál es la más común', 'cuál es la principal', 'y en hombres', 'y en mujeres',
+    'también', 'además', 'y en', 'qué tal en', 'y por', 'y el', 'y la',
+    'más común', 'principal', 'primero', 'mayor', 'menor',
+    'puedes darme', 'dame la', 'lista', 'listado', 'cuáles son', 'muéstrame',
+    'cuántos son', 'cuántas son', 'puedes contarlas', 'contarlos', 'en total',
+    'suma', 'sumar', 'total', 'coincide', 'da el conjunto'
+]
+PATRON_CONTINUACION = re.compile(patron_trie(normalizar_slots(p) for p in PALABRAS_CONTINUACION))
+
+def _valor_a_json(valor):
+    """Valores de filas SQL serializables a JSON sin perder el tipo (Decimal, fechas)"""
+    if valor is None or isinstance(valor, (str, int, float, bool)):
+        return valor
+    if isinstance(valor, Decimal):
+        return {'$decimal': str(valor)}
+    if isinstance(valor, datetime):
+        return {'$datetime': valor.isoformat()}
+    if isinstance(valor, date):
+        return {'$date': valor.isoformat()}
+    return str(valor)
+
+
+def _valor_desde_json(valor):
+    if isinstance(valor, dict) and len(valor) == 1:
+        (tipo, texto), = valor.items()
+        if tipo == '$decimal':
+            return Decimal(texto)
+        if tipo == '$datetime':
+            return datetime.fromisoformat(texto)
+        if tipo == '$date':
+            return date.fromisoformat(texto)
+    return valor
+
+
+def _item_a_json(item: dict) -> dict:
+    datos = dict(item, timestamp=item['timestamp'].isoformat())
+    if 'resultado' in item:
+        datos['resultado'] = [{k: _valor_a_json(v) for k, v in fila.items()} for fila in item['resultado']]
+    return datos
+
+
+def _item_desde_json(datos: dict) -> dict:
+    item = dict(datos, timestamp=datetime.fromisoformat(datos['timestamp']))
+    if 'resultado' in datos:
+        item['resultado'] = [{k: _valor_desde_json(v) for k, v in fila.items()} for fila in datos['resultado']]
+    return item
+
+
+class ContextoConversacion:
+    # __slots__: sin __dict__ por instancia (puede haber miles de contextos en memoria)
+    __slots__ = ('sesion_actual', 'historial_sesion', 'id_sesion', 'ultimo_acceso', 'version', 'verificado')
+    
+    def __init__(self):
+        self.sesion_actual = {
+            'ultima_region': None,
+            'ultima_comuna': None,
+            'ultimo_año': None,
+            'ultimo_mes': None,
+            'ultimo_mes_num': None,
+            'ultimo_sexo': None,
+            'ultima_causa': None,
+            'ultimo_tema': None
+        }
+        self.historial_sesion = []
+        self.id_sesion = str(uuid.uuid4())[:8]
+        self.ultimo_acceso = time.monotonic()
+        # Versión en el backend compartido (0 = nunca guardado) y cuándo se validó contra él
+        self.version = 0
+        self.verificado = float('-inf')
+    
+    def detectar_contexto_en_pregunta(self, pregunta):
+        """Detectar y extraer contexto de la pregunta actual"""
+        slots = extraer_slots(pregunta)
+        
+        if 'region' in slots:
+            self.sesion_actual['ultima_region'] = slots['region']
+        if 'comuna' in slots:
+            self.sesion_actual['ultima_comuna'] = slots['comuna']
+        if 'año' in slots:
+            self.sesion_actual['ultimo_año'] = slots['año']
+        if 'mes' in slots:
+            self.sesion_actual['ultimo_mes'] = slots['mes']
+            self.sesion_actual['ultimo_mes_num'] = slots['mes_num']
+        if 'sexo' in slots:
+            self.sesion_actual['ultimo_sexo'] = slots['sexo']
+        if 'causa' in slots:
+            self.sesion_actual['ultima_causa'] = slots['causa']
+        
+        return slots
+    
+    def es_pregunta_continuacion(self, pregunta):
+        """Detectar si es una pregunta de continuación"""
+        return PATRON_CONTINUACION.search(pregunta.lower()) is not None
+    
+    def expandir_pregunta_continuacion(self, pregunta):
+        """Expandir preguntas de continuación usando el contexto (reglas en reglas_expansion.py)"""
+        return self.expandir_con_regla(pregunta)[0]
+    
+    def expandir_con_regla(self, pregunta):
+        """Expandir y retornar también la regla aplicada (None si ninguna)"""
+        expansion, regla = motor_activo().expandir(pregunta, self.sesion_actual, self.historial_sesion)
+        if regla is not None:
+            log.debug("🧠 Regla '%s': '%s' → '%s'", regla, pregunta, expansion)
+        return expansion, regla
+    
+    def construir_contexto_para_prompt(self):
+        """Construir información de contexto para el prompt"""
+        contexto_partes = []
+        
+        if self.sesion_actual['ultima_region']:
+            contexto_partes.append(f"Región en contexto: {self.sesion_actual['ultima_region']}")
+        
+        if self.sesion_actual['ultima_comuna']:
+            contexto_partes.append(f"Comuna en contexto: {self.sesion_actual['ultima_comuna']}")
+        
+        if self.sesion_actual['ultimo_año']:
+            contexto_partes.append(f"Año en contexto: {self.sesion_actual['ultimo_año']}")
+        
+        if self.sesion_actual['ultimo_mes']:
+            contexto_partes.append(f"Mes en contexto: {self.sesion_actual['ultimo_mes']}")
+        
+        if self.sesion_actual['ultimo_sexo']:
+            contexto_partes.append(f"Sexo en contexto: {self.sesion_actual['ultimo_sexo']}")
+        
+        if self.sesion_actual['ultima_causa']:
+            contexto_partes.append(f"Causa en contexto: {self.sesion_actual['ultima_causa']}")
+        
+        # Últimas 3 preguntas para referencia
+        if self.historial_sesion:
+            contexto_partes.append("\nÚltimas preguntas:")
+            for item in self.historial_sesion[-3:]:
+                contexto_partes.append(f"- {item['pregunta']}")
+        
+        return "\n".join(contexto_partes) if contexto_partes else "Sin contexto previo"
+    
+    def agregar_interaccion(self, pregunta, sql_generado, resultado=None, completo=False):
+        """Registrar nueva interacción (`completo`: las filas de `resultado` no quedaron recortadas por el LIMIT)"""
+        self._descartar_resultados()
+        item = {
+            'pregunta': pregunta,
+            'sql': sql_generado,
+            'timestamp': datetime.now()
+        }
+        if resultado is not None:
+            item['resultado'] = resultado
+            item['completo'] = completo
+        self.historial_sesion.append(item)
+        
+        # Mantener solo últimas 10 interacciones
+        if len(self.historial_sesion) > 10:
+            self.historial_sesion = self.historial_sesion[-10:]
+    
+    def _descartar_resultados(self):
+        """Solo la última interacción conserva sus filas (acota memoria y tamaño del snapshot)"""
+        for item in self.historial_sesion:
+            item.pop('resultado', None)
+            item.pop('completo', None)
+    
+    def registrar_resultado(self, sql, resultado, max_filas: int, limite: Optional[int] = None) -> bool:
+        """
+        Guardar una copia de las filas de la última interacción (si es la de este SQL y no excede max_filas).
+        `limite` es el LIMIT con que se ejecutó: si las filas lo alcanzan, el resultado puede estar recortado
+        """
+        if not self.historial_sesion or self.historial_sesion[-1]['sql'] != sql:
+            return False
+        if not isinstance(resultado, list) or not resultado or len(resultado) > max_filas:
+            return False
+        self.historial_sesion[-1]['resultado'] = [dict(fila) for fila in resultado]
+        self.historial_sesion[-1]['completo'] = limite is not None and len(resultado) < limite
+        return True
+    
+    def resultado_anterior(self) -> Optional[dict]:
+        """Última interacción si conserva sus filas (para responder seguimientos sin volver a consultar)"""
+        if self.historial_sesion and 'resultado' in self.historial_sesion[-1]:
+            return self.historial_sesion[-1]
+        return None
+    
+    def reiniciar_sesion(self):
+        """Limpiar contexto para nueva conversación"""
+        self.sesion_actual = {
+            'ultima_region': None,
+            'ultima_comuna': None,
+            'ultimo_año': None,
+            'ultimo_mes': None,
+            'ultimo_mes_num': None,
+            'ultimo_sexo': None,
+            'ultima_causa': None,
+            'ultimo_tema': None
+        }
+        self.historial_sesion = []
+        self.id_sesion = str(uuid.uuid4())[:8]
+    
+    def a_dict(self) -> dict:
+        """Serializar a JSON (para los backends compartidos)"""
+        return {
+            'sesion_actual': self.sesion_actual,
+            'historial_sesion': [_item_a_json(item) for item in self.historial_sesion],
+            'id_sesion': self.id_sesion
+        }
+    
+    @classmethod
+    def desde_dict(cls, datos: dict) -> 'ContextoConversacion':
+        contexto = cls()
+        contexto.sesion_actual.update(datos.get('sesion_actual', {}))
+        contexto.historial_sesion = [_item_desde_json(item) for item in datos.get('historial_sesion', [])]
+        contexto.id_sesion = datos.get('id_sesion', contexto.id_sesion)
+        return contexto
+    
+    def fusionar(self, remoto: 'ContextoConversacion'):
+        """
+        Combinar con la versión que guardó otro worker en paralelo: historial unido por fecha
+        y, en la sesión, los valores propios sobre los remotos. Si una de las dos se reinició, gana la propia.
+        """
+        if remoto.id_sesion != self.id_sesion:
+            return
+        # Misma interacción en ambas: se prefiere la copia que ya tiene sus filas registradas
+        por_clave = {(item['pregunta'], item['timestamp']): item for item in remoto.historial_sesion}
+        for item in self.historial_sesion:
+            clave = (item['pregunta'], item['timestamp'])
+            if 'resultado' in item or 'resultado' not in por_clave.get(clave, {}):
+                por_clave[clave] = item
+        historial = sorted(por_clave.values(), key=lambda item: item['timestamp'])[-10:]
+        ultimo = historial[-1] if historial else None
+        self.historial_sesion = [
+            item if item is ultimo or 'resultado' not in item
+            else {k: v for k, v in item.items() if k not in ('resultado', 'completo')}
+            for item in historial
+        ]
+        
+        sesion = dict(remoto.sesion_actual)
+        sesion.update({k: v for k, v in self.sesion_actual.items() if v is not None})
+        self.sesion_actual = sesion
+    
+    def get_estado(self):
+        """Obtener estado actual del contexto"""
+        return {
+            'id_sesion': self.id_sesion,
+            'contexto_activo': {k: v for k, v in self.sesion_actual.items() if v is not None},
+            'interacciones': len(self.historial_sesion)
+        }
+
+
+def tamano_objeto(objeto, vistos=None) -> int:
+    """Tamaño aproximado en bytes de un objeto y lo que contiene (dict, list, __slots__)"""
+    if vistos is None:
+        vistos = set()
+    if id(objeto) in vistos:
+        return 0
+    vistos.add(id(objeto))
+    tamano = sys.getsizeof(objeto)
+    if isinstance(objeto, dict):
+        tamano += sum(tamano_objeto(k, vistos) + tamano_objeto(v, vistos) for k, v in objeto.items())
+    elif isinstance(objeto, (list, tuple)):
+        tamano += sum(tamano_objeto(v, vistos) for v in objeto)
+    elif hasattr(objeto, '__slots__'):
+        tamano += sum(tamano_objeto(getattr(objeto, s), vistos) for s in objeto.__slots__ if hasattr(objeto, s))
+    return tamano
+
+
+class AlmacenContextos:
+    """
+    Contextos de conversación con capacidad máxima (LRU) y expiración por inactividad.
+    El orden LRU coincide con el orden de último acceso, así que los inactivos están siempre al inicio.
+    """
+
+    def __init__(self, max_contextos: int = 10000, ttl_inactividad: float = 7200.0, muestra_memoria: int = 500,
+                 backend=None, frescura: float = 0.0, rehidratar=None):
+        self.max_contextos = max_contextos
+        self.ttl_inactividad = ttl_inactividad
+        self.muestra_memoria = muestra_memoria
+        # Con backend (ver backends_contexto.py) los contextos en memoria son una cache de lectura:
+        # se revalidan contra el backend si pasaron más de `frescura` segundos
+        self.backend = backend
+        self.frescura = frescura
+        # rehidratar(clave) -> contexto reconstruido desde la BD (o None) cuando no está en memoria ni en el backend
+        self.rehidratar = rehidratar
+        self._contextos = OrderedDict()
+        self._lock = threading.Lock()
+        self.creados = 0
+        self.expulsados = 0
+        self.expirados = 0
+        self.lecturas_backend = 0
+        self.vigentes_backend = 0
+        self.escrituras_backend = 0
+        self.conflictos = 0
+        self.errores_backend = 0
+        self.rehidratados = 0
+
+    def _purgar(self, ahora: float):
+        """Descartar inactivos (al inicio) y los menos usados si se excede la capacidad"""
+        while self._contextos:
+            contexto = next(iter(self._contextos.values()))
+            if ahora - contexto.ultimo_acceso < self.ttl_inactividad:
+                break
+            self._contextos.popitem(last=False)
+            self.expirados += 1
+        while len(self._contextos) > self.max_contextos:
+            self._contextos.popitem(last=False)
+            self.expulsados += 1
+
+    def _crear(self, clave, nuevo: bool) -> ContextoConversacion:
+        """Contexto para una clave sin copia vigente: rehidratado si existe historial, si no vacío"""
+        self.creados += 1
+        if not nuevo and self.rehidratar is not None:
+            try:
+                contexto = self.rehidratar(clave)
+            except Exception as e:
+                contexto = None
+                log.warning("⚠️ Error rehidratando contexto %s: %s", clave, e)
+            if contexto is not None:
+                self.rehidratados += 1
+                return contexto
+        return ContextoConversacion()
+
+    def en_memoria(self, clave) -> bool:
+        """Si hay copia local vigente (obtener no hará E/S en modo memoria)"""
+        with self._lock:
+            contexto = self._contextos.get(clave)
+            return contexto is not None and time.monotonic() - contexto.ultimo_acceso < self.ttl_inactividad
+
+    def obtener(self, clave, nuevo: bool = False) -> ContextoConversacion:
+        """Obtener o crear el contexto de la clave (`nuevo`: se sabe que no hay historial que rehidratar)"""
+        if self.backend is not None:
+            return self._obtener_compartido(clave, crear=True, nuevo=nuevo)
+        ahora = time.monotonic()
+        with self._lock:
+            contexto = self._contextos.get(clave)
+            if contexto is not None and ahora - contexto.ultimo_acceso < self.ttl_inactividad:
+                contexto.ultimo_acceso = ahora
+                self._contextos.move_to_end(clave)
+                return contexto
+            if contexto is not None:
+                self.expirados += 1
+        
+        # La rehidratación consulta la BD: fuera del lock
+        contexto = self._crear(clave, nuevo)
+        with self._lock:
+            otro = self._contextos.get(clave)
+            if otro is not None and ahora - otro.ultimo_acceso < self.ttl_inactividad:
+                contexto = otro
+            contexto.ultimo_acceso = ahora
+            self._contextos[clave] = contexto
+            self._contextos.move_to_end(clave)
+            self._purgar(ahora)
+            return contexto
+
+    def existente(self, clave) -> Optional[ContextoConversacion]:
+        """Contexto vigente de la clave, sin crearlo ni cambiar su posición LRU"""
+        if self.backend is not None:
+            return self._obtener_compartido(clave, crear=False)
+        with self._lock:
+            contexto = self._contextos.get(clave)
+            if contexto is None or time.monotonic() - contexto.ultimo_acceso >= self.ttl_inactividad:
+                return None
+            return contexto
+
+    def _obtener_compartido(self, clave, crear: bool, nuevo: bool = False) -> Optional[ContextoConversacion]:
+        """Lectura a través de la cache local: solo se transfiere el contexto si cambió su versión"""
+        ahora = time.monotonic()
+        with self._lock:
+            contexto = self._contextos.get(clave)
+            if contexto is not None and ahora - contexto.ultimo_acceso >= self.ttl_inactividad:
+                contexto = None
+            if contexto is not None and ahora - contexto.verificado < self.frescura:
+                contexto.ultimo_acceso = ahora
+                self._contextos.move_to_end(clave)
+                return contexto
+        
+        try:
+            leido = self.backend.leer(str(clave), contexto.version if contexto else 0)
+            self.lecturas_backend += 1
+        except Exception as e:
+            # Sin backend disponible se sigue con la copia local (o un contexto nuevo)
+            self.errores_backend += 1
+            log.warning("⚠️ Error leyendo contexto (%s): %s", self.backend.nombre, e)
+            leido = (None, contexto.version) if contexto else None
+        
+        if leido is None:
+            # No existe (o expiró) en el backend; se conserva la copia local aún no guardada
+            if contexto is None or contexto.version > 0:
+                if not crear:
+                    return None
+                contexto = self._crear(clave, nuevo)
+        elif leido[0] is None:
+            self.vigentes_backend += 1
+        else:
+            contexto = ContextoConversacion.desde_dict(leido[0])
+            contexto.version = leido[1]
+        
+        contexto.verificado = ahora
+        contexto.ultimo_acceso = ahora
+        with self._lock:
+            self._contextos[clave] = contexto
+            self._contextos.move_to_end(clave)
+            self._purgar(ahora)
+        return contexto
+    
+    def guardar(self, clave, contexto: ContextoConversacion, intentos: int = 3) -> bool:
+        """Publicar el contexto en el backend; ante un conflicto de versión se fusiona y reintenta"""
+        if self.backend is None:
+            return True
+        try:
+            for _ in range(intentos):
+                try:
+                    contexto.version = self.backend.escribir(str(clave), contexto.a_dict(), contexto.version)
+                    contexto.verificado = time.monotonic()
+                    self.escrituras_backend += 1
+                    return True
+                except ConflictoVersion:
+                    self.conflictos += 1
+                    leido = self.backend.leer(str(clave))
+                    if leido is None:
+                        contexto.version = 0
+                    else:
+                        contexto.fusionar(ContextoConversacion.desde_dict(leido[0]))
+                        contexto.version = leido[1]
+            log.warning("⚠️ Contexto %s no guardado tras %s conflictos de versión", clave, intentos)
+        except Exception as e:
+            self.errores_backend += 1
+            log.warning("⚠️ Error guardando contexto (%s): %s", self.backend.nombre, e)
+        return False
+    
+    def eliminar(self, clave):
+        with self._lock:
+            self._contextos.pop(clave, None)
+        if self.backend is not None:
+            self.backend.eliminar(str(clave))
+
+    def __len__(self):
+        return len(self._contextos)
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            self._purgar(time.monotonic())
+            total = len(self._contextos)
+            # Memoria estimada a partir de una muestra de los contextos más recientes
+            muestra = []
+            for contexto in reversed(self._contextos.values()):
+                if len(muestra) >= self.muestra_memoria:
+                    break
+                muestra.append(contexto)
+        promedio = sum(tamano_objeto(c) for c in muestra) / len(muestra) if muestra else 0
+        return {
+            "contextos": total,
+            "max_contextos": self.max_contextos,
+            "ttl_inactividad": self.ttl_inactividad,
+            "creados": self.creados,
+            "expulsados_lru": self.expulsados,
+            "expirados": self.expirados,
+            "bytes_promedio": int(promedio),
+            "bytes_estimados": int(promedio * total),
+            "backend": self.backend.nombre if self.backend else "memoria",
+            "lecturas_backend": self.lecturas_backend,
+            "vigentes_backend": self.vigentes_backend,
+            "escrituras_backend": self.escrituras_backend,
+            "conflictos": self.conflictos,
+            "errores_backend": self.errores_backend,
+            "rehidratados": self.rehidratados
+        }
@@ -1,14 +1,24 @@
+import argparse
+import csv
+import io
+import os
+import re
+import time
+from datetime import date, datetime
+from functools import lru_cache
+from itertools import islice
+
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
-from datetime import datetime
 
-# Configuración de base de datos (misma que main.py)
+# Configuración de base de datos (misma que main.py); DB_* permite apuntar a otra base (ej. benchmarks)
 db_config = {
-    'host': '192.168.1.7',
-    'user': 'evaluacion',
-    'password': 'inacap123',
-    'database': 'salud_chile',
-    'port': 5432
+    'host': os.getenv("DB_HOST", '192.168.1.7'),
+    'user': os.getenv("DB_USER", 'evaluacion'),
+    'password': os.getenv("DB_PASSWORD", 'inacap123'),
+    'database': os.getenv("DB_NAME", 'salud_chile'),
+    'port': int(os.getenv("DB_PORT", "5432"))
 }
 
 def crear_tablas_evaluacion3():
@@ -60,6 +70,10 @@ def crear_tablas_evaluacion3():
         """)
         print("✅ Tabla 'mensajes' creada")
         
+        # Snapshot del contexto por mensaje y marca de reinicio por conversación (rehidratar al reabrir)
+        cur.execute("ALTER TABLE mensajes ADD COLUMN IF NOT EXISTS contexto_snapshot TEXT")
+        cur.execute("ALTER TABLE conversaciones ADD COLUMN IF NOT EXISTS contexto_reiniciado_at TIMESTAMP")
+        
         # 4. Tabla términos excluidos (Evaluación 3 - E)
         cur.execute("""
             CREATE TABLE IF NOT EXISTS terminos_excluidos (
@@ -85,7 +99,18 @@ def crear_tablas_evaluacion3():
         """)
         print("✅ Tabla 'configuracion_prompts' creada")
         
-        # 6. Índices para optimización
+        # 6. Tabla contextos de conversación (CONTEXTO_BACKEND=postgres, compartidos entre workers)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS contextos_conversacion (
+                clave VARCHAR(100) PRIMARY KEY,
+                datos TEXT NOT NULL,
+                version BIGINT NOT NULL DEFAULT 1,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        print("✅ Tabla 'contextos_conversacion' creada")
+        
+        # 7. Índices para optimización
         cur.execute("""
             CREATE INDEX IF NOT EXISTS idx_conversaciones_user_id 
             ON conversaciones(user_id)
@@ -101,6 +126,11 @@ def crear_tablas_evaluacion3():
             ON mensajes(created_at)
         """)
         
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_contextos_conversacion_updated_at 
+            ON contextos_conversacion(updated_at)
+        """)
+        
         print("✅ Índices creados")
         
         # Commit todas las transacciones
@@ -115,6 +145,536 @@ def crear_tablas_evaluacion3():
         print(f"❌ Error creando tablas: {err}")
         return False
 
+# Tablas del dataset DEIS cuya recarga invalida las caches de resultados
+TABLAS_DATASET = ['defunciones_principales', 'ubicaciones', 'diagnosticos']
+
+def crear_version_dataset():
+    """
+    Crear la tabla de versión del dataset y los triggers que la incrementan
+    cada vez que se modifican o recargan las tablas DEIS
+    """
+    try:
+        conn = psycopg2.connect(**db_config)
+        cur = conn.cursor()
+        
+        print("🏷️ Configurando versión del dataset...")
+        
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS version_dataset (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version BIGINT NOT NULL DEFAULT 1,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cur.execute("""
+            INSERT INTO version_dataset (id, version, updated_at)
+            VALUES (1, 1, CURRENT_TIMESTAMP)
+            ON CONFLICT (id) DO NOTHING
+        """)
+        # Versión del dataset con la que se refrescaron los cubos (rollups)
+        cur.execute("ALTER TABLE version_dataset ADD COLUMN IF NOT EXISTS version_rollups BIGINT")
+        
+        cur.execute("""
+            CREATE OR REPLACE FUNCTION incrementar_version_dataset() RETURNS trigger AS $$
+            BEGIN
+                UPDATE version_dataset SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE id = 1;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+        """)
+        
+        for tabla in TABLAS_DATASET:
+            cur.execute("SELECT to_regclass(%s)", (tabla,))
+            if cur.fetchone()[0] is None:
+                print(f"   ⚠️ {tabla} no existe, trigger omitido")
+                continue
+            crear_trigger_version(cur, tabla)
+            print(f"   ✅ Trigger de versión en {tabla}")
+        
+        conn.commit()
+        cur.close()
+        conn.close()
+        
+        return True
+        
+    except psycopg2.Error as err:
+        print(f"❌ Error configurando versión del dataset: {err}")
+        return False
+
+def crear_trigger_version(cur, tabla: str):
+    """
+    (Re)crear el trigger que incrementa la versión al modificar la tabla (dentro de la transacción del cursor).
+    Un trigger por sentencia (no por fila) para no penalizar cargas masivas
+    """
+    cur.execute(f"DROP TRIGGER IF EXISTS trg_version_{tabla} ON {tabla}")
+    cur.execute(f"""
+        CREATE TRIGGER trg_version_{tabla}
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {tabla}
+        FOR EACH STATEMENT EXECUTE FUNCTION incrementar_version_dataset()
+    """)
+
+def incrementar_version_dataset(cur):
+    """
+    Incrementar manualmente la versión del dataset (dentro de la transacción del cursor)
+    """
+    cur.execute("""
+        UPDATE version_dataset SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+        WHERE id = 1
+        RETURNING version
+    """)
+    fila = cur.fetchone()
+    return fila[0] if fila else None
+
+# Cubos pre-agregados para conteos agrupados (ver rollups.py).
+# Se usan LEFT JOIN y las columnas con_ubicacion/con_diagnostico para poder
+# responder tanto consultas con JOIN como sin él (asume llaves únicas en
+# ubicaciones."COD_COMUNA" y diagnosticos.codigo_diagnostico). {tabla} es la tabla
+# de defunciones: la ingesta construye los cubos sobre la tabla de carga.
+ROLLUPS = {
+    'mv_cubo_region': (
+        ['"ANIO"', '"MES"', '"SEXO_NOMBRE"', '"NOMBRE_REGION"', 'capitulo', 'descripcion_capitulo',
+         '"LETRA_DIAG1"', 'con_ubicacion', 'con_diagnostico'],
+        """
+            SELECT d."ANIO",
+                   EXTRACT(MONTH FROM d."FECHA_DEF")::int AS "MES",
+                   d."SEXO_NOMBRE",
+                   u."NOMBRE_REGION",
+                   diag.capitulo,
+                   diag.descripcion_capitulo,
+                   LEFT(d."DIAG1", 1) AS "LETRA_DIAG1",
+                   u."COD_COMUNA" IS NOT NULL AS con_ubicacion,
+                   diag.codigo_diagnostico IS NOT NULL AS con_diagnostico,
+                   COUNT(*) AS total
+            FROM {tabla} d
+            LEFT JOIN ubicaciones u ON d."COD_COMUNA" = u."COD_COMUNA"
+            LEFT JOIN diagnosticos diag ON d."DIAG1" = diag.codigo_diagnostico
+            GROUP BY 1, 2, 3, 4, 5, 6, 7, 8, 9
+        """
+    ),
+    'mv_cubo_comuna': (
+        ['"ANIO"', '"MES"', '"SEXO_NOMBRE"', '"NOMBRE_REGION"', '"COMUNA"', 'con_ubicacion'],
+        """
+            SELECT d."ANIO",
+                   EXTRACT(MONTH FROM d."FECHA_DEF")::int AS "MES",
+                   d."SEXO_NOMBRE",
+                   u."NOMBRE_REGION",
+                   u."COMUNA",
+                   u."COD_COMUNA" IS NOT NULL AS con_ubicacion,
+                   COUNT(*) AS total
+            FROM {tabla} d
+            LEFT JOIN ubicaciones u ON d."COD_COMUNA" = u."COD_COMUNA"
+            GROUP BY 1, 2, 3, 4, 5, 6
+        """
+    ),
+}
+
+def crear_rollups():
+    """
+    Crear las vistas materializadas de los cubos pre-agregados
+    """
+    try:
+        conn = psycopg2.connect(**db_config)
+        cur = conn.cursor()
+        
+        print("🧊 Creando cubos pre-agregados...")
+        
+        for tabla in TABLAS_DATASET:
+            cur.execute("SELECT to_regclass(%s)", (tabla,))
+            if cur.fetchone()[0] is None:
+                print(f"   ⚠️ {tabla} no existe, cubos omitidos")
+                cur.close()
+                conn.close()
+                return True
+        
+        for nombre, (columnas, consulta) in ROLLUPS.items():
+            cur.execute(f"CREATE MATERIALIZED VIEW IF NOT EXISTS {nombre} AS "
+                        f"{consulta.format(tabla='defunciones_principales')} WITH NO DATA")
+            # Índice único: requerido por REFRESH ... CONCURRENTLY
+            cur.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{nombre} ON {nombre} ({', '.join(columnas)})")
+            print(f"   ✅ {nombre}")
+        
+        conn.commit()
+        cur.close()
+        conn.close()
+        
+        return refrescar_rollups()
+        
+    except psycopg2.Error as err:
+        print(f"❌ Error creando cubos: {err}")
+        return False
+
+def refrescar_rollups():
+    """
+    Refrescar los cubos y registrar la versión del dataset que reflejan.
+    El backend solo reescribe consultas hacia los cubos si version_rollups = version.
+    """
+    try:
+        conn = psycopg2.connect(**db_config)
+        conn.autocommit = True
+        cur = conn.cursor()
+        
+        # Versión antes de refrescar: si el dataset cambia durante el refresco, los cubos quedan desfasados
+        cur.execute("SELECT version FROM version_dataset WHERE id = 1")
+        version = cur.fetchone()[0]
+        
+        for nombre in ROLLUPS:
+            try:
+                cur.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {nombre}")
+            except psycopg2.Error:
+                # La primera carga (vista sin datos) no admite CONCURRENTLY
+                cur.execute(f"REFRESH MATERIALIZED VIEW {nombre}")
+            print(f"   🔄 {nombre} refrescado")
+        
+        cur.execute("UPDATE version_dataset SET version_rollups = %s WHERE id = 1", (version,))
+        
+        cur.close()
+        conn.close()
+        
+        return True
+        
+    except psycopg2.Error as err:
+        print(f"❌ Error refrescando cubos: {err}")
+        return False
+
+# === INGESTA DEIS ===
+# El CSV de defunciones del DEIS se carga con COPY en una tabla de carga (sin índices) y se
+# reemplaza a defunciones_principales en una sola transacción: las consultas siguen leyendo la
+# tabla anterior hasta el commit. Los índices y los cubos se construyen sobre la tabla de carga
+# después de cargar los datos, y el trigger de versión se crea antes del commit.
+
+TABLA_CARGA = 'defunciones_principales_carga'
+
+# Solo para la primera carga; si defunciones_principales existe, la tabla de carga copia su esquema
+TABLA_DEFUNCIONES = """
+    CREATE TABLE {tabla} (
+        id SERIAL PRIMARY KEY,
+        "ANIO" INTEGER NOT NULL,
+        "FECHA_DEF" DATE,
+        "SEXO_NOMBRE" VARCHAR(20),
+        "EDAD_TIPO" INTEGER,
+        "EDAD_CANT" INTEGER,
+        "COD_COMUNA" INTEGER,
+        "DIAG1" VARCHAR(10),
+        "DIAG2" VARCHAR(10),
+        "LUGAR_DEFUNCION" VARCHAR(50)
+    )
+"""
+
+# Índices si la tabla actual no existe; si existe, se replican los suyos
+INDICES_DEFUNCIONES = {
+    'idx_defunciones_anio': '"ANIO"',
+    'idx_defunciones_comuna': '"COD_COMUNA"',
+    'idx_defunciones_diag1': '"DIAG1"',
+}
+
+# Columna de la tabla -> nombres aceptados en el encabezado (los del archivo DEIS y los propios)
+COLUMNAS_DEIS = {
+    'ANIO': ('ANIO', 'ANO_DEF', 'AÑO_DEF', 'AÑO'),
+    'FECHA_DEF': ('FECHA_DEF',),
+    'SEXO_NOMBRE': ('SEXO_NOMBRE', 'GLOSA_SEXO', 'SEXO'),
+    'EDAD_TIPO': ('EDAD_TIPO',),
+    'EDAD_CANT': ('EDAD_CANT',),
+    'COD_COMUNA': ('COD_COMUNA', 'CODIGO_COMUNA_RESIDENCIA'),
+    'DIAG1': ('DIAG1',),
+    'DIAG2': ('DIAG2',),
+    'LUGAR_DEFUNCION': ('LUGAR_DEFUNCION', 'GLOSA_LUGAR_DEFUNCION'),
+}
+
+SEXOS = {'1': 'Hombre', 'hombre': 'Hombre', 'h': 'Hombre', '2': 'Mujer', 'mujer': 'Mujer', 'm': 'Mujer'}
+
+_PATRON_FECHA_ISO = re.compile(r'^(\d{4})[-/](\d{1,2})[-/](\d{1,2})')
+_PATRON_FECHA_DMA = re.compile(r'^(\d{1,2})[-/](\d{1,2})[-/](\d{4})')
+_PATRON_CIE10 = re.compile(r'^[A-Z]\d{2}[0-9A-Z]{0,2}$')
+
+def copiar_filas(cur, tabla: str, columnas: str, filas, congelar: bool = False):
+    """
+    COPY de las filas (tuplas, None = NULL) desde un buffer en memoria en formato CSV.
+    congelar=True usa FREEZE: solo si la tabla se creó o truncó en esta transacción.
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerows(filas)
+    buffer.seek(0)
+    opciones = "FORMAT csv, FREEZE" if congelar else "FORMAT csv"
+    cur.copy_expert(f"COPY {tabla} ({columnas}) FROM STDIN WITH ({opciones})", buffer)
+
+def _entero(texto):
+    try:
+        return int(texto)
+    except ValueError:
+        try:
+            return int(float(texto.replace(',', '.')))
+        except ValueError:
+            return None
+
+# Los valores se repiten mucho (fechas, códigos, glosas): se normaliza cada uno una sola vez
+@lru_cache(maxsize=8192)
+def normalizar_fecha(texto: str):
+    """Fecha DEIS (AAAA-MM-DD, DD-MM-AAAA o DD/MM/AAAA, con o sin hora) a ISO; None si no es válida"""
+    m = _PATRON_FECHA_ISO.match(texto)
+    if m:
+        anio, mes, dia = m.groups()
+    else:
+        m = _PATRON_FECHA_DMA.match(texto)
+        if not m:
+            return None
+        dia, mes, anio = m.groups()
+    try:
+        return date(int(anio), int(mes), int(dia)).isoformat()
+    except ValueError:
+        return None
+
+@lru_cache(maxsize=16384)
+def normalizar_cie10(texto: str):
+    """Código CIE-10 en mayúsculas sin punto ni espacios ('c34.9' -> 'C349'); None si no es válido"""
+    codigo = texto.upper().replace('.', '').replace('-', '').replace(' ', '')
+    return codigo if _PATRON_CIE10.match(codigo) else None
+
+@lru_cache(maxsize=256)
+def normalizar_sexo(texto: str):
+    return SEXOS.get(texto.lower(), texto.capitalize()) if texto else None
+
+def normalizar_edad(tipo: str, cantidad: str):
+    """EDAD_TIPO (1 años, 2 meses, 3 días, 4 horas) y EDAD_CANT; valores fuera de rango (ej. 999) quedan en NULL"""
+    tipo = _entero(tipo) if tipo else None
+    cantidad = _entero(cantidad) if cantidad else None
+    if tipo not in (1, 2, 3, 4):
+        tipo = None
+    if cantidad is not None and not 0 <= cantidad <= 130:
+        cantidad = None
+    return tipo, cantidad
+
+def _indices_columnas(encabezado: list) -> dict:
+    """Posición en el CSV de cada columna de la tabla (None si no viene)"""
+    posiciones = {nombre.strip().upper(): i for i, nombre in enumerate(encabezado)}
+    indices = {}
+    for columna, alias in COLUMNAS_DEIS.items():
+        indices[columna] = next((posiciones[a] for a in alias if a in posiciones), None)
+    if indices['ANIO'] is None and indices['FECHA_DEF'] is None:
+        raise ValueError(f"El archivo no trae ANO_DEF/ANIO ni FECHA_DEF (encabezado: {encabezado})")
+    if indices['DIAG1'] is None:
+        raise ValueError(f"El archivo no trae DIAG1 (encabezado: {encabezado})")
+    return indices
+
+def leer_defunciones_deis(lector, encabezado: list, conteo: dict):
+    """
+    Filas normalizadas para defunciones_principales, en el orden de COLUMNAS_DEIS.
+    Se descartan las filas sin año (ni en ANIO ni en FECHA_DEF) o sin DIAG1 válido.
+    """
+    indices = _indices_columnas(encabezado)
+    i_anio, i_fecha, i_sexo = indices['ANIO'], indices['FECHA_DEF'], indices['SEXO_NOMBRE']
+    i_tipo, i_cant, i_comuna = indices['EDAD_TIPO'], indices['EDAD_CANT'], indices['COD_COMUNA']
+    i_diag1, i_diag2, i_lugar = indices['DIAG1'], indices['DIAG2'], indices['LUGAR_DEFUNCION']
+    ancho = len(encabezado)
+
+    def campo(fila, i):
+        return fila[i].strip() if i is not None else ''
+
+    for fila in lector:
+        conteo['leidas'] += 1
+        if len(fila) < ancho:
+            conteo['descartadas'] += 1
+            continue
+
+        fecha_texto = campo(fila, i_fecha)
+        fecha = normalizar_fecha(fecha_texto) if fecha_texto else None
+        if fecha_texto and fecha is None:
+            conteo['fechas_invalidas'] += 1
+        anio = _entero(campo(fila, i_anio)) if i_anio is not None else None
+        if anio is None and fecha is not None:
+            anio = int(fecha[:4])
+
+        diag1 = normalizar_cie10(campo(fila, i_diag1))
+        if anio is None or diag1 is None:
+            conteo['descartadas'] += 1
+            continue
+        diag2_texto = campo(fila, i_diag2)
+        diag2 = normalizar_cie10(diag2_texto) if diag2_texto else None
+
+        edad_tipo, edad_cant = normalizar_edad(campo(fila, i_tipo), campo(fila, i_cant))
+        comuna = campo(fila, i_comuna)
+        yield (
+            anio, fecha, normalizar_sexo(campo(fila, i_sexo)), edad_tipo, edad_cant,
+            _entero(comuna) if comuna else None, diag1, diag2, campo(fila, i_lugar) or None
+        )
+
+def _crear_tabla_carga(cur) -> list:
+    """
+    Crear la tabla de carga con el esquema de defunciones_principales (tipos, defaults y CHECK), o con
+    TABLA_DEFUNCIONES si es la primera carga. Retorna [(nombre temporal, nombre final)] de sus secuencias
+    (y de la clave primaria, que en la primera carga se crea con la tabla).
+    """
+    cur.execute("SELECT to_regclass('defunciones_principales')")
+    if cur.fetchone()[0] is None:
+        cur.execute(TABLA_DEFUNCIONES.format(tabla=TABLA_CARGA))
+        return [(f"{TABLA_CARGA}_pkey", "defunciones_principales_pkey"),
+                (f"{TABLA_CARGA}_id_seq", "defunciones_principales_id_seq")]
+
+    cur.execute(f"CREATE TABLE {TABLA_CARGA} (LIKE defunciones_principales INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    # Los defaults copiados usan las secuencias de la tabla anterior, que se eliminan con ella:
+    # cada columna serial recibe una secuencia propia que sigue donde iba la anterior
+    cur.execute("""
+        SELECT a.attname, pg_get_serial_sequence('defunciones_principales', a.attname)
+        FROM pg_attribute a
+        WHERE a.attrelid = 'defunciones_principales'::regclass AND a.attnum > 0 AND NOT a.attisdropped
+          AND pg_get_serial_sequence('defunciones_principales', a.attname) IS NOT NULL
+    """)
+    renombres = []
+    for columna, secuencia in cur.fetchall():
+        nombre = secuencia.rsplit('.', 1)[-1].strip('"')
+        temporal = psycopg2.extensions.quote_ident(f"{TABLA_CARGA}_{columna}_seq"[:63], cur)
+        columna_sql = psycopg2.extensions.quote_ident(columna, cur)
+        cur.execute(f"CREATE SEQUENCE {temporal} OWNED BY {TABLA_CARGA}.{columna_sql}")
+        cur.execute(f"SELECT setval('{temporal}', last_value, is_called) FROM {secuencia}")
+        cur.execute(f"ALTER TABLE {TABLA_CARGA} ALTER COLUMN {columna_sql} SET DEFAULT nextval('{temporal}')")
+        renombres.append((f"{TABLA_CARGA}_{columna}_seq"[:63], nombre))
+    return renombres
+
+def _replicar_indices(cur, tabla_carga: str) -> list:
+    """
+    Crear en la tabla de carga los índices de defunciones_principales, incluida su clave primaria
+    (o los por defecto). Retorna [(nombre temporal, nombre final)] para renombrarlos después del reemplazo.
+    """
+    renombres = []
+    cur.execute("SELECT to_regclass('defunciones_principales')")
+    if cur.fetchone()[0] is None:
+        definiciones = [(nombre, f"CREATE INDEX {{nombre}} ON {{tabla}} ({columna})")
+                        for nombre, columna in INDICES_DEFUNCIONES.items()]
+    else:
+        cur.execute("""
+            SELECT i.relname, pg_get_indexdef(x.indexrelid)
+            FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid
+            WHERE x.indrelid = 'defunciones_principales'::regclass AND NOT x.indisprimary
+        """)
+        definiciones = []
+        for nombre, definicion in cur.fetchall():
+            # "CREATE [UNIQUE] INDEX nombre ON [ONLY] esquema.tabla USING ..." -> plantilla
+            m = re.match(r'^(CREATE (?:UNIQUE )?INDEX) \S+ ON (?:ONLY )?\S+ (.*)$', definicion, re.DOTALL)
+            if m:
+                definiciones.append((nombre, m.group(1) + " {nombre} ON {tabla} " + m.group(2).replace('{', '{{').replace('}', '}}')))
+        # LIKE no copia la clave primaria; se agrega después de la carga, como los índices
+        cur.execute("""
+            SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+            WHERE conrelid = 'defunciones_principales'::regclass AND contype = 'p'
+        """)
+        for nombre, definicion in cur.fetchall():
+            definiciones.append((nombre, "ALTER TABLE {tabla} ADD CONSTRAINT {nombre} "
+                                 + definicion.replace('{', '{{').replace('}', '}}')))
+
+    for nombre, plantilla in definiciones:
+        temporal = f"{nombre[:57]}_carga"
+        cur.execute(plantilla.format(nombre=psycopg2.extensions.quote_ident(temporal, cur), tabla=tabla_carga))
+        renombres.append((temporal, nombre))
+        print(f"   🗂️ Índice {nombre}")
+    return renombres
+
+def _construir_cubos_carga(cur) -> list:
+    """
+    Crear los cubos (con datos) sobre la tabla de carga como <cubo>_carga; se renombran en el reemplazo.
+    Retorna los cubos construidos (ninguno si faltan ubicaciones o diagnosticos)
+    """
+    for tabla in TABLAS_DATASET[1:]:
+        cur.execute("SELECT to_regclass(%s)", (tabla,))
+        if cur.fetchone()[0] is None:
+            print(f"   ⚠️ {tabla} no existe, cubos omitidos")
+            return []
+    for nombre, (columnas, consulta) in ROLLUPS.items():
+        cur.execute(f"CREATE MATERIALIZED VIEW {nombre}_carga AS {consulta.format(tabla=TABLA_CARGA)}")
+        cur.execute(f"CREATE UNIQUE INDEX idx_{nombre}_carga ON {nombre}_carga ({', '.join(columnas)})")
+        print(f"   🧊 {nombre}")
+    return list(ROLLUPS)
+
+def ingestar_deis(ruta: str, lote: int = 200_000, separador: str = None, codificacion: str = 'utf-8-sig'):
+    """
+    Cargar el CSV de defunciones del DEIS en defunciones_principales sin dejar de atender consultas:
+    COPY por lotes en una tabla de carga, índices, ANALYZE y cubos sobre ella, y reemplazo atómico
+    junto con el trigger de versión y la versión del dataset incrementada (las caches de resultados
+    se invalidan). Si algo falla, se conservan la tabla y los cubos anteriores.
+    """
+    conteo = {'leidas': 0, 'cargadas': 0, 'descartadas': 0, 'fechas_invalidas': 0}
+    inicio = time.perf_counter()
+    # Tabla de versión y función del trigger (la tabla nueva recibe su trigger dentro del reemplazo)
+    if not crear_version_dataset():
+        return False
+    conn = None
+    try:
+        conn = psycopg2.connect(**db_config)
+        cur = conn.cursor()
+        print(f"📥 Ingestando {ruta} en defunciones_principales...")
+
+        cur.execute(f"SET LOCAL maintenance_work_mem = '{os.getenv('INGESTA_MEMORIA_INDICES', '512MB')}'")
+        cur.execute(f"DROP TABLE IF EXISTS {TABLA_CARGA}")
+        renombres_tabla = _crear_tabla_carga(cur)
+
+        columnas = ', '.join(f'"{c}"' for c in COLUMNAS_DEIS)
+        with open(ruta, newline='', encoding=codificacion) as archivo:
+            if separador is None:
+                separador = csv.Sniffer().sniff(archivo.readline(), delimiters=';,\t|').delimiter
+                archivo.seek(0)
+            lector = csv.reader(archivo, delimiter=separador)
+            filas = leer_defunciones_deis(lector, next(lector), conteo)
+            while True:
+                bloque = list(islice(filas, lote))
+                if not bloque:
+                    break
+                # Tabla creada en esta transacción: FREEZE evita reescribir las páginas al hacer VACUUM
+                copiar_filas(cur, TABLA_CARGA, columnas, bloque, congelar=True)
+                conteo['cargadas'] += len(bloque)
+                print(f"   📥 {conteo['cargadas']:,} filas ({conteo['leidas']:,} leídas)")
+
+        if not conteo['cargadas']:
+            print("❌ El archivo no trae filas válidas: se conserva la tabla actual")
+            conn.rollback()
+            return False
+
+        # Índices después de la carga (mucho más rápido que mantenerlos fila a fila)
+        renombres = _replicar_indices(cur, TABLA_CARGA)
+        cur.execute(f"ANALYZE {TABLA_CARGA}")
+        cubos = _construir_cubos_carga(cur)
+
+        # Reemplazo: el bloqueo exclusivo se toma recién aquí y dura hasta el commit
+        cur.execute(f"SET LOCAL lock_timeout = '{os.getenv('INGESTA_LOCK_TIMEOUT', '30s')}'")
+        for nombre in ROLLUPS:
+            cur.execute(f"DROP MATERIALIZED VIEW IF EXISTS {nombre}")
+        # Sin CASCADE: si otro objeto depende de la tabla anterior, el reemplazo falla y nada cambia
+        cur.execute("DROP TABLE IF EXISTS defunciones_principales")
+        cur.execute(f"ALTER TABLE {TABLA_CARGA} RENAME TO defunciones_principales")
+        for nombre in cubos:
+            cur.execute(f"ALTER MATERIALIZED VIEW {nombre}_carga RENAME TO {nombre}")
+            cur.execute(f"ALTER INDEX idx_{nombre}_carga RENAME TO idx_{nombre}")
+        renombres += renombres_tabla
+        for temporal, nombre in renombres:
+            cur.execute("SELECT to_regclass(%s)", (nombre,))
+            if cur.fetchone()[0] is None:
+                cur.execute(f"ALTER {'SEQUENCE' if temporal.endswith('_seq') else 'INDEX'} "
+                            f"{psycopg2.extensions.quote_ident(temporal, cur)} "
+                            f"RENAME TO {psycopg2.extensions.quote_ident(nombre, cur)}")
+
+        # DROP/RENAME no disparan los triggers de versión: se incrementa en la misma transacción,
+        # y los cubos construidos sobre los datos nuevos quedan al día con esa versión
+        crear_trigger_version(cur, 'defunciones_principales')
+        version = incrementar_version_dataset(cur)
+        if cubos:
+            cur.execute("UPDATE version_dataset SET version_rollups = %s WHERE id = 1", (version,))
+        conn.commit()
+        cur.close()
+        conn.close()
+
+        segundos = time.perf_counter() - inicio
+        print(f"✅ {conteo['cargadas']:,} defunciones cargadas en {segundos:.1f}s "
+              f"({conteo['cargadas'] / segundos * 60:,.0f} filas/min), versión del dataset {version}")
+        if conteo['descartadas'] or conteo['fechas_invalidas']:
+            print(f"   ⚠️ {conteo['descartadas']:,} filas descartadas (sin año o DIAG1 válido), "
+                  f"{conteo['fechas_invalidas']:,} fechas inválidas cargadas como NULL")
+
+    except (psycopg2.Error, OSError, ValueError, csv.Error) as err:
+        print(f"❌ Error ingestando {ruta}: {err}")
+        if conn is not None:
+            conn.rollback()
+            conn.close()
+        return False
+
+    return True
+
 def verificar_tablas():
     """
     Verificar que todas las tablas existan
@@ -130,6 +690,8 @@ def verificar_tablas():
             'mensajes',
             'terminos_excluidos',
             'configuracion_prompts',
+            'contextos_conversacion',
+            'version_dataset',
             'defunciones_principales',  # Tu tabla original
             'ubicaciones',              # Tu tabla original
             'diagnosticos'              # Tu tabla original
@@ -293,22 +855,32 @@ def main():
         print("❌ Error en creación de tablas")
         return
     
-    # 2. Verificar tablas
+    # 2. Versión del dataset (invalidación de caches de resultados)
+    if not crear_version_dataset():
+        print("❌ Error configurando versión del dataset")
+        return
+    
+    # 3. Cubos pre-agregados (rollups)
+    if not crear_rollups():
+        print("❌ Error creando cubos pre-agregados")
+        return
+    
+    # 4. Verificar tablas
     if not verificar_tablas():
         print("❌ Error en verificación de tablas")
         return
     
-    # 3. Crear usuario admin
+    # 5. Crear usuario admin
     if not crear_usuario_admin():
         print("❌ Error creando usuario admin")
         return
     
-    # 4. Insertar datos ejemplo
+    # 6. Insertar datos ejemplo
     if not insertar_datos_ejemplo():
         print("❌ Error insertando datos ejemplo")
         return
     
-    # 5. Mostrar estadísticas
+    # 7. Mostrar estadísticas
     print("\n📊 Estadísticas de la base de datos:")
     stats = obtener_estadisticas_bd()
     for tabla, count in stats.items():
@@ -321,4 +893,14 @@ def main():
     print("\n🚀 Puedes iniciar el servidor FastAPI con: uvicorn main:app --reload")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Configuración de la base de datos e ingesta DEIS")
+    parser.add_argument("archivo", nargs="?", help="CSV de defunciones DEIS a ingestar (sin archivo: configuración completa)")
+    parser.add_argument("--lote", type=int, default=200_000, help="filas por COPY")
+    parser.add_argument("--separador", help="separador del CSV (por defecto se detecta)")
+    parser.add_argument("--codificacion", default="utf-8-sig", help="ej. latin-1 para archivos DEIS antiguos")
+    args = parser.parse_args()
+    if args.archivo:
+        if not ingestar_deis(args.archivo, args.lote, args.separador, args.codificacion):
+            raise SystemExit(1)
+    else:
+        main()
\ No newline at end of file
@@ -0,0 +1,250 @@
+import re
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Optional
+
+from cache import normalizar_texto
+
+# Mismas traducciones que se le piden al LLM en generar_respuesta_final
+TRADUCCIONES = {
+    "tumores [neoplasias]": "Cáncer",
+    "tumores (neoplasias)": "Cáncer",
+    "enfermedades del sistema circulatorio": "Problemas cardiovasculares",
+    "enfermedades del sistema respiratorio": "Problemas respiratorios",
+}
+
+MESES = ['enero', 'febrero', 'marzo', 'abril', 'mayo', 'junio', 'julio',
+         'agosto', 'septiembre', 'octubre', 'noviembre', 'diciembre']
+
+# Columnas que representan un conteo de defunciones
+PREFIJOS_CONTEO = ('count', 'total', 'cantidad', 'numero', 'num_', 'defunciones', 'muertes', 'fallecidos')
+
+# Columnas que representan un mes numérico (EXTRACT/DATE_PART sin alias)
+COLUMNAS_MES = ('mes', 'month', 'extract', 'date_part')
+
+# Máximo de filas que se formatean como lista sin pasar por el LLM
+MAX_FILAS_LISTA = 20
+
+
+def _es_numero(valor) -> bool:
+    return isinstance(valor, (int, float, Decimal)) and not isinstance(valor, bool)
+
+
+def _a_numero(valor):
+    if isinstance(valor, Decimal):
+        return int(valor) if valor == valor.to_integral_value() else float(valor)
+    if isinstance(valor, float) and valor.is_integer():
+        return int(valor)
+    return valor
+
+
+def formatear_numero(valor) -> str:
+    """Número con separador de miles (15,432) y máximo dos decimales"""
+    valor = _a_numero(valor)
+    if isinstance(valor, int):
+        return f"{valor:,}"
+    return f"{valor:,.2f}"
+
+
+def traducir(texto: str) -> str:
+    """Traducir términos médicos a lenguaje común"""
+    return TRADUCCIONES.get(texto.strip().lower(), texto.strip())
+
+
+def _es_conteo(columna: str, valor) -> bool:
+    return isinstance(_a_numero(valor), int) and columna.lower().startswith(PREFIJOS_CONTEO)
+
+
+def _unidad(pregunta: str) -> str:
+    return "defunciones" if "defunci" in pregunta.lower() else "muertes"
+
+
+def _formatear_etiqueta(columna: str, valor) -> str:
+    if valor is None:
+        return "Sin dato"
+    if _es_numero(valor):
+        valor = _a_numero(valor)
+        if columna.lower() in COLUMNAS_MES and isinstance(valor, int) and 1 <= valor <= 12:
+            return MESES[valor - 1].capitalize()
+        # Años y códigos no llevan separador de miles
+        return str(valor)
+    if isinstance(valor, (date, datetime)):
+        return valor.strftime("%d/%m/%Y")
+    return traducir(str(valor))
+
+
+def _formatear_valor(columna: str, valor, pregunta: str) -> str:
+    if _es_conteo(columna, valor):
+        return f"{formatear_numero(valor)} {_unidad(pregunta)}"
+    return formatear_numero(valor)
+
+
+def _separar_etiqueta_valor(fila: dict):
+    """Para filas de dos columnas, identificar (columna etiqueta, columna numérica)"""
+    (col_a, val_a), (col_b, val_b) = fila.items()
+    if _es_numero(val_b) and (not _es_numero(val_a) or _es_conteo(col_b, val_b)):
+        return col_a, col_b
+    if _es_numero(val_a) and not _es_numero(val_b):
+        return col_b, col_a
+    return None
+
+
+def formatear_respuesta(resultado_sql, pregunta: str) -> Optional[str]:
+    """
+    Formatear localmente resultados de forma simple (escalar, etiqueta/conteo, top-N).
+    Retorna None si la forma no es reconocida y se debe usar el LLM.
+    """
+    if not isinstance(resultado_sql, list) or not resultado_sql:
+        return None
+
+    columnas = list(resultado_sql[0].keys())
+    if any(list(fila.keys()) != columnas for fila in resultado_sql):
+        return None
+
+    # Valor único: "15,432 muertes" / "Región Metropolitana"
+    if len(resultado_sql) == 1 and len(columnas) == 1:
+        columna = columnas[0]
+        valor = resultado_sql[0][columna]
+        if _es_numero(valor):
+            return _formatear_valor(columna, valor, pregunta)
+        if isinstance(valor, str):
+            return traducir(valor)
+        return None
+
+    if len(columnas) == 2:
+        par = _separar_etiqueta_valor(resultado_sql[0])
+        if par is None or not all(_es_numero(fila[par[1]]) for fila in resultado_sql):
+            return None
+        col_etiqueta, col_valor = par
+
+        # Una fila etiqueta/conteo: "Metropolitana de Santiago (15,432 muertes)"
+        if len(resultado_sql) == 1:
+            fila = resultado_sql[0]
+            return f"{_formatear_etiqueta(col_etiqueta, fila[col_etiqueta])} ({_formatear_valor(col_valor, fila[col_valor], pregunta)})"
+
+        # Top-N: lista numerada
+        if len(resultado_sql) <= MAX_FILAS_LISTA:
+            return "\n".join(
+                f"{i}. {_formatear_etiqueta(col_etiqueta, fila[col_etiqueta])}: {formatear_numero(fila[col_valor])}"
+                for i, fila in enumerate(resultado_sql, start=1)
+            )
+
+    # Lista simple de etiquetas (ej: lista de regiones)
+    if len(columnas) == 1 and len(resultado_sql) <= MAX_FILAS_LISTA:
+        valores = [fila[columnas[0]] for fila in resultado_sql]
+        if all(isinstance(v, str) for v in valores):
+            return "\n".join(f"- {traducir(v)}" for v in valores)
+
+    return None
+
+
+# === SEGUIMIENTOS SOBRE EL RESULTADO ANTERIOR ===
+
+# Operaciones que se pueden resolver con las filas ya devueltas (texto normalizado: sin tildes ni signos)
+PATRONES_SEGUIMIENTO = {
+    'conteo': re.compile(r"\b(cuant[oa]s son|cuant[oa]s hay|contarl[oa]s|puedes contarl[oa]s)\b"),
+    'suma': re.compile(r"\b(suma|sumar|sumal[oa]s|en total|el total)\b"),
+    'maximo': re.compile(r"\b(mas comun|la principal|el principal|(el|la) mayor|(el|la) maximo|cual tiene mas|primer lugar)\b"),
+    'minimo': re.compile(r"\b(menos comun|(el|la) menor|(el|la) minimo|cual tiene menos|ultimo lugar)\b"),
+}
+
+# Dimensiones que puede nombrar un seguimiento ("cuál es la principal causa") y prefijos de las columnas
+# que las contienen: solo se responde localmente si la dimensión es la etiqueta del resultado anterior
+DIMENSIONES_SEGUIMIENTO = {
+    'causa': re.compile(r"\b(causas?|enfermedad(es)?|diagnosticos?|capitulos?|motivos?)\b"),
+    'mes': re.compile(r"\b(mes(es)?)\b"),
+    'region': re.compile(r"\b(region(es)?)\b"),
+    'comuna': re.compile(r"\b(comunas?)\b"),
+    'sexo': re.compile(r"\b(sexos?|generos?|hombres?|mujer(es)?)\b"),
+    'año': re.compile(r"\b(anos?|anio)\b"),
+    'edad': re.compile(r"\b(edad(es)?)\b"),
+    'lugar': re.compile(r"\b(lugar(es)?|hospital(es)?|casa)\b"),
+    'dia': re.compile(r"\b(dias?|semana)\b"),
+}
+COLUMNAS_DIMENSION = (
+    ('causa', ('descripcion', 'capitulo', 'diag', 'causa', 'subcategoria')),
+    ('mes', COLUMNAS_MES),
+    ('region', ('nombre_region', 'region')),
+    ('comuna', ('comuna',)),
+    ('sexo', ('sexo',)),
+    ('año', ('anio', 'ano', 'year')),
+    ('edad', ('edad',)),
+    ('lugar', ('lugar',)),
+    ('dia', ('dia', 'dow')),
+)
+
+# Un seguimiento es una pregunta corta; las largas probablemente piden otra cosa
+MAX_PALABRAS_SEGUIMIENTO = 8
+
+
+def clasificar_seguimiento(pregunta: str) -> Optional[str]:
+    """Operación pedida sobre el resultado anterior (None si no es un seguimiento o es ambiguo)"""
+    texto = normalizar_texto(pregunta)
+    if len(texto.split()) > MAX_PALABRAS_SEGUIMIENTO:
+        return None
+    operaciones = [nombre for nombre, patron in PATRONES_SEGUIMIENTO.items() if patron.search(texto)]
+    return operaciones[0] if len(operaciones) == 1 else None
+
+
+def dimension_columna(columna: str) -> Optional[str]:
+    """Dimensión que representa una columna de etiqueta (None si no se reconoce)"""
+    columna = columna.lower()
+    for dimension, prefijos in COLUMNAS_DIMENSION:
+        if columna.startswith(prefijos) or any(f"_{p}" in columna for p in prefijos):
+            return dimension
+    return None
+
+
+def _otra_dimension(pregunta: str, col_etiqueta: str) -> bool:
+    """Si la pregunta nombra una dimensión distinta de la etiqueta del resultado ("causa" sobre regiones)"""
+    texto = normalizar_texto(pregunta)
+    permitida = dimension_columna(col_etiqueta)
+    return any(patron.search(texto) for dimension, patron in DIMENSIONES_SEGUIMIENTO.items() if dimension != permitida)
+
+
+def responder_seguimiento(resultado_sql, pregunta: str, completo: bool = False) -> Optional[tuple]:
+    """
+    Responder suma / conteo / máximo / mínimo sobre las filas del resultado anterior.
+    `completo` indica que las filas no alcanzaron el LIMIT de su consulta: sobre un resultado recortado
+    el conteo sería el LIMIT ("Son 10." tras un top 10), la suma parcial y el mínimo el último mostrado.
+    Retorna (operación, respuesta) o None si la pregunta o la forma del resultado no lo permiten.
+    """
+    operacion = clasificar_seguimiento(pregunta)
+    if operacion is None or not completo or not isinstance(resultado_sql, list) or not resultado_sql:
+        return None
+
+    columnas = list(resultado_sql[0].keys())
+    if any(list(fila.keys()) != columnas for fila in resultado_sql):
+        return None
+
+    # Lista de etiquetas sin valores (ej: lista de regiones): solo se puede contar
+    if len(columnas) == 1 and not any(_es_numero(fila[columnas[0]]) for fila in resultado_sql):
+        if operacion == 'conteo' and not _otra_dimension(pregunta, columnas[0]):
+            return operacion, f"Son {formatear_numero(len(resultado_sql))}."
+        return None
+
+    # Las demás operaciones necesitan una etiqueta y su columna numérica; sin etiqueta (un total) o con
+    # otra dimensión en la pregunta ("la principal causa" tras una lista de regiones) piden otra consulta
+    if len(columnas) != 2:
+        return None
+    par = _separar_etiqueta_valor(resultado_sql[0])
+    if par is None or not all(_es_numero(fila[par[1]]) for fila in resultado_sql):
+        return None
+    col_etiqueta, col_valor = par
+    if _otra_dimension(pregunta, col_etiqueta):
+        return None
+
+    if operacion == 'conteo':
+        return operacion, f"Son {formatear_numero(len(resultado_sql))}."
+
+    if operacion == 'suma':
+        # Sumar promedios o porcentajes no tiene sentido: solo conteos
+        if not all(_es_conteo(col_valor, fila[col_valor]) for fila in resultado_sql):
+            return None
+        total = sum(_a_numero(fila[col_valor]) for fila in resultado_sql)
+        return operacion, f"En total, {_formatear_valor(col_valor, total, pregunta)}."
+
+    elegir = max if operacion == 'maximo' else min
+    fila = elegir(resultado_sql, key=lambda f: f[col_valor])
+    valor = _formatear_valor(col_valor, fila[col_valor], pregunta)
+    return operacion, f"{_formatear_etiqueta(col_etiqueta, fila[col_etiqueta])} ({valor})"
@@ -0,0 +1,120 @@
+import json
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+
+from cache import CacheLRU
+
+log = logging.getLogger(__name__)
+
+
+class ConsultaCostosaError(psycopg2.DatabaseError):
+    """El plan estimado supera los límites o la consulta excedió statement_timeout"""
+
+
+@dataclass(frozen=True)
+class PlanEstimado:
+    costo: float        # "Total Cost" del nodo raíz
+    filas: float        # mayor "Plan Rows" del árbol (detecta productos cartesianos intermedios)
+    nodo: str           # tipo del nodo raíz
+
+
+def resumir_plan(explain) -> PlanEstimado:
+    """Resumir la salida de EXPLAIN (FORMAT JSON); psycopg2 la entrega ya decodificada o como texto"""
+    if isinstance(explain, str):
+        explain = json.loads(explain)
+    raiz = explain[0]['Plan']
+    filas, pendientes = 0.0, [raiz]
+    while pendientes:
+        nodo = pendientes.pop()
+        filas = max(filas, float(nodo.get('Plan Rows', 0)))
+        pendientes.extend(nodo.get('Plans', ()))
+    return PlanEstimado(float(raiz.get('Total Cost', 0)), filas, raiz.get('Node Type', ''))
+
+
+class GuardiaCostos:
+    """
+    Ejecuta el SQL generado en una transacción de solo lectura con statement_timeout, después de
+    estimar su plan con EXPLAIN (cacheado por SQL canónico). Si el plan supera el costo o las filas
+    máximas se intenta una reescritura más barata (cubos); si no la hay, la consulta se rechaza.
+    """
+
+    def __init__(self, costo_maximo: float, filas_maximas: float, timeout_ms: int, planes: CacheLRU,
+                 reescribir: Optional[Callable[[str], Optional[str]]] = None):
+        self.costo_maximo = costo_maximo
+        self.filas_maximas = filas_maximas
+        self.timeout_ms = timeout_ms
+        self.planes = planes
+        self._reescribir = reescribir
+        self._lock = threading.Lock()
+        self.contadores = {'ejecutadas': 0, 'explicadas': 0, 'rechazadas': 0, 'reescritas': 0, 'canceladas': 0}
+
+    def _contar(self, evento: str):
+        with self._lock:
+            self.contadores[evento] += 1
+
+    def excede(self, plan: PlanEstimado) -> bool:
+        return plan.costo > self.costo_maximo or plan.filas > self.filas_maximas
+
+    def _plan(self, cur, sql: str) -> PlanEstimado:
+        plan = self.planes.obtener(sql)
+        if plan is None:
+            cur.execute("EXPLAIN (FORMAT JSON) " + sql)
+            plan = resumir_plan(cur.fetchone()[0])
+            self.planes.guardar(sql, plan)
+            self._contar('explicadas')
+        return plan
+
+    def ejecutar(self, conn, sql: str) -> list:
+        """Filas de la consulta como diccionarios; ConsultaCostosaError si se rechaza o se cancela"""
+        cur = conn.cursor()
+        try:
+            # Deben ser las primeras sentencias de la transacción
+            cur.execute("SET TRANSACTION READ ONLY")
+            cur.execute(f"SET LOCAL statement_timeout = {int(self.timeout_ms)}")
+
+            plan = self._plan(cur, sql)
+            if self.excede(plan):
+                alternativa = self._reescribir(sql) if self._reescribir else None
+                if alternativa is None or self.excede(self._plan(cur, alternativa)):
+                    self._contar('rechazadas')
+                    log.info("🛑 SQL rechazado por costo (%.0f, %.0f filas): %s", plan.costo, plan.filas, sql)
+                    raise ConsultaCostosaError(
+                        f"la consulta es demasiado costosa (costo estimado {plan.costo:,.0f}, "
+                        f"{plan.filas:,.0f} filas intermedias); intenta acotarla por año, región o causa"
+                    )
+                self._contar('reescritas')
+                sql = alternativa
+        finally:
+            cur.close()
+
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        try:
+            cur.execute(sql)
+            filas = cur.fetchall()
+        except psycopg2.extensions.QueryCanceledError as err:
+            self._contar('canceladas')
+            raise ConsultaCostosaError(
+                f"la consulta superó el tiempo máximo de {self.timeout_ms} ms; intenta acotarla"
+            ) from err
+        finally:
+            cur.close()
+        conn.rollback()  # Cerrar la transacción de solo lectura
+        self._contar('ejecutadas')
+        return [dict(fila) for fila in filas]
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            datos = dict(self.contadores)
+        datos.update({
+            "costo_maximo": self.costo_maximo,
+            "filas_maximas": self.filas_maximas,
+            "timeout_ms": self.timeout_ms,
+            "planes": self.planes.estadisticas()
+        })
+        return datos
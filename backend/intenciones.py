@@ -0,0 +1,212 @@
+import re
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+from cache import normalizar_texto
+from slots import es_comuna_ambigua, extraer_slots, separar_slots, CAUSAS_SQL
+
+# Patrones (sobre texto normalizado: minúsculas y sin tildes) que identifican cada intención
+PATRONES_INTENCION = {
+    'principales_causas': re.compile(r"\b(principal(es)? causas?|causas? (mas comun(es)?|principal(es)?)|causas? de muerte mas)\b"),
+    'por_region': re.compile(r"\b(por region(es)?|en cada region|cada region|lista de (las )?regiones|regiones con mas)\b"),
+    'por_anio': re.compile(r"\b(por anos?|cada ano|por anio)\b"),
+    'por_sexo': re.compile(r"\b(por sexo|por genero|hombres y mujeres|mujeres y hombres)\b"),
+    'por_mes': re.compile(r"\b(por mes(es)?|cada mes|que mes|mes (con|tuvo|hubo) mas)\b"),
+    'conteo': re.compile(r"\b(cuant[oa]s|total de|numero de|cantidad de)\b"),
+}
+
+# La pregunta debe referirse a defunciones
+PATRON_DEFUNCIONES = re.compile(r"\b(muertes?|defunciones|defuncion|fallecid[oa]s|fallecimientos|murieron|mortalidad|causas?)\b")
+
+# Palabras que no cambian el resultado de una plantilla. Cualquier otra palabra (o número) que no sea un
+# slot ni parte de un patrón de intención es un filtro que las plantillas no saben aplicar: se usa el LLM
+PALABRAS_NEUTRAS = frozenset((
+    'el la los las lo un una de del en por para y a al con que cual cuales es son fue fueron era hubo hay '
+    'ha han habido tuvo tiene se registraron registradas registrados registro ocurrieron total totales '
+    'personas cantidad chile pais nacional todo toda todos todas general dataset datos me dime dame muestra '
+    'muestrame mostrar quiero saber ver puedes podrias decir'
+).split())
+
+# Palabras neutras solo si se menciona el slot ("la comuna de Puente Alto" sí, "por comuna" no)
+PALABRAS_SLOT = {
+    'region': frozenset('region regiones libertador bernardo b antartica chilena carlos ibanez campo'.split()),
+    'comuna': frozenset(('comuna',)),
+    'año': frozenset(('ano', 'anio')),
+    'mes': frozenset(('mes',)),
+}
+
+# Slot que una intención agrupa en vez de filtrar ("hombres y mujeres" es por_sexo)
+SLOT_AGRUPADO = {'por_sexo': 'sexo'}
+
+# Preguntas en singular ("la principal causa", "qué mes") devuelven solo la primera fila
+PATRON_SINGULAR = re.compile(r"\b(la principal|la causa mas|cual es la|que mes|mes (con|tuvo|hubo) mas)\b")
+
+
+def _palabras_sin_explicar(texto: str, valores: dict) -> list:
+    """Palabras del texto (ya sin slots) que no cubre ningún patrón ni son neutras"""
+    patrones = [*PATRONES_INTENCION.values(), PATRON_DEFUNCIONES, PATRON_SINGULAR]
+    cubierto = [False] * len(texto)
+    palabras = list(re.finditer(r"\S+", texto))
+    # Se prueba cada patrón desde cada palabra: las coincidencias pueden solaparse ("que mes tuvo mas")
+    for patron in patrones:
+        for palabra in palabras:
+            m = patron.match(texto, palabra.start())
+            if m:
+                cubierto[m.start():m.end()] = [True] * (m.end() - m.start())
+
+    neutras = PALABRAS_NEUTRAS.union(*(PALABRAS_SLOT.get(slot, ()) for slot in valores))
+    return [p.group(0) for p in palabras
+            if not all(cubierto[p.start():p.end()]) and p.group(0) not in neutras]
+
+
+@dataclass
+class Intencion:
+    nombre: str
+    sql: str
+    confianza: float
+    slots: dict
+
+
+# Las plantillas producen SQL autocontenido, con los valores como literales y no como parámetros %s: ese
+# texto pasa por el mismo camino que el SQL del LLM (analizador, clave canónica de cache, reescritura a
+# cubos, motor columnar e historial de la conversación), que trabaja sobre SQL sin parámetros. Los valores
+# nunca son texto del usuario: vienen de vocabularios cerrados (regiones, sexos, causas, comunas de
+# ubicaciones) o son enteros, y las comillas se duplican igual que en un literal estándar de PostgreSQL.
+def _literal(valor: str) -> str:
+    """Literal SQL para valores de vocabulario cerrado"""
+    return "'" + str(valor).replace("'", "''") + "'"
+
+
+def construir_sql(nombre: str, slots: dict, singular: bool = False) -> str:
+    """Construir SQL a partir de la plantilla de la intención y los slots resueltos"""
+    joins = []
+    filtros = []
+
+    if 'año' in slots:
+        filtros.append(f'd."ANIO" = {int(slots["año"])}')
+    if 'mes_num' in slots:
+        filtros.append(f'EXTRACT(MONTH FROM d."FECHA_DEF") = {int(slots["mes_num"])}')
+    if 'sexo' in slots and SLOT_AGRUPADO.get(nombre) != 'sexo':
+        filtros.append(f'd."SEXO_NOMBRE" = {_literal(slots["sexo"])}')
+    if 'causa' in slots:
+        filtros.append(CAUSAS_SQL[slots['causa']])
+    if 'region' in slots or 'comuna' in slots or nombre == 'por_region':
+        joins.append('JOIN ubicaciones u ON d."COD_COMUNA" = u."COD_COMUNA"')
+    if 'region' in slots:
+        filtros.append(f'u."NOMBRE_REGION" = {_literal(slots["region"])}')
+    if 'comuna' in slots:
+        filtros.append(f'u."COMUNA" = {_literal(slots["comuna"])}')
+    if nombre == 'principales_causas':
+        joins.append('JOIN diagnosticos diag ON d."DIAG1" = diag.codigo_diagnostico')
+
+    desde = "FROM defunciones_principales d" + "".join(f" {j}" for j in joins)
+    donde = f" WHERE {' AND '.join(filtros)}" if filtros else ""
+
+    if nombre == 'conteo':
+        return f"SELECT COUNT(*) AS total_defunciones {desde}{donde}"
+    if nombre == 'por_region':
+        return (f'SELECT u."NOMBRE_REGION", COUNT(*) AS total_defunciones {desde}{donde} '
+                f'GROUP BY u."NOMBRE_REGION" ORDER BY total_defunciones DESC')
+    if nombre == 'por_anio':
+        return (f'SELECT d."ANIO", COUNT(*) AS total_defunciones {desde}{donde} '
+                f'GROUP BY d."ANIO" ORDER BY d."ANIO"')
+    if nombre == 'por_sexo':
+        return (f'SELECT d."SEXO_NOMBRE", COUNT(*) AS total_defunciones {desde}{donde} '
+                f'GROUP BY d."SEXO_NOMBRE" ORDER BY total_defunciones DESC')
+    if nombre == 'por_mes':
+        orden = "ORDER BY total_defunciones DESC LIMIT 1" if singular else "ORDER BY mes"
+        return (f'SELECT EXTRACT(MONTH FROM d."FECHA_DEF") AS mes, COUNT(*) AS total_defunciones {desde}{donde} '
+                f'GROUP BY mes {orden}')
+    if nombre == 'principales_causas':
+        limite = 1 if singular else 10
+        return (f'SELECT diag.descripcion_capitulo, COUNT(*) AS total_defunciones {desde}{donde} '
+                f'GROUP BY diag.descripcion_capitulo ORDER BY total_defunciones DESC LIMIT {limite}')
+    raise ValueError(f"Intención desconocida: {nombre}")
+
+
+class MotorIntenciones:
+    """Resolver preguntas frecuentes con plantillas SQL, sin generar SQL con el LLM"""
+
+    def __init__(self, umbral: float = 0.8):
+        self.umbral = umbral
+        self._lock = threading.Lock()
+        self.evaluadas = 0
+        self.resueltas = 0
+        self.bajo_umbral = 0
+        self.sin_intencion = 0
+        self.por_intencion = {}
+
+    def clasificar(self, pregunta: str, original: Optional[str] = None) -> Optional[Intencion]:
+        """
+        Clasificar la pregunta y calcular la confianza (sin registrar telemetría). Si la pregunta es la
+        expansión de `original` y la plantilla pierde un slot de la original ("¿cuántas muertes hubo en
+        2024?" expandida a "cuántas defunciones hay en total"), se clasifica la original
+        """
+        intencion = self._clasificar(pregunta)
+        if original is not None and original != pregunta and intencion is not None:
+            if any(intencion.slots.get(slot) != valor for slot, valor in extraer_slots(original).items()):
+                return self._clasificar(original)
+            # La expansión tampoco puede descartar filtros de la original ("... de mayores de 80 hubo en 2024")
+            resto, valores = separar_slots(original)
+            if _palabras_sin_explicar(normalizar_texto(resto), valores):
+                intencion.confianza = 0.0
+        return intencion
+
+    def _clasificar(self, pregunta: str) -> Optional[Intencion]:
+        texto = normalizar_texto(pregunta)
+        if not PATRON_DEFUNCIONES.search(texto):
+            return None
+
+        candidatas = [nombre for nombre, patron in PATRONES_INTENCION.items() if patron.search(texto)]
+        # "cuántas muertes por región" es una agrupación, no un conteo simple
+        if len(candidatas) > 1 and 'conteo' in candidatas:
+            candidatas.remove('conteo')
+        if not candidatas:
+            return None
+
+        slots = extraer_slots(pregunta)
+        confianza = 1.0 if len(candidatas) == 1 else 0.5
+
+        nombre = candidatas[0]
+        # Solo si los slots y los patrones explican toda la pregunta: "por covid", "de niños" o
+        # "mayores de 80" son filtros que la plantilla dejaría fuera
+        resto, valores = separar_slots(pregunta)
+        if _palabras_sin_explicar(normalizar_texto(resto), valores):
+            confianza = 0.0
+        # Varios valores del mismo slot ("2023 y 2024", "Valparaíso y el Maule"): la plantilla filtra uno
+        if any(len(v) > 1 for slot, v in valores.items() if slot != SLOT_AGRUPADO.get(nombre)):
+            confianza = 0.0
+        # Comunas con nombre de palabra común ("Victoria", "Primavera"): aun con contexto, las confirma el LLM
+        if any(es_comuna_ambigua(comuna) for comuna in valores.get('comuna', ())):
+            confianza = 0.0
+
+        singular = bool(PATRON_SINGULAR.search(texto))
+        return Intencion(nombre, construir_sql(nombre, slots, singular), confianza, slots)
+
+    def resolver(self, pregunta: str, original: Optional[str] = None) -> Optional[Intencion]:
+        """Retornar la intención si supera el umbral de confianza; registra telemetría"""
+        intencion = self.clasificar(pregunta, original)
+        with self._lock:
+            self.evaluadas += 1
+            if intencion is None:
+                self.sin_intencion += 1
+                return None
+            if intencion.confianza < self.umbral:
+                self.bajo_umbral += 1
+                return None
+            self.resueltas += 1
+            self.por_intencion[intencion.nombre] = self.por_intencion.get(intencion.nombre, 0) + 1
+        return intencion
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {
+                "umbral": self.umbral,
+                "evaluadas": self.evaluadas,
+                "resueltas": self.resueltas,
+                "bajo_umbral": self.bajo_umbral,
+                "sin_intencion": self.sin_intencion,
+                "cobertura": round(self.resueltas / self.evaluadas, 4) if self.evaluadas else 0.0,
+                "por_intencion": dict(self.por_intencion)
+            }
@@ -1,8 +1,9 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from typing import Optional, Dict, Any
 import psycopg2
 import psycopg2.extras
 import anthropic
@@ -10,13 +11,39 @@ from datetime import datetime, timedelta
 import uuid
 import hashlib
 import jwt
+import logging
 import os
 import json
+import asyncio
+import threading
+import time
 from dotenv import load_dotenv
+from conexiones import PoolConexiones
+from metricas import LIMITES_ETAPAS, etapa, iniciar_traza, registro, terminar_traza
+from cache import CacheLRU, normalizar_texto, clave_cache
+from formateador import formatear_respuesta, responder_seguimiento
+from contexto import ContextoConversacion, AlmacenContextos
+from backends_contexto import crear_backend
+from intenciones import MotorIntenciones
+from coalescencia import Coalescedor
+from rollups import CUBOS, reescribir_con_rollup, resultados_equivalentes
+from motor_columnar import MotorColumnar, NUMPY_DISPONIBLE
+from terminos import AutomataTerminos
+from notificaciones import EscuchaNotificaciones, notificar
+from configuracion import CacheConfiguracion
+from prefetch import PrefetchConsultas, predecir_consultas
+from slots import configurar_comunas, extractor_activo, extraer_slots
+from reglas_expansion import cargar_reglas, configurar_reglas, motor_activo
+from analizador_sql import analizador_activo, analizar_sql, configurar_analizador
+from guardia_costos import GuardiaCostos
 
 # Cargar variables de entorno
 load_dotenv()
 
+# Log de la ruta caliente del chat (nivel configurable con LOG_NIVEL, ej. DEBUG)
+logging.basicConfig(level=os.getenv("LOG_NIVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+log = logging.getLogger("defunciones.chat")
+
 # Configuración
 SECRET_KEY = "tu_clave_secreta_aqui_cambiar_en_produccion"
 ALGORITHM = "HS256"
@@ -24,6 +51,24 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 480  # 8 horas para desarrollo
 
 app = FastAPI(title="Chatbot Defunciones Chile", version="2.0.0")
 
+@app.middleware("http")
+async def medir_solicitud(request: Request, call_next):
+    """Traza por solicitud: histograma por ruta, encabezado Server-Timing y una línea de log con las etapas"""
+    traza, token = iniciar_traza(request.url.path)
+    try:
+        response = await call_next(request)
+    finally:
+        terminar_traza(token)
+    ruta = getattr(request.scope.get("route"), "path", "otra")
+    registro.histograma(
+        "solicitud_duracion_segundos", "Duración de las solicitudes HTTP por ruta",
+        limites=LIMITES_ETAPAS, ruta=ruta, metodo=request.method
+    ).observar(traza.total())
+    response.headers["Server-Timing"] = traza.server_timing()
+    if traza.etapas:
+        log.info("⏱️ %s %s %s", request.method, ruta, response.headers["Server-Timing"])
+    return response
+
 # Configurar CORS
 app.add_middleware(
     CORSMiddleware,
@@ -33,17 +78,176 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Configuración PostgreSQL (tu configuración actual)
+# Configuración PostgreSQL (tu configuración actual); DB_* permite apuntar a otra base (ej. benchmarks)
 db_config = {
-    'host': '192.168.1.7',
-    'user': 'evaluacion',
-    'password': 'inacap123',
-    'database': 'salud_chile',
-    'port': 5432
+    'host': os.getenv("DB_HOST", '192.168.1.7'),
+    'user': os.getenv("DB_USER", 'evaluacion'),
+    'password': os.getenv("DB_PASSWORD", 'inacap123'),
+    'database': os.getenv("DB_NAME", 'salud_chile'),
+    'port': int(os.getenv("DB_PORT", "5432"))
 }
 
-# API Claude (tu configuración actual)
-client = anthropic.Anthropic(api_key="ANTHROPIC_API_KEY")
+# Pool de conexiones compartido por todos los endpoints
+pool = PoolConexiones(
+    db_config,
+    minimo=int(os.getenv("DB_POOL_MIN", "2")),
+    maximo=int(os.getenv("DB_POOL_MAX", "10")),
+    timeout_adquirir=float(os.getenv("DB_POOL_TIMEOUT", "5")),
+    chequeo_inactividad=float(os.getenv("DB_POOL_CHEQUEO", "30"))
+)
+
+@app.on_event("startup")
+def abrir_pool():
+    """Precalentar conexiones mínimas del pool"""
+    try:
+        pool.abrir()
+    except psycopg2.Error as err:
+        log.warning("⚠️ No se pudo precalentar el pool: %s", err)
+
+# LISTEN/NOTIFY: propagar cambios de administración a todos los workers
+CANAL_TERMINOS = "terminos_excluidos"
+CANAL_CONFIGURACION = "configuracion_prompts"
+escucha_notificaciones = EscuchaNotificaciones(db_config)
+
+@app.on_event("startup")
+def iniciar_notificaciones():
+    """Compilar los términos excluidos y escuchar sus cambios"""
+    recargar_terminos_excluidos()
+    escucha_notificaciones.suscribir(CANAL_TERMINOS, lambda _: recargar_terminos_excluidos())
+    config_prompts.refrescar()
+    escucha_notificaciones.suscribir(CANAL_CONFIGURACION, lambda _: config_prompts.refrescar())
+    escucha_notificaciones.iniciar()
+
+@app.on_event("startup")
+def cargar_vocabulario_slots():
+    """Compilar el extractor de slots con las comunas de ubicaciones"""
+    try:
+        with pool.conexion() as conn:
+            cur = conn.cursor()
+            cur.execute('SELECT DISTINCT "COMUNA" FROM ubicaciones WHERE "COMUNA" IS NOT NULL')
+            extractor = configurar_comunas(fila[0] for fila in cur.fetchall())
+            cur.close()
+        log.info("🔤 Extractor de slots compilado (%s comunas)", extractor.comunas)
+    except psycopg2.Error as err:
+        log.warning("⚠️ No se pudieron cargar las comunas (el extractor usa solo regiones): %s", err)
+
+@app.on_event("startup")
+def cargar_reglas_expansion():
+    """Agregar reglas de expansión desde REGLAS_EXPANSION_ARCHIVO (JSON), sin cambiar código"""
+    ruta = os.getenv("REGLAS_EXPANSION_ARCHIVO")
+    if not ruta:
+        return
+    try:
+        motor = configurar_reglas(cargar_reglas(ruta))
+        log.info("📐 Reglas de expansión cargadas (%s en total)", len(motor.reglas))
+    except (OSError, ValueError, KeyError, TypeError) as err:
+        log.warning("⚠️ No se pudieron cargar las reglas de expansión de %s: %s", ruta, err)
+
+@app.on_event("startup")
+def detectar_rollups():
+    """Detectar los cubos pre-agregados disponibles (creados por database.crear_rollups)"""
+    try:
+        with pool.conexion() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT matviewname FROM pg_matviews WHERE matviewname = ANY(%s) AND ispopulated",
+                (list(CUBOS),)
+            )
+            cubos_disponibles.update(fila[0] for fila in cur.fetchall())
+            cur.close()
+        log.info("🧊 Cubos disponibles: %s", sorted(cubos_disponibles) or 'ninguno')
+    except psycopg2.Error as err:
+        log.warning("⚠️ No se pudieron detectar los cubos: %s", err)
+
+@app.on_event("startup")
+def iniciar_motor_columnar():
+    """Cargar el motor columnar en segundo plano (no retrasa el arranque)"""
+    if MOTOR_COLUMNAR_ACTIVO:
+        threading.Thread(target=cargar_motor_columnar, daemon=True).start()
+    elif os.getenv("MOTOR_COLUMNAR", "1") == "1":
+        log.warning("⚠️ numpy no está instalado, motor columnar deshabilitado")
+
+@app.on_event("shutdown")
+def cerrar_pool():
+    """Cerrar conexiones del pool al apagar"""
+    escucha_notificaciones.detener()
+    pool.cerrar()
+
+# API Claude (tu configuración actual) - cliente asíncrono para no bloquear el event loop
+client = anthropic.AsyncAnthropic(api_key="ANTHROPIC_API_KEY")
+
+def registrar_tokens_llm(llamada: str, uso):
+    """Contar las llamadas al LLM y sus tokens de entrada y salida (message.usage)"""
+    registro.incrementar("llm_llamadas_total", 1, "Llamadas al LLM", llamada=llamada)
+    if uso is None:
+        return
+    for tipo, valor in (("entrada", getattr(uso, "input_tokens", 0)), ("salida", getattr(uso, "output_tokens", 0))):
+        registro.incrementar("llm_tokens_total", valor or 0, "Tokens consumidos en llamadas al LLM",
+                             llamada=llamada, tipo=tipo)
+
+# Límites de concurrencia por etapa del pipeline /chat
+LIMITE_LLM = asyncio.Semaphore(int(os.getenv("CHAT_CONCURRENCIA_LLM", "64")))
+LIMITE_SQL = asyncio.Semaphore(int(os.getenv("CHAT_CONCURRENCIA_SQL", os.getenv("DB_POOL_MAX", "10"))))
+LIMITE_BD = asyncio.Semaphore(int(os.getenv("CHAT_CONCURRENCIA_BD", os.getenv("DB_POOL_MAX", "10"))))
+
+# Cache de SQL generado por el LLM (pregunta expandida + contexto + configuración)
+cache_sql = CacheLRU(
+    "sql_generado",
+    max_entradas=int(os.getenv("SQL_CACHE_MAX", "512")),
+    ttl=float(os.getenv("SQL_CACHE_TTL", "3600"))
+)
+
+# Cache de resultados de ejecutar_sql (compartida por /chat y /chat/details)
+cache_resultados = CacheLRU(
+    "resultados_sql",
+    max_entradas=int(os.getenv("RESULTADOS_CACHE_MAX", "2048")),
+    ttl=float(os.getenv("RESULTADOS_CACHE_TTL", "86400")),
+    max_bytes=int(os.getenv("RESULTADOS_CACHE_BYTES", str(64 * 1024 * 1024)))
+)
+
+# Plantillas SQL para preguntas frecuentes (evitan la llamada al LLM para generar SQL)
+INTENCIONES_ACTIVAS = os.getenv("INTENCIONES_ACTIVAS", "1") == "1"
+motor_intenciones = MotorIntenciones(umbral=float(os.getenv("INTENCION_UMBRAL", "0.8")))
+
+# Seguimientos ("suma", "cuántos son", "cuál es la más común") respondidos con las filas de la respuesta anterior
+SEGUIMIENTO_LOCAL_ACTIVO = os.getenv("SEGUIMIENTO_LOCAL", "1") == "1"
+SEGUIMIENTO_MAX_FILAS = int(os.getenv("SEGUIMIENTO_MAX_FILAS", "100"))
+estadisticas_seguimiento = {"respondidos": 0, "por_operacion": {}}
+
+# Single-flight: preguntas idénticas concurrentes comparten la misma llamada al LLM / a la BD
+coalescedor_sql = Coalescedor("generacion_sql")
+coalescedor_resultados = Coalescedor("ejecucion_sql")
+coalescedor_respuestas = Coalescedor("generacion_respuesta")
+
+# Reescritura de conteos agrupados hacia los cubos pre-agregados (ver rollups.py)
+ROLLUPS_ACTIVOS = os.getenv("ROLLUPS_ACTIVOS", "1") == "1"
+# Modo verificación: ejecutar ambas consultas, comparar y responder con la original
+ROLLUP_VERIFICAR = os.getenv("ROLLUP_VERIFICAR", "0") == "1"
+cubos_disponibles = set()
+estadisticas_rollups = {'reescritas': 0, 'verificadas': 0, 'discrepancias': 0, 'errores': 0}
+_lock_rollups = threading.Lock()
+
+# Antes de ejecutar el SQL generado: EXPLAIN (cacheado) contra un costo y filas máximas, y ejecución
+# en transacción de solo lectura con statement_timeout (ver guardia_costos.py). La guardia reescribe
+# mientras tiene una conexión del pool: solo con la versión ya cacheada, sin tomar una segunda conexión
+guardia_costos = GuardiaCostos(
+    costo_maximo=float(os.getenv("SQL_COSTO_MAXIMO", "500000")),
+    filas_maximas=float(os.getenv("SQL_FILAS_ESTIMADAS_MAXIMAS", "5000000")),
+    timeout_ms=int(os.getenv("SQL_TIMEOUT_MS", "15000")),
+    planes=CacheLRU("planes_sql", max_entradas=int(os.getenv("SQL_PLANES_MAX", "1024")),
+                    ttl=float(os.getenv("SQL_PLANES_TTL", "3600"))),
+    reescribir=lambda sql: reescribir_rollup(sql, refrescar=False)
+)
+
+# Copia columnar en memoria del dataset para conteos frecuentes (opcional, requiere numpy)
+MOTOR_COLUMNAR_ACTIVO = os.getenv("MOTOR_COLUMNAR", "1") == "1" and NUMPY_DISPONIBLE
+motor_columnar = MotorColumnar()
+_lock_motor_columnar = threading.Lock()
+
+async def en_hilo(limite: asyncio.Semaphore, funcion, *args):
+    """Ejecutar una función bloqueante (psycopg2) en un hilo, respetando el límite de la etapa"""
+    async with limite:
+        return await asyncio.to_thread(funcion, *args)
 
 # === TU ESTRUCTURA Y CONTEXTO ORIGINAL ===
 
@@ -64,6 +268,9 @@ CAMPOS IMPORTANTES:
 - "NOMBRE_REGION": Regiones de Chile
 """
 
+# El SQL generado solo puede leer las tablas y columnas que se le describen al LLM (ver analizador_sql.py)
+configurar_analizador(ESTRUCTURA_TABLA, limite_filas=int(os.getenv("SQL_LIMITE_FILAS", "1000")))
+
 CONTEXT = """
 CONJUNTO DE DATOS: DEFUNCIONES CHILE 2023-2025
 Fuente: DEIS - Ministerio de Salud Chile (datos oficiales preliminares)
@@ -93,451 +300,235 @@ TEMPORAL:
 
 # === NUEVAS FUNCIONES PARA COMPLETAR EVALUACIÓN 3 ===
 
+# Términos excluidos compilados en un autómata; se reconstruye solo cuando cambian (NOTIFY)
+automata_terminos: Optional[AutomataTerminos] = None
+_lock_terminos = threading.Lock()
+
+def recargar_terminos_excluidos() -> bool:
+    """Cargar los términos activos y reconstruir el autómata"""
+    global automata_terminos
+    with _lock_terminos:
+        try:
+            with pool.conexion() as conn:
+                cur = conn.cursor()
+                cur.execute("SELECT termino FROM terminos_excluidos WHERE activo = true")
+                terminos = [row[0] for row in cur.fetchall()]
+                cur.close()
+        except psycopg2.Error as err:
+            log.warning("⚠️ No se pudieron cargar los términos excluidos: %s", err)
+            return False
+        automata_terminos = AutomataTerminos(terminos)
+        log.info("🚫 Términos excluidos compilados: %s", len(automata_terminos))
+        return True
+
 def verificar_terminos_excluidos(pregunta: str) -> bool:
     """Verificar si la pregunta contiene términos excluidos (Punto E)"""
-    try:
-        conn = psycopg2.connect(**db_config)
-        cur = conn.cursor()
-        
-        cur.execute("SELECT termino FROM terminos_excluidos WHERE activo = true")
-        terminos_prohibidos = [row[0].lower() for row in cur.fetchall()]
-        cur.close()
-        conn.close()
-        
-        pregunta_lower = pregunta.lower()
-        for termino in terminos_prohibidos:
-            if termino in pregunta_lower:
-                return True
-        return False
-    except:
+    if automata_terminos is None and not recargar_terminos_excluidos():
         return False
+    return automata_terminos.contiene(pregunta)
 
 def obtener_configuracion_activa() -> dict:
     """Obtener configuración de prompts activa (Punto F)"""
-    try:
-        conn = psycopg2.connect(**db_config)
+    with pool.conexion() as conn:
         cur = conn.cursor()
-        
         cur.execute("SELECT configuracion FROM configuracion_prompts WHERE activo = true ORDER BY created_at DESC LIMIT 1")
         result = cur.fetchone()
         cur.close()
-        conn.close()
-        
-        if result:
-            return json.loads(result[0])
-        return {}
-    except:
-        return {}
+    
+    if result:
+        return json.loads(result[0])
+    return {}
+
+# Configuración activa en memoria: se refresca por NOTIFY y, como respaldo, cada CONFIG_PROMPTS_INTERVALO segundos.
+# Al cambiar se descarta el SQL generado con la configuración anterior.
+config_prompts = CacheConfiguracion(
+    obtener_configuracion_activa,
+    intervalo=float(os.getenv("CONFIG_PROMPTS_INTERVALO", "300")),
+    al_cambiar=lambda: cache_sql.invalidar()
+)
 
 # === TU SISTEMA DE HILADO INTELIGENTE COMPLETO ===
 
-class ContextoConversacion:
-    def __init__(self):
-        self.sesion_actual = {
-            'ultima_region': None,
-            'ultimo_año': None,
-            'ultimo_mes': None,
-            'ultimo_mes_num': None,
-            'ultimo_sexo': None,
-            'ultima_causa': None,
-            'ultimo_tema': None
-        }
-        self.historial_sesion = []
-        self.id_sesion = str(uuid.uuid4())[:8]
+def clave_contexto(user_id: int, conversation_id: str) -> str:
+    """Clave del contexto: por conversación (incluye al usuario para no compartir contextos ajenos)"""
+    return f"{user_id}:{conversation_id}"
+
+def rehidratar_contexto(clave: str) -> Optional[ContextoConversacion]:
+    """
+    Reconstruir el contexto de una conversación reabierta desde mensajes: se parte del último
+    snapshot guardado (O(1)) y solo se reproducen las preguntas posteriores a él (mensajes antiguos sin snapshot)
+    """
+    user_id, conversation_id = clave.split(":", 1)
+    with pool.conexion() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT m.contexto_snapshot, m.pregunta, m.sql_query, m.created_at
+            FROM mensajes m
+            JOIN conversaciones c ON m.conversation_id = c.id
+            WHERE m.conversation_id = %s AND c.user_id = %s
+              AND (c.contexto_reiniciado_at IS NULL OR m.created_at > c.contexto_reiniciado_at)
+            ORDER BY m.id DESC
+            LIMIT 10
+        """, (conversation_id, int(user_id)))
+        filas = cur.fetchall()
+        cur.close()
     
-    def detectar_contexto_en_pregunta(self, pregunta):
-        """Detectar y extraer contexto de la pregunta actual"""
-        pregunta_lower = pregunta.lower()
-        
-        # Detectar regiones
-        regiones_map = {
-            'santiago': 'Metropolitana de Santiago',
-            'metropolitana': 'Metropolitana de Santiago',
-            'valparaíso': 'De Valparaíso',
-            'valpo': 'De Valparaíso',
-            'biobío': 'Del Biobío',
-            'bio bio': 'Del Biobío',
-            'araucanía': 'De La Araucanía',
-            'temuco': 'De La Araucanía',
-            'antofagasta': 'De Antofagasta',
-            'coquimbo': 'De Coquimbo',
-            'tarapacá': 'De Tarapacá',
-            'atacama': 'De Atacama',
-            'ohiggins': 'Del Libertador B. O\'Higgins',
-            'maule': 'Del Maule',
-            'los ríos': 'De Los Ríos',
-            'los lagos': 'De Los Lagos',
-            'aysén': 'De Aysén',
-            'magallanes': 'De Magallanes'
-        }
-        
-        for key, region in regiones_map.items():
-            if key in pregunta_lower:
-                self.sesion_actual['ultima_region'] = region
-                break
-        
-        # Detectar años
-        for año in ['2023', '2024', '2025']:
-            if año in pregunta:
-                self.sesion_actual['ultimo_año'] = año
-                break
-        
-        # Detectar meses
-        meses_map = {
-            'enero': '01', 'febrero': '02', 'marzo': '03', 'abril': '04',
-            'mayo': '05', 'junio': '06', 'julio': '07', 'agosto': '08',
-            'septiembre': '09', 'octubre': '10', 'noviembre': '11', 'diciembre': '12'
-        }
-        
-        for mes_nombre, mes_num in meses_map.items():
-            if mes_nombre in pregunta_lower:
-                self.sesion_actual['ultimo_mes'] = mes_nombre
-                self.sesion_actual['ultimo_mes_num'] = mes_num
-                break
-        
-        # Detectar sexo
-        if 'hombre' in pregunta_lower or 'masculino' in pregunta_lower:
-            self.sesion_actual['ultimo_sexo'] = 'Hombre'
-        elif 'mujer' in pregunta_lower or 'femenino' in pregunta_lower:
-            self.sesion_actual['ultimo_sexo'] = 'Mujer'
-        
-        # Detectar causas
-        if 'cáncer' in pregunta_lower or 'tumor' in pregunta_lower:
-            self.sesion_actual['ultima_causa'] = 'cáncer'
-        elif 'cardiovascular' in pregunta_lower or 'corazón' in pregunta_lower:
-            self.sesion_actual['ultima_causa'] = 'cardiovascular'
-        elif 'respiratorio' in pregunta_lower or 'pulmón' in pregunta_lower:
-            self.sesion_actual['ultima_causa'] = 'respiratorio'
-        elif 'diabetes' in pregunta_lower:
-            self.sesion_actual['ultima_causa'] = 'diabetes'
+    if not filas:
+        return None
     
-    def es_pregunta_continuacion(self, pregunta):
-        """Detectar si es una pregunta de continuación"""
-        palabras_continuacion = [
-            'cuál es la más común', 'cuál es la principal', 'y en hombres', 'y en mujeres',
-            'también', 'además', 'y en', 'qué tal en', 'y por', 'y el', 'y la',
-            'más común', 'principal', 'primero', 'mayor', 'menor',
-            'puedes darme', 'dame la', 'lista', 'listado', 'cuáles son', 'muéstrame',
-            'cuántos son', 'cuántas son', 'puedes contarlas', 'contarlos', 'en total',
-            'suma', 'sumar', 'total', 'coincide', 'da el conjunto'
-        ]
-        
-        pregunta_lower = pregunta.lower()
-        return any(palabra in pregunta_lower for palabra in palabras_continuacion)
+    # Mensajes más recientes que el último snapshot (en orden cronológico)
+    pendientes = []
+    contexto = None
+    for snapshot, pregunta, sql_query, created_at in filas:
+        if snapshot:
+            contexto = ContextoConversacion.desde_dict(json.loads(snapshot))
+            break
+        pendientes.append((pregunta, sql_query, created_at))
+    if contexto is None:
+        contexto = ContextoConversacion()
     
-    def expandir_pregunta_continuacion(self, pregunta):
-        """Expandir preguntas de continuación usando el contexto - VERSIÓN MEJORADA"""
-        pregunta_lower = pregunta.lower()
-        
-        # NUEVO: Detectar preguntas ultra-cortas que necesitan contexto completo
-        preguntas_cortas = ['cuántos?', 'cuántas?', 'cuántos', 'cuántas', 'qué cantidad?', 'total?', 'cantidad?', 'y en que mes hubo mas muerte?', 'y en qué mes hubo más muerte?', 'en que mes hubo mas muertes?', 'qué mes tuvo más muertes?']
-        
-        if any(p in pregunta_lower for p in preguntas_cortas):
-            print(f"🧠 DEBUG - Detectada pregunta corta: '{pregunta}'")
-            
-            # Construir pregunta completa basada en el contexto
-            if self.historial_sesion:
-                # Analizar la pregunta anterior para extraer contexto
-                ultima_pregunta = self.historial_sesion[-1]['pregunta'].lower()
-                print(f"🧠 DEBUG - Última pregunta: '{ultima_pregunta}'")
-                
-                # Analizar también la respuesta anterior si existe
-                ultima_respuesta = ""
-                if len(self.historial_sesion) >= 1:
-                    # Buscar en el historial la última respuesta que mencionó un mes
-                    for item in reversed(self.historial_sesion[-3:]):  # Últimas 3 interacciones
-                        respuesta_str = str(item).lower()
-                        for mes in ['enero', 'febrero', 'marzo', 'abril', 'mayo', 'junio', 'julio', 'agosto', 'septiembre', 'octubre', 'noviembre', 'diciembre']:
-                            if mes in respuesta_str:
-                                ultima_respuesta = respuesta_str
-                                print(f"🧠 DEBUG - Encontrado mes '{mes}' en respuesta anterior")
-                                break
-                        if ultima_respuesta:
-                            break
-                
-                # CASO 1: Si la pregunta anterior tenía año y mes específicos
-                if any(año in ultima_pregunta for año in ['2023', '2024', '2025']):
-                    año_encontrado = None
-                    for año in ['2023', '2024', '2025']:
-                        if año in ultima_pregunta:
-                            año_encontrado = año
-                            break
-                    
-                    # Buscar mes en pregunta anterior
-                    mes_encontrado = None
-                    for mes in ['enero', 'febrero', 'marzo', 'abril', 'mayo', 'junio', 'julio', 'agosto', 'septiembre', 'octubre', 'noviembre', 'diciembre']:
-                        if mes in ultima_pregunta:
-                            mes_encontrado = mes
-                            break
-                    
-                    # Si encontramos año y mes
-                    if año_encontrado and mes_encontrado:
-                        expansion = f"cuántas defunciones hubo en {mes_encontrado} de {año_encontrado}"
-                        print(f"🧠 DEBUG - Expansión: '{expansion}'")
-                        return expansion
-                    
-                    # Si solo encontramos año
-                    elif año_encontrado:
-                        expansion = f"cuántas defunciones hubo en {año_encontrado}"
-                        print(f"🧠 DEBUG - Expansión: '{expansion}'")
-                        return expansion
-                
-                # CASO 2: Si la respuesta anterior mencionó un mes específico
-                if ultima_respuesta:
-                    for mes in ['enero', 'febrero', 'marzo', 'abril', 'mayo', 'junio', 'julio', 'agosto', 'septiembre', 'octubre', 'noviembre', 'diciembre']:
-                        if mes in ultima_respuesta:
-                            # ARREGLO: Detectar año dinámicamente del contexto actual
-                            año_contexto = self.sesion_actual.get('ultimo_año')
-                            if not año_contexto:
-                                # Si no hay año en sesión actual, buscar en historial
-                                for año in ['2023', '2024', '2025']:
-                                    if año in ultima_respuesta or año in ultima_pregunta:
-                                        año_contexto = año
-                                        break
-                                # Si aún no encuentra año, usar 2024 por defecto
-                                if not año_contexto:
-                                    año_contexto = "2024"
-                            
-                            expansion = f"cuántas defunciones hubo en {mes} de {año_contexto}"
-                            print(f"🧠 DEBUG - Expansión desde respuesta: '{expansion}' (año detectado: {año_contexto})")
-                            return expansion
-                
-                # CASO 3: Si hay contexto de región activo
-                if self.sesion_actual['ultima_region']:
-                    año_activo = self.sesion_actual.get('ultimo_año', '2024')
-                    if self.sesion_actual['ultimo_año']:
-                        expansion = f"cuántas defunciones hubo en {self.sesion_actual['ultima_region']} en {año_activo}"
-                    else:
-                        expansion = f"cuántas defunciones hubo en {self.sesion_actual['ultima_region']}"
-                    print(f"🧠 DEBUG - Expansión con región: '{expansion}' (año: {año_activo})")
-                    return expansion
-                
-                # CASO 4: Si hay contexto de causa activo
-                if self.sesion_actual['ultima_causa']:
-                    año_activo = self.sesion_actual.get('ultimo_año', '2024')
-                    if self.sesion_actual['ultimo_año']:
-                        expansion = f"cuántas muertes por {self.sesion_actual['ultima_causa']} hubo en {año_activo}"
-                    else:
-                        expansion = f"cuántas muertes por {self.sesion_actual['ultima_causa']} hubo"
-                    print(f"🧠 DEBUG - Expansión con causa: '{expansion}' (año: {año_activo})")
-                    return expansion
-                
-                # CASO 5: NUEVO - Detectar preguntas sobre "qué mes tuvo más muertes"
-                if any(patron in pregunta_lower for patron in ['en que mes', 'qué mes', 'mes hubo mas', 'mes tuvo más']):
-                    año_activo = self.sesion_actual.get('ultimo_año', '2024')
-                    expansion = f"en qué mes de {año_activo} hubo más defunciones"
-                    print(f"🧠 DEBUG - Expansión mes con más muertes: '{expansion}' (año: {año_activo})")
-                    return expansion
-            
-            # Si no hay contexto específico, pregunta general
-            print(f"🧠 DEBUG - Sin contexto específico, usando pregunta general")
-            return "cuántas defunciones hay en total"
-        
-        # CÓDIGO ORIGINAL PARA OTROS TIPOS DE PREGUNTAS...
-        
-        # Detectar referencias temporales como "de este último", "de ese mes", "de este período"
-        referencias_temporales = ['de este último', 'de ese', 'de este', 'del último', 'del mes', 'de ese período']
-        
-        if any(ref in pregunta_lower for ref in referencias_temporales):
-            # Extraer contexto temporal de la respuesta anterior
-            if self.historial_sesion:
-                ultima_respuesta = str(self.historial_sesion[-1]).lower()
-                
-                # Buscar mes en la respuesta anterior
-                meses = ['enero', 'febrero', 'marzo', 'abril', 'mayo', 'junio', 
-                        'julio', 'agosto', 'septiembre', 'octubre', 'noviembre', 'diciembre']
-                mes_encontrado = None
-                año_encontrado = None
-                region_encontrada = None
-                
-                for mes in meses:
-                    if mes in ultima_respuesta:
-                        mes_encontrado = mes
-                        break
-                
-                # Buscar año
-                for año in ['2023', '2024', '2025']:
-                    if año in ultima_respuesta:
-                        año_encontrado = año
-                        break
-                
-                # Buscar región en respuesta anterior
-                if 'antofagasta' in ultima_respuesta:
-                    region_encontrada = 'Antofagasta'
-                elif 'santiago' in ultima_respuesta:
-                    region_encontrada = 'Santiago'
-                
-                # Construir pregunta expandida
-                if mes_encontrado and 'día de la semana' in pregunta_lower:
-                    partes = [f"día de la semana con más defunciones en {mes_encontrado}"]
-                    if año_encontrado:
-                        partes.append(f"de {año_encontrado}")
-                    if region_encontrada:
-                        partes.append(f"en {region_encontrada}")
-                    return " ".join(partes)
-        
-        # Detectar preguntas sobre totales simples
-        if any(palabra in pregunta_lower for palabra in ['dame la cantidad total', 'total de datos', 'cantidad total']):
-            return "total de defunciones en el dataset"
-        
-        # Detectar preguntas que piden listas o detalles
-        if any(palabra in pregunta_lower for palabra in ['lista', 'listado', 'cuáles son', 'dame la', 'muéstrame']):
-            # Si la pregunta anterior fue sobre regiones, expandir para lista de regiones
-            if self.historial_sesion and 'region' in str(self.historial_sesion[-1]).lower():
-                return "lista de todas las regiones con número de defunciones"
-            elif 'lista' in pregunta_lower:
-                return "lista de regiones de Chile con defunciones"
-        
-        # Detectar preguntas sobre sumas o totales del contexto anterior
-        if any(palabra in pregunta_lower for palabra in ['suma', 'total', 'sumar', 'coincide', 'da el conjunto']):
-            if self.historial_sesion:
-                ultima_pregunta = self.historial_sesion[-1]['pregunta'].lower()
-                if 'region' in ultima_pregunta or 'lista' in ultima_pregunta:
-                    return "total de defunciones en todo el dataset"
-                else:
-                    return "total general de defunciones"
-        
-        # Detectar preguntas sobre contar elementos del contexto anterior
-        elif any(palabra in pregunta_lower for palabra in ['cuántos son', 'cuántas son', 'puedes contarlas', 'contarlos']):
-            # Verificar el contexto de la pregunta anterior
-            if self.historial_sesion:
-                ultima_pregunta = self.historial_sesion[-1]['pregunta'].lower()
-                if 'region' in ultima_pregunta:
-                    if 'cuántos son' in pregunta_lower or 'cuántas son' in pregunta_lower or 'contarlas' in pregunta_lower:
-                        return "cuántas regiones diferentes hay en el dataset"
-                elif 'comuna' in ultima_pregunta:
-                    return "cuántas comunas diferentes hay en el dataset"
-                elif 'causa' in ultima_pregunta or 'diagnóstico' in ultima_pregunta:
-                    return "cuántas causas de muerte diferentes hay"
-        
-        # Si hay contexto activo y es una pregunta de continuación
-        if self.es_pregunta_continuacion(pregunta):
-            
-            if 'cuál es la más común' in pregunta_lower or 'cuál es la principal' in pregunta_lower:
-                if self.sesion_actual['ultima_region']:
-                    return f"cuál es la principal causa de muerte en {self.sesion_actual['ultima_region']}"
-            
-            elif 'y en hombres' in pregunta_lower:
-                partes = []
-                if self.sesion_actual['ultima_causa']:
-                    partes.append(f"muertes por {self.sesion_actual['ultima_causa']}")
-                else:
-                    partes.append("muertes")
-                partes.append("en hombres")
-                if self.sesion_actual['ultima_region']:
-                    partes.append(f"en {self.sesion_actual['ultima_region']}")
-                return " ".join(partes)
-            
-            elif 'y en mujeres' in pregunta_lower:
-                partes = []
-                if self.sesion_actual['ultima_causa']:
-                    partes.append(f"muertes por {self.sesion_actual['ultima_causa']}")
-                else:
-                    partes.append("muertes")
-                partes.append("en mujeres")
-                if self.sesion_actual['ultima_region']:
-                    partes.append(f"en {self.sesion_actual['ultima_región']}")
-                return " ".join(partes)
-            
-            elif 'qué tal en' in pregunta_lower:
-                # Mantener tema, cambiar región
-                if self.sesion_actual['ultima_causa']:
-                    return pregunta  # Dejamos que detecte la nueva región
-        
-        return pregunta
+    for pregunta, sql_query, created_at in reversed(pendientes):
+        contexto.detectar_contexto_en_pregunta(pregunta)
+        contexto.agregar_interaccion(pregunta, sql_query or "NO_SE_PUEDE_GENERAR")
+        contexto.historial_sesion[-1]['timestamp'] = created_at
+    return contexto
+
+# Almacenar contextos por conversación (acotado: LRU + expiración por inactividad; rehidratados desde mensajes).
+# CONTEXTO_BACKEND=postgres|redis los comparte entre workers/réplicas (memoria = solo este proceso).
+contextos_conversacion = AlmacenContextos(
+    max_contextos=int(os.getenv("CONTEXTOS_MAX", "10000")),
+    ttl_inactividad=float(os.getenv("CONTEXTOS_TTL", "7200")),
+    backend=crear_backend(
+        os.getenv("CONTEXTO_BACKEND", "memoria"),
+        pool=pool,
+        ttl=float(os.getenv("CONTEXTOS_TTL", "7200")),
+        url_redis=os.getenv("REDIS_URL", "redis://localhost:6379/0")
+    ),
+    frescura=float(os.getenv("CONTEXTO_FRESCURA", "0")),
+    rehidratar=rehidratar_contexto
+)
+
+def get_contexto_conversacion(user_id: int, conversation_id: str, es_nueva: bool = False) -> ContextoConversacion:
+    """Obtener o crear contexto para una conversación"""
+    return contextos_conversacion.obtener(clave_contexto(user_id, conversation_id), es_nueva)
+
+async def obtener_contexto_conversacion(user_id: int, conversation_id: str, es_nueva: bool = False) -> ContextoConversacion:
+    """get_contexto_conversacion sin bloquear el event loop cuando hay que ir al backend o rehidratar"""
+    clave = clave_contexto(user_id, conversation_id)
+    if contextos_conversacion.backend is None and (es_nueva or contextos_conversacion.en_memoria(clave)):
+        return contextos_conversacion.obtener(clave, es_nueva)
+    return await en_hilo(LIMITE_BD, get_contexto_conversacion, user_id, conversation_id, es_nueva)
+
+async def guardar_contexto_conversacion(user_id: int, conversation_id: str, contexto: ContextoConversacion):
+    """Publicar el contexto en el backend compartido (sin efecto en modo memoria)"""
+    if contextos_conversacion.backend is not None:
+        await en_hilo(LIMITE_BD, contextos_conversacion.guardar, clave_contexto(user_id, conversation_id), contexto)
+
+def marcar_contexto_reiniciado(user_id: int, conversation_id: str):
+    """Los mensajes anteriores al reinicio no se usan para rehidratar el contexto"""
+    with pool.conexion() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "UPDATE conversaciones SET contexto_reiniciado_at = %s WHERE id = %s AND user_id = %s",
+            (datetime.now(), conversation_id, user_id)
+        )
+        conn.commit()
+        cur.close()
+
+async def reiniciar_contexto_conversacion(user_id: int, conversation_id: str):
+    """Reiniciar solo el contexto de esta conversación (no crea uno nuevo)"""
+    await en_hilo(LIMITE_BD, marcar_contexto_reiniciado, user_id, conversation_id)
+    clave = clave_contexto(user_id, conversation_id)
+    if contextos_conversacion.backend is None:
+        contexto = contextos_conversacion.existente(clave)
+    else:
+        contexto = await en_hilo(LIMITE_BD, contextos_conversacion.existente, clave)
+    if contexto is not None:
+        contexto.reiniciar_sesion()
+        await guardar_contexto_conversacion(user_id, conversation_id, contexto)
+
+def ultima_conversacion(user_id: int) -> Optional[str]:
+    """Conversación más reciente del usuario (para /context sin conversation_id)"""
+    with pool.conexion() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT id FROM conversaciones WHERE user_id = %s ORDER BY created_at DESC LIMIT 1",
+            (user_id,)
+        )
+        fila = cur.fetchone()
+        cur.close()
+    return fila[0] if fila else None
+
+async def registrar_resultado_conversacion(user_id: int, conversation_id: str, sql: str, resultado):
+    """Conservar (acotadas) las filas devueltas para responder seguimientos sin volver a consultar"""
+    if not SEGUIMIENTO_LOCAL_ACTIVO:
+        return
+    contexto = await obtener_contexto_conversacion(user_id, conversation_id)
+    limite = analizador_activo().limite(sql)
+    if contexto.registrar_resultado(sql, resultado, SEGUIMIENTO_MAX_FILAS, limite):
+        await guardar_contexto_conversacion(user_id, conversation_id, contexto)
+
+async def responder_con_resultado_anterior(pregunta: str, user_id: int, conversation_id: str, es_nueva: bool):
+    """
+    Seguimientos sobre la respuesta anterior (suma, conteo, máximo/mínimo) calculados con sus filas:
+    sin LLM ni BD. Retorna (respuesta, operación) o None para seguir el flujo normal.
+    """
+    if not SEGUIMIENTO_LOCAL_ACTIVO or es_nueva:
+        return None
+    # Términos excluidos y preguntas con filtros nuevos ("y en hombres") siguen el flujo normal
+    if automata_terminos is None or verificar_terminos_excluidos(pregunta) or extraer_slots(pregunta):
+        return None
     
-    def construir_contexto_para_prompt(self):
-        """Construir información de contexto para el prompt"""
-        contexto_partes = []
-        
-        if self.sesion_actual['ultima_region']:
-            contexto_partes.append(f"Región en contexto: {self.sesion_actual['ultima_region']}")
-        
-        if self.sesion_actual['ultimo_año']:
-            contexto_partes.append(f"Año en contexto: {self.sesion_actual['ultimo_año']}")
-        
-        if self.sesion_actual['ultimo_mes']:
-            contexto_partes.append(f"Mes en contexto: {self.sesion_actual['ultimo_mes']}")
-        
-        if self.sesion_actual['ultimo_sexo']:
-            contexto_partes.append(f"Sexo en contexto: {self.sesion_actual['ultimo_sexo']}")
-        
-        if self.sesion_actual['ultima_causa']:
-            contexto_partes.append(f"Causa en contexto: {self.sesion_actual['ultima_causa']}")
-        
-        # Últimas 3 preguntas para referencia
-        if self.historial_sesion:
-            contexto_partes.append("\nÚltimas preguntas:")
-            for item in self.historial_sesion[-3:]:
-                contexto_partes.append(f"- {item['pregunta']}")
-        
-        return "\n".join(contexto_partes) if contexto_partes else "Sin contexto previo"
+    contexto = await obtener_contexto_conversacion(user_id, conversation_id)
+    anterior = contexto.resultado_anterior()
+    if anterior is None:
+        return None
+    respuesta = responder_seguimiento(anterior['resultado'], pregunta, anterior.get('completo', False))
+    if respuesta is None:
+        return None
+    operacion, texto = respuesta
     
-    def agregar_interaccion(self, pregunta, sql_generado):
-        """Registrar nueva interacción"""
-        self.historial_sesion.append({
-            'pregunta': pregunta,
-            'sql': sql_generado,
-            'timestamp': datetime.now()
-        })
-        
-        # Mantener solo últimas 10 interacciones
-        if len(self.historial_sesion) > 10:
-            self.historial_sesion = self.historial_sesion[-10:]
+    # El seguimiento hereda las filas: se puede encadenar ("suma" y luego "cuál es la mayor")
+    contexto.agregar_interaccion(pregunta, anterior['sql'], anterior['resultado'], anterior.get('completo', False))
+    await guardar_contexto_conversacion(user_id, conversation_id, contexto)
     
-    def reiniciar_sesion(self):
-        """Limpiar contexto para nueva conversación"""
-        self.sesion_actual = {
-            'ultima_region': None,
-            'ultimo_año': None,
-            'ultimo_mes': None,
-            'ultimo_mes_num': None,
-            'ultimo_sexo': None,
-            'ultima_causa': None,
-            'ultimo_tema': None
-        }
-        self.historial_sesion = []
-        self.id_sesion = str(uuid.uuid4())[:8]
-    
-    def get_estado(self):
-        """Obtener estado actual del contexto"""
-        return {
-            'id_sesion': self.id_sesion,
-            'contexto_activo': {k: v for k, v in self.sesion_actual.items() if v is not None},
-            'interacciones': len(self.historial_sesion)
-        }
-
-# Almacenar contextos por usuario
-contextos_usuario = {}
-
-def get_contexto_usuario(user_id: int) -> ContextoConversacion:
-    """Obtener o crear contexto para un usuario"""
-    if user_id not in contextos_usuario:
-        contextos_usuario[user_id] = ContextoConversacion()
-    return contextos_usuario[user_id]
+    estadisticas_seguimiento["respondidos"] += 1
+    por_operacion = estadisticas_seguimiento["por_operacion"]
+    por_operacion[operacion] = por_operacion.get(operacion, 0) + 1
+    log.debug("♻️ Seguimiento '%s' respondido con el resultado anterior", operacion)
+    return texto, operacion
 
 # === TUS FUNCIONES ORIGINALES ADAPTADAS CON MEJORAS EVALUACIÓN 3 ===
 
-def obtener_consulta_sql_con_hilado(pregunta: str, user_id: int):
+async def obtener_consulta_sql_con_hilado(pregunta: str, user_id: int, conversation_id: str, es_nueva: bool = False):
     """Tu versión completa con hilado inteligente + MEJORAS EVALUACIÓN 3"""
     
-    # 1. VERIFICAR TÉRMINOS EXCLUIDOS (Punto E)
-    if verificar_terminos_excluidos(pregunta):
+    # 1. VERIFICAR TÉRMINOS EXCLUIDOS (Punto E) - en memoria; solo va a la BD si aún no se compilaron
+    with etapa("terminos_excluidos"):
+        if automata_terminos is not None:
+            excluida = verificar_terminos_excluidos(pregunta)
+        else:
+            excluida = await en_hilo(LIMITE_BD, verificar_terminos_excluidos, pregunta)
+    if excluida:
         return "TERMINO_EXCLUIDO", "Pregunta contiene términos no permitidos"
     
-    # 2. OBTENER CONFIGURACIÓN ACTIVA (Punto F)
-    config_activa = obtener_configuracion_activa()
+    # 2. OBTENER CONFIGURACIÓN ACTIVA (Punto F) - en memoria; solo se relee si venció el intervalo de respaldo
+    with etapa("configuracion"):
+        if config_prompts.vencida():
+            await en_hilo(LIMITE_BD, config_prompts.refrescar, False)
+        configuracion = config_prompts.actual()
     
-    contexto_conversacion = get_contexto_usuario(user_id)
-    
-    # 3. Detectar contexto en la pregunta actual
-    contexto_conversacion.detectar_contexto_en_pregunta(pregunta)
-    
-    # 4. Expandir pregunta si es continuación
-    pregunta_expandida = contexto_conversacion.expandir_pregunta_continuacion(pregunta)
-    
-    # 5. Construir contexto para el prompt
-    contexto_activo = contexto_conversacion.construir_contexto_para_prompt()
+    with etapa("contexto"):
+        contexto_conversacion = await obtener_contexto_conversacion(user_id, conversation_id, es_nueva)
+        
+        # 3. Detectar contexto en la pregunta actual
+        contexto_conversacion.detectar_contexto_en_pregunta(pregunta)
+        
+        # 4. Expandir pregunta si es continuación
+        pregunta_expandida, regla_expansion = contexto_conversacion.expandir_con_regla(pregunta)
+        
+        # 5. Construir contexto para el prompt
+        contexto_activo = contexto_conversacion.construir_contexto_para_prompt()
     
     CONTEXTO_GENERAL_ACUMULADO = f"""
 CONTEXTO INTELIGENTE:
@@ -550,7 +541,25 @@ ESTRUCTURA DE DATOS:
     # Mostrar si se expandió la pregunta
     expansion_info = None
     if pregunta_expandida != pregunta:
-        expansion_info = f"Pregunta expandida: '{pregunta}' → '{pregunta_expandida}'"
+        expansion_info = f"Pregunta expandida: '{pregunta}' → '{pregunta_expandida}' (regla: {regla_expansion})"
+
+    # Preguntas frecuentes con todos sus filtros resueltos: SQL desde plantilla, sin LLM
+    if INTENCIONES_ACTIVAS:
+        with etapa("intencion"):
+            intencion = motor_intenciones.resolver(pregunta_expandida, original=pregunta)
+        if intencion is not None:
+            log.debug("⚡ Intención '%s' resuelta con plantilla", intencion.nombre)
+            contexto_conversacion.agregar_interaccion(pregunta, intencion.sql)
+            await guardar_contexto_conversacion(user_id, conversation_id, contexto_conversacion)
+            return intencion.sql, expansion_info
+    
+    # Si ya se generó SQL para esta misma pregunta, contexto y configuración, no llamar al LLM
+    clave_sql = clave_cache(normalizar_texto(pregunta_expandida), contexto_activo, configuracion.huella)
+    sql_cacheado = cache_sql.obtener(clave_sql)
+    if sql_cacheado is not None:
+        contexto_conversacion.agregar_interaccion(pregunta, sql_cacheado)
+        await guardar_contexto_conversacion(user_id, conversation_id, contexto_conversacion)
+        return sql_cacheado, expansion_info
 
     # 6. CONSTRUIR PROMPT CON CONFIGURACIÓN PERSONALIZADA
     prompt_base = f"""
@@ -595,84 +604,273 @@ IMPORTANTE: Para preguntas sobre totales después de ver listas, usar consulta s
 NOTA: Si la pregunta pide una lista después de una consulta previa, generar la consulta apropiada aunque la pregunta sea simple como "puedes darme la lista".
 """
 
-    # 7. APLICAR CONFIGURACIÓN PERSONALIZADA DEL ADMIN
-    if config_activa:
-        if config_activa.get('restricciones'):
-            prompt_base += f"\n\nRESTRICCIONES ADICIONALES:\n" + "\n".join([f"- {r}" for r in config_activa['restricciones']])
-        
-        if config_activa.get('instrucciones_adicionales'):
-            prompt_base += f"\n\nINSTRUCCIONES ESPECIALES: {config_activa['instrucciones_adicionales']}"
+    # 7. APLICAR CONFIGURACIÓN PERSONALIZADA DEL ADMIN (restricciones e instrucciones precompiladas)
+    prompt_base += configuracion.sufijo_prompt
+
+    # 8. USAR CONFIGURACIÓN PERSONALIZADA PARA LA API
+    max_tokens = configuracion.max_tokens
+    temperature = configuracion.temperature
+    
+    async def generar_sql():
+        async with LIMITE_LLM:
+            message = await client.messages.create(
+                model="claude-3-haiku-20240307",
+                max_tokens=max_tokens,
+                temperature=temperature,
+                messages=[{"role": "user", "content": prompt_base}]
+            )
+        registrar_tokens_llm("sql", getattr(message, "usage", None))
+        sql_generado = message.content[0].text.strip()
+        cache_sql.guardar(clave_sql, sql_generado)
+        return sql_generado
 
     try:
-        # 8. USAR CONFIGURACIÓN PERSONALIZADA PARA LA API
-        max_tokens = config_activa.get('max_tokens', 1000)
-        temperature = config_activa.get('temperature', 0)
-        
-        message = client.messages.create(
-            model="claude-3-haiku-20240307",
-            max_tokens=max_tokens,
-            temperature=temperature,
-            messages=[{"role": "user", "content": prompt_base}]
-        )
-        sql_resultado = message.content[0].text.strip()
+        # Una sola llamada al LLM por clave, aunque lleguen varias preguntas iguales a la vez
+        with etapa("llm_sql"):
+            sql_resultado = await coalescedor_sql.ejecutar(clave_sql, generar_sql)
         
         # Registrar la interacción
         contexto_conversacion.agregar_interaccion(pregunta, sql_resultado)
+        await guardar_contexto_conversacion(user_id, conversation_id, contexto_conversacion)
         
         return sql_resultado, expansion_info
     except Exception as e:
-        print(f"Error generando SQL: {e}")
+        log.warning("Error generando SQL: %s", e)
+        await guardar_contexto_conversacion(user_id, conversation_id, contexto_conversacion)
         return "NO_SE_PUEDE_GENERAR", None
 
+# Versión del dataset: la tabla version_dataset se incrementa (por trigger) al recargar los datos DEIS
+VERSION_DATASET_INTERVALO = float(os.getenv("VERSION_DATASET_INTERVALO", "30"))
+_version_dataset = {'valor': None, 'rollups': None, 'revisado': float('-inf')}
+_lock_version_dataset = threading.Lock()
+
+def obtener_version_dataset():
+    """Obtener versión del dataset, consultando la BD como máximo cada VERSION_DATASET_INTERVALO segundos"""
+    if time.monotonic() - _version_dataset['revisado'] < VERSION_DATASET_INTERVALO:
+        return _version_dataset['valor']
+    
+    with _lock_version_dataset:
+        # Otro hilo pudo haberla actualizado mientras esperábamos
+        if time.monotonic() - _version_dataset['revisado'] < VERSION_DATASET_INTERVALO:
+            return _version_dataset['valor']
+        
+        version = _version_dataset['valor']
+        version_rollups = _version_dataset['rollups']
+        try:
+            with pool.conexion() as conn:
+                cur = conn.cursor()
+                cur.execute("SELECT version, version_rollups FROM version_dataset WHERE id = 1")
+                fila = cur.fetchone()
+                cur.close()
+            version, version_rollups = fila if fila else (None, None)
+        except psycopg2.Error as err:
+            log.warning("⚠️ No se pudo leer la versión del dataset: %s", err)
+        
+        if version != _version_dataset['valor'] and _version_dataset['valor'] is not None:
+            log.info("🔄 Dataset actualizado (versión %s → %s), invalidando resultados", _version_dataset['valor'], version)
+            cache_resultados.invalidar()
+            prefetch_consultas.almacen.invalidar()
+            guardia_costos.planes.invalidar()
+        
+        _version_dataset['valor'] = version
+        _version_dataset['rollups'] = version_rollups
+        _version_dataset['revisado'] = time.monotonic()
+        return version
+
+def canonicalizar_sql(sql: str) -> str:
+    """Forma canónica del SQL (la que se ejecuta) para usar como clave de cache"""
+    consulta = analizar_sql(sql)
+    if consulta.valida:
+        return consulta.sql
+    return " ".join(sql.split()).rstrip(";").strip()
+
+def copiar_resultado(resultado):
+    """Copiar filas para que los llamadores no modifiquen lo guardado en cache"""
+    if isinstance(resultado, list):
+        return [dict(fila) for fila in resultado]
+    return resultado
+
+def cargar_motor_columnar():
+    """Cargar (o recargar) la instantánea columnar con la versión actual del dataset"""
+    if not _lock_motor_columnar.acquire(blocking=False):
+        return  # Ya hay una carga en curso
+    try:
+        version = obtener_version_dataset()
+        if motor_columnar.cargas and motor_columnar.version == version:
+            return
+        with pool.conexion() as conn:
+            motor_columnar.cargar(conn, version)
+        stats = motor_columnar.estadisticas()
+        log.info("🧮 Motor columnar cargado: %d filas en %ss (versión %s)", stats['filas'], stats['segundos_ultima_carga'], version)
+    except psycopg2.Error as err:
+        log.warning("⚠️ No se pudo cargar el motor columnar: %s", err)
+    finally:
+        _lock_motor_columnar.release()
+
+def consultar_columnar(sql: str) -> Optional[list]:
+    """Resolver la consulta en memoria; None si el motor no está al día o no soporta la consulta"""
+    if not MOTOR_COLUMNAR_ACTIVO:
+        return None
+    if not motor_columnar.cargas or motor_columnar.version != obtener_version_dataset():
+        # Instantánea desactualizada: recargar en segundo plano y usar PostgreSQL mientras tanto
+        if not _lock_motor_columnar.locked():
+            threading.Thread(target=cargar_motor_columnar, daemon=True).start()
+        return None
+    try:
+        return motor_columnar.ejecutar(sql)
+    except Exception as e:
+        log.warning("⚠️ Error en motor columnar, usando PostgreSQL: %s", e)
+        return None
+
+def contar_rollup(evento: str):
+    with _lock_rollups:
+        estadisticas_rollups[evento] += 1
+
+def reescribir_rollup(sql: str, refrescar: bool = True) -> Optional[str]:
+    """SQL sobre el cubo pre-agregado, solo si los cubos reflejan la versión actual del dataset
+    (con refrescar=False se usa la versión cacheada, sin consultar la BD)"""
+    if not ROLLUPS_ACTIVOS or not cubos_disponibles:
+        return None
+    version = obtener_version_dataset() if refrescar else _version_dataset['valor']
+    if version is None or _version_dataset['rollups'] != version:
+        return None
+    return reescribir_con_rollup(sql, cubos_disponibles)
+
+def consultar_bd(sql: str) -> list:
+    """Ejecutar una consulta de lectura (costo acotado y statement_timeout) y retornar las filas como diccionarios"""
+    with etapa("bd"), pool.conexion() as conn:
+        return guardia_costos.ejecutar(conn, sql)
+
+def consultar_con_rollup(sql: str) -> list:
+    """Ejecutar la consulta sobre el cubo cuando es posible; si el cubo falla se usa la original"""
+    reescrito = reescribir_rollup(sql)
+    if reescrito is None:
+        return consultar_bd(sql)
+    
+    if not ROLLUP_VERIFICAR:
+        try:
+            filas = consultar_bd(reescrito)
+            contar_rollup('reescritas')
+            return filas
+        except psycopg2.Error as err:
+            log.warning("⚠️ Error consultando cubo, usando consulta original: %s", err)
+            contar_rollup('errores')
+            return consultar_bd(sql)
+    
+    filas = consultar_bd(sql)
+    try:
+        filas_cubo = consultar_bd(reescrito)
+    except psycopg2.Error as err:
+        log.warning("⚠️ Error consultando cubo: %s", err)
+        contar_rollup('errores')
+        return filas
+    
+    contar_rollup('verificadas')
+    if not resultados_equivalentes(filas, filas_cubo, ordenado=' ORDER BY ' in sql.upper()):
+        contar_rollup('discrepancias')
+        log.error("❌ Discrepancia en cubo:\n   original: %s\n   reescrita: %s", sql, reescrito)
+    return filas
+
+async def ejecutar_sql_async(sql):
+    """Ejecutar SQL en un hilo; consultas idénticas concurrentes se ejecutan una sola vez"""
+    return await coalescedor_resultados.ejecutar(
+        canonicalizar_sql(sql),
+        lambda: en_hilo(LIMITE_SQL, ejecutar_sql, sql),
+        copiar=copiar_resultado
+    )
+
 def ejecutar_sql(sql):
     """Tu función original de ejecución SQL"""
     if sql.strip() == "NO_SE_PUEDE_GENERAR":
         return "La pregunta no se puede responder con esta base de datos de defunciones."
     
-    # Limpiar SQL - quitar explicaciones extra (tu lógica original)
-    sql_lines = sql.strip().split('\n')
-    sql_clean = ""
-    for line in sql_lines:
-        line = line.strip()
-        if line.upper().startswith('SELECT') or line.upper().startswith('FROM') or line.upper().startswith('WHERE') or line.upper().startswith('GROUP BY') or line.upper().startswith('ORDER BY') or line.upper().startswith('LIMIT') or line.upper().startswith('JOIN') or line.upper().startswith('AND') or line.upper().startswith('EXTRACT') or line.upper().startswith('COUNT'):
-            sql_clean += line + " "
-        elif sql_clean and (line.startswith('    ') or line.startswith('\t')):  # Continuación de línea
-            sql_clean += line + " "
-    
-    if not sql_clean.strip():
-        sql_clean = sql_lines[0] if sql_lines else sql
-    
-    sql = sql_clean.strip()
-    
-    if not sql.lower().startswith("select"):
+    # Extraer el SELECT de la salida del LLM y validarlo: una sola sentencia de solo lectura,
+    # tablas y columnas conocidas y LIMIT acotado. Se ejecuta la forma canónica.
+    consulta = analizar_sql(sql)
+    if consulta.motivo == 'sin_select':
         return "La pregunta no se puede responder con esta base de datos de defunciones."
+    if not consulta.valida:
+        log.info("🛡️ SQL rechazado (%s): %s", consulta.motivo, consulta.error)
+        return f"Error en consulta SQL: {consulta.error}"
+    sql = consulta.sql
+    
+    # Resultados precargados por el prefetch y cacheados para la misma consulta y versión del dataset
+    clave = clave_resultado(sql)
+    if PREFETCH_ACTIVO:
+        precargado = prefetch_consultas.obtener(clave)
+        if precargado is not None:
+            cache_resultados.guardar(clave, precargado)
+            return copiar_resultado(precargado)
+    cacheado = cache_resultados.obtener(clave)
+    if cacheado is not None:
+        return copiar_resultado(cacheado)
     
     try:
-        conn = psycopg2.connect(**db_config)
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cur.execute(sql)
-        results = cur.fetchall()
-        cur.close()
-        conn.close()
-        
-        # Convertir a lista de diccionarios para compatibilidad
-        if results:
-            return [dict(row) for row in results]
-        else:
-            # Si no hay resultados, verificar si la consulta es válida
-            return "Sin registros para los criterios especificados."
+        resultado = consultar_resultado(sql)
+        cache_resultados.guardar(clave, copiar_resultado(resultado))
+        return resultado
     except psycopg2.Error as err:
         return f"Error en consulta SQL: {err}"
 
-def generar_respuesta_final(resultado_sql, pregunta):
-    """Tu función original de generación de respuestas"""
+def clave_resultado(sql: str) -> str:
+    """Clave de cache_resultados (y del almacén de prefetch): versión del dataset y SQL canónico"""
+    return clave_cache(obtener_version_dataset(), canonicalizar_sql(sql))
+
+def consultar_resultado(sql: str):
+    """Ejecutar un SELECT ya limpio: motor columnar, cubo o PostgreSQL"""
+    # La clave de cache es la consulta original aunque se responda desde memoria o un cubo
+    resultado = consultar_columnar(sql)
+    if resultado is None:
+        resultado = consultar_con_rollup(sql)
+    
+    if not resultado:
+        # Si no hay resultados, verificar si la consulta es válida
+        resultado = "Sin registros para los criterios especificados."
+    return resultado
+
+def consultar_prefetch(sql: str) -> Optional[list]:
+    """Ejecutar una consulta precargada con la misma validación que ejecutar_sql"""
+    consulta = analizar_sql(sql)
+    if not consulta.valida:
+        return None
+    return consultar_resultado(consulta.sql)
+
+# Prefetch especulativo: tras responder, precargar los seguimientos más probables (ver prefetch.py)
+PREFETCH_ACTIVO = os.getenv("PREFETCH_ACTIVO", "0") == "1"
+PREFETCH_K = int(os.getenv("PREFETCH_K", "3"))
+prefetch_consultas = PrefetchConsultas(
+    ejecutar=consultar_prefetch,
+    clave=clave_resultado,
+    cacheado=lambda clave: cache_resultados.obtener(clave) is not None,
+    almacen=CacheLRU(
+        "prefetch",
+        max_entradas=int(os.getenv("PREFETCH_MAX", "256")),
+        ttl=float(os.getenv("PREFETCH_TTL", "600")),
+        max_bytes=int(os.getenv("PREFETCH_BYTES", str(16 * 1024 * 1024)))
+    ),
+    holgura=pool.holgura,
+    presupuesto_minuto=int(os.getenv("PREFETCH_PRESUPUESTO", "60")),
+    holgura_minima=int(os.getenv("PREFETCH_HOLGURA", "2"))
+)
+
+async def programar_prefetch(user_id: int, conversation_id: str):
+    """Encolar (sin esperar) las consultas de los seguimientos probables de esta conversación"""
+    if not PREFETCH_ACTIVO:
+        return
+    contexto = await obtener_contexto_conversacion(user_id, conversation_id)
+    consultas = predecir_consultas(contexto, motor_intenciones, PREFETCH_K)
+    if consultas:
+        prefetch_consultas.programar(consultas)
+
+def preparar_respuesta_final(resultado_sql, pregunta):
+    """Retorna (respuesta, None) si se resuelve localmente o (None, prompt) si requiere el LLM"""
     if isinstance(resultado_sql, str):
         if "Error" in resultado_sql:
-            return resultado_sql
+            return resultado_sql, None
         elif "Sin registros" in resultado_sql:
-            return "0 (sin registros para los criterios especificados)"
+            return "0 (sin registros para los criterios especificados)", None
         else:
-            return resultado_sql
+            return resultado_sql, None
     
     # Si hay resultados numéricos
     if isinstance(resultado_sql, list) and resultado_sql:
@@ -680,10 +878,15 @@ def generar_respuesta_final(resultado_sql, pregunta):
         for fila in resultado_sql:
             for key, value in fila.items():
                 if isinstance(value, (int, float)) and value == 0:
-                    return "0"
+                    return "0", None
                 elif isinstance(value, float):
                     fila[key] = round(value, 2)
     
+    # Formas simples (escalar, etiqueta/conteo, top-N) se responden sin segunda llamada al LLM
+    respuesta_local = formatear_respuesta(resultado_sql, pregunta)
+    if respuesta_local is not None:
+        return respuesta_local, None
+    
     prompt = f"""
 Pregunta: "{pregunta}"
 Resultados SQL: {resultado_sql}
@@ -707,18 +910,88 @@ Ejemplos:
 - Pregunta: "¿qué región?" → Respuesta: "Región Metropolitana"
 - Pregunta: "¿cuál es la principal causa?" → Respuesta: "Enfermedades cardiovasculares"
 """
+    return None, prompt
 
-    try:
-        message = client.messages.create(
-            model="claude-3-haiku-20240307",
-            max_tokens=500,
-            temperature=0.3,
-            messages=[{"role": "user", "content": prompt}]
-        )
+async def generar_respuesta_final(resultado_sql, pregunta):
+    """Tu función original de generación de respuestas"""
+    respuesta, prompt = preparar_respuesta_final(resultado_sql, pregunta)
+    if respuesta is not None:
+        return respuesta
+
+    async def generar():
+        async with LIMITE_LLM:
+            message = await client.messages.create(
+                model="claude-3-haiku-20240307",
+                max_tokens=500,
+                temperature=0.3,
+                messages=[{"role": "user", "content": prompt}]
+            )
+        registrar_tokens_llm("respuesta", getattr(message, "usage", None))
         return message.content[0].text.strip()
+
+    try:
+        # El prompt incluye pregunta y resultados: prompts idénticos concurrentes comparten respuesta
+        return await coalescedor_respuestas.ejecutar(clave_cache(prompt), generar)
     except Exception as e:
         return f"Error generando respuesta: {e}"
 
+async def generar_respuesta_final_stream(resultado_sql, pregunta):
+    """Igual que generar_respuesta_final, pero entrega la respuesta del LLM por fragmentos"""
+    respuesta, prompt = preparar_respuesta_final(resultado_sql, pregunta)
+    if respuesta is not None:
+        yield respuesta
+        return
+
+    try:
+        async with LIMITE_LLM:
+            async with client.messages.stream(
+                model="claude-3-haiku-20240307",
+                max_tokens=500,
+                temperature=0.3,
+                messages=[{"role": "user", "content": prompt}]
+            ) as stream:
+                async for fragmento in stream.text_stream:
+                    yield fragmento
+                final = await stream.get_final_message()
+                registrar_tokens_llm("respuesta", getattr(final, "usage", None))
+    except Exception as e:
+        yield f"Error generando respuesta: {e}"
+
+def guardar_mensaje(conversation_id: str, user_id: int, pregunta: str, respuesta: str, sql_query: str, es_nueva: bool,
+                    contexto_snapshot: Optional[str] = None):
+    """Guardar conversación (si es nueva) y mensaje; retorna el id del mensaje o None si falla"""
+    with pool.conexion() as conn:
+        cur = conn.cursor()
+        
+        try:
+            # Solo crear conversación si es nueva
+            if es_nueva:
+                log.debug("📝 Creando nueva conversación con ID: %s", conversation_id)
+                cur.execute(
+                    "INSERT INTO conversaciones (id, user_id, titulo, created_at) VALUES (%s, %s, %s, %s)",
+                    (conversation_id, user_id, pregunta[:50], datetime.now())
+                )
+            
+            # Siempre guardar el mensaje
+            cur.execute(
+                "INSERT INTO mensajes (conversation_id, pregunta, respuesta, sql_query, contexto_snapshot, created_at) VALUES (%s, %s, %s, %s, %s, %s) RETURNING id",
+                (conversation_id, pregunta, respuesta, sql_query if sql_query != "NO_SE_PUEDE_GENERAR" else None, contexto_snapshot, datetime.now())
+            )
+            message_id = cur.fetchone()[0]
+            
+            conn.commit()
+            log.debug("✅ Mensaje %s guardado en la conversación %s", message_id, conversation_id)
+            return message_id
+            
+        except psycopg2.Error as db_error:
+            conn.rollback()
+            log.error("❌ Error de BD guardando mensaje: %s", db_error)
+            # Si hay error, seguir sin guardar pero mostrar el error completo
+            return None
+            
+        finally:
+            cur.close()
+
 # === ESQUEMAS PYDANTIC ===
 
 class UserCreate(BaseModel):
@@ -787,43 +1060,40 @@ async def root():
     return {"message": "Chatbot Defunciones Chile API", "status": "running", "version": "2.0.0"}
 
 @app.post("/register", response_model=dict)
-async def register(user: UserCreate):
+def register(user: UserCreate):
     """Registrar nuevo usuario"""
     try:
-        conn = psycopg2.connect(**db_config)
-        cur = conn.cursor()
-        
-        # Verificar si usuario existe
-        cur.execute("SELECT id FROM usuarios WHERE username = %s", (user.username,))
-        if cur.fetchone():
-            raise HTTPException(status_code=400, detail="Usuario ya existe")
-        
-        # Crear usuario
-        hashed_password = get_password_hash(user.password)
-        cur.execute(
-            "INSERT INTO usuarios (username, email, password_hash, created_at) VALUES (%s, %s, %s, %s) RETURNING id",
-            (user.username, user.email, hashed_password, datetime.now())
-        )
-        user_id = cur.fetchone()[0]
-        conn.commit()
-        cur.close()
-        conn.close()
+        with pool.conexion() as conn:
+            cur = conn.cursor()
+            
+            # Verificar si usuario existe
+            cur.execute("SELECT id FROM usuarios WHERE username = %s", (user.username,))
+            if cur.fetchone():
+                raise HTTPException(status_code=400, detail="Usuario ya existe")
+            
+            # Crear usuario
+            hashed_password = get_password_hash(user.password)
+            cur.execute(
+                "INSERT INTO usuarios (username, email, password_hash, created_at) VALUES (%s, %s, %s, %s) RETURNING id",
+                (user.username, user.email, hashed_password, datetime.now())
+            )
+            user_id = cur.fetchone()[0]
+            conn.commit()
+            cur.close()
         
         return {"message": "Usuario creado exitosamente", "user_id": user_id}
     except psycopg2.Error as err:
         raise HTTPException(status_code=500, detail=f"Error de base de datos: {err}")
 
 @app.post("/login", response_model=Token)
-async def login(user: UserLogin):
+def login(user: UserLogin):
     """Login de usuario"""
     try:
-        conn = psycopg2.connect(**db_config)
-        cur = conn.cursor()
-        
-        cur.execute("SELECT id, password_hash FROM usuarios WHERE username = %s", (user.username,))
-        result = cur.fetchone()
-        cur.close()
-        conn.close()
+        with pool.conexion() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT id, password_hash FROM usuarios WHERE username = %s", (user.username,))
+            result = cur.fetchone()
+            cur.close()
         
         if not result or not verify_password(user.password, result[1]):
             raise HTTPException(status_code=401, detail="Credenciales inválidas")
@@ -842,24 +1112,50 @@ async def login(user: UserLogin):
     except psycopg2.Error as err:
         raise HTTPException(status_code=500, detail=f"Error de base de datos: {err}")
 
+def resolver_conversation_id(message: ChatMessage):
+    """Obtener (conversation_id, es_nueva) para el mensaje"""
+    # ARREGLO: Verificar si viene "null" como string también
+    if not message.conversation_id or message.conversation_id == "null":
+        return str(uuid.uuid4()), True
+    return message.conversation_id, False
+
+def evento_sse(evento: str, datos: dict) -> str:
+    """Serializar un evento Server-Sent Events"""
+    return f"event: {evento}\ndata: {json.dumps(datos, ensure_ascii=False, default=str)}\n\n"
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat(message: ChatMessage, user_id: int = Depends(get_current_user)):
     """Endpoint principal del chat CON TODAS LAS MEJORAS DE EVALUACIÓN 3"""
     try:
         # 1. Generar conversation_id ANTES de cualquier operación
-        # ARREGLO: Verificar si viene "null" como string también
-        if not message.conversation_id or message.conversation_id == "null":
-            conversation_id = str(uuid.uuid4())
-            is_new_conversation = True
-        else:
-            conversation_id = message.conversation_id
-            is_new_conversation = False
+        conversation_id, is_new_conversation = resolver_conversation_id(message)
+        log.debug("🔍 conversation_id %s (nueva: %s)", conversation_id, is_new_conversation)
         
-        print(f"🔍 DEBUG - conversation_id generado: {conversation_id}")
-        print(f"🔍 DEBUG - es nueva conversación: {is_new_conversation}")
+        # Seguimiento sobre la respuesta anterior: se calcula con sus filas, sin LLM ni BD
+        with etapa("seguimiento_local"):
+            seguimiento = await responder_con_resultado_anterior(
+                message.message, user_id, conversation_id, is_new_conversation
+            )
+        if seguimiento is not None:
+            respuesta, operacion = seguimiento
+            contexto = await obtener_contexto_conversacion(user_id, conversation_id)
+            await en_hilo(
+                LIMITE_BD, guardar_mensaje,
+                conversation_id, user_id, message.message, respuesta, None, is_new_conversation,
+                json.dumps(contexto.a_dict())
+            )
+            return ChatResponse(
+                response=respuesta,
+                conversation_id=conversation_id,
+                sql_query=None,
+                expansion_info=f"Respondida con el resultado anterior ({operacion})",
+                context_info=contexto.get_estado()
+            )
         
         # 2. Generar SQL con hilado inteligente + filtros (EVALUACIÓN 3)
-        sql_query, expansion_info = obtener_consulta_sql_con_hilado(message.message, user_id)
+        sql_query, expansion_info = await obtener_consulta_sql_con_hilado(
+            message.message, user_id, conversation_id, is_new_conversation
+        )
         
         # 3. Verificar si fue bloqueado por términos excluidos
         if sql_query == "TERMINO_EXCLUIDO":
@@ -872,46 +1168,26 @@ async def chat(message: ChatMessage, user_id: int = Depends(get_current_user)):
             )
         
         # 4. Ejecutar SQL (tu función original)
-        resultado_sql = ejecutar_sql(sql_query)
+        with etapa("ejecutar_sql"):
+            resultado_sql = await ejecutar_sql_async(sql_query)
+        await registrar_resultado_conversacion(user_id, conversation_id, sql_query, resultado_sql)
         
         # 5. Generar respuesta natural (tu función original)
-        respuesta = generar_respuesta_final(resultado_sql, message.message)
-        
-        # 6. Obtener contexto actual
-        contexto_usuario = get_contexto_usuario(user_id)
-        context_info = contexto_usuario.get_estado()
-        
-        # 7. Guardar conversación (ARREGLADO - sin try/catch interno)
-        conn = psycopg2.connect(**db_config)
-        cur = conn.cursor()
-        
-        try:
-            # Solo crear conversación si es nueva
-            if is_new_conversation:
-                print(f"📝 DEBUG - Creando nueva conversación con ID: {conversation_id}")
-                cur.execute(
-                    "INSERT INTO conversaciones (id, user_id, titulo, created_at) VALUES (%s, %s, %s, %s)",
-                    (conversation_id, user_id, message.message[:50], datetime.now())
-                )
-            
-            # Siempre guardar el mensaje
-            print(f"💬 DEBUG - Guardando mensaje con conversation_id: {conversation_id}")
-            cur.execute(
-                "INSERT INTO mensajes (conversation_id, pregunta, respuesta, sql_query, created_at) VALUES (%s, %s, %s, %s, %s)",
-                (conversation_id, message.message, respuesta, sql_query if sql_query != "NO_SE_PUEDE_GENERAR" else None, datetime.now())
+        with etapa("respuesta"):
+            respuesta = await generar_respuesta_final(resultado_sql, message.message)
+        await programar_prefetch(user_id, conversation_id)
+        
+        # 6. Obtener contexto actual de la conversación
+        contexto = await obtener_contexto_conversacion(user_id, conversation_id)
+        context_info = contexto.get_estado()
+        
+        # 7. Guardar conversación con snapshot del contexto (en un hilo para no bloquear el event loop)
+        with etapa("guardar_mensaje"):
+            await en_hilo(
+                LIMITE_BD, guardar_mensaje,
+                conversation_id, user_id, message.message, respuesta, sql_query, is_new_conversation,
+                json.dumps(contexto.a_dict())
             )
-            
-            conn.commit()
-            print(f"✅ Guardado exitoso - Conversation ID: {conversation_id}")
-            
-        except psycopg2.Error as db_error:
-            conn.rollback()
-            print(f"❌ Error de BD: {db_error}")
-            # Si hay error, seguir sin guardar pero mostrar el error completo
-            
-        finally:
-            cur.close()
-            conn.close()
         
         return ChatResponse(
             response=respuesta,
@@ -924,20 +1200,112 @@ async def chat(message: ChatMessage, user_id: int = Depends(get_current_user)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error en chat: {str(e)}")
 
+@app.post("/chat/stream")
+async def chat_stream(message: ChatMessage, user_id: int = Depends(get_current_user)):
+    """Chat con Server-Sent Events: expansión, SQL, filas, tokens de la respuesta y id del mensaje guardado"""
+    conversation_id, is_new_conversation = resolver_conversation_id(message)
+    
+    async def eventos():
+        try:
+            yield evento_sse("inicio", {"conversation_id": conversation_id})
+            
+            # Seguimiento sobre la respuesta anterior: se calcula con sus filas, sin LLM ni BD
+            with etapa("seguimiento_local"):
+                seguimiento = await responder_con_resultado_anterior(
+                    message.message, user_id, conversation_id, is_new_conversation
+                )
+            if seguimiento is not None:
+                respuesta, operacion = seguimiento
+                expansion_info = f"Respondida con el resultado anterior ({operacion})"
+                yield evento_sse("expansion", {"pregunta": message.message, "expansion_info": expansion_info})
+                yield evento_sse("token", {"texto": respuesta})
+                contexto = await obtener_contexto_conversacion(user_id, conversation_id)
+                message_id = await en_hilo(
+                    LIMITE_BD, guardar_mensaje,
+                    conversation_id, user_id, message.message, respuesta, None, is_new_conversation,
+                    json.dumps(contexto.a_dict())
+                )
+                yield evento_sse("fin", {
+                    "conversation_id": conversation_id,
+                    "message_id": message_id,
+                    "response": respuesta,
+                    "sql_query": None,
+                    "expansion_info": expansion_info,
+                    "context_info": contexto.get_estado()
+                })
+                return
+            
+            # 1. Generar SQL con hilado inteligente + filtros
+            sql_query, expansion_info = await obtener_consulta_sql_con_hilado(
+                message.message, user_id, conversation_id, is_new_conversation
+            )
+            
+            if sql_query == "TERMINO_EXCLUIDO":
+                respuesta = "⚠️ Su consulta contiene términos no permitidos. Por favor, reformule su pregunta."
+                yield evento_sse("token", {"texto": respuesta})
+                yield evento_sse("fin", {"conversation_id": conversation_id, "message_id": None, "response": respuesta})
+                return
+            
+            yield evento_sse("expansion", {"pregunta": message.message, "expansion_info": expansion_info})
+            sql_visible = sql_query if sql_query != "NO_SE_PUEDE_GENERAR" else None
+            yield evento_sse("sql", {"sql_query": sql_visible})
+            
+            # 2. Ejecutar SQL
+            with etapa("ejecutar_sql"):
+                resultado_sql = await ejecutar_sql_async(sql_query)
+            await registrar_resultado_conversacion(user_id, conversation_id, sql_query, resultado_sql)
+            if isinstance(resultado_sql, list):
+                yield evento_sse("filas", {"filas": resultado_sql, "total": len(resultado_sql)})
+            else:
+                yield evento_sse("filas", {"filas": [], "total": 0, "mensaje": resultado_sql})
+            
+            # 3. Respuesta del LLM a medida que llega
+            partes = []
+            with etapa("respuesta"):
+                async for fragmento in generar_respuesta_final_stream(resultado_sql, message.message):
+                    partes.append(fragmento)
+                    yield evento_sse("token", {"texto": fragmento})
+            respuesta = "".join(partes).strip()
+            await programar_prefetch(user_id, conversation_id)
+            
+            # 4. Guardar (con snapshot del contexto) y cerrar con el id persistido
+            contexto = await obtener_contexto_conversacion(user_id, conversation_id)
+            with etapa("guardar_mensaje"):
+                message_id = await en_hilo(
+                    LIMITE_BD, guardar_mensaje,
+                    conversation_id, user_id, message.message, respuesta, sql_query, is_new_conversation,
+                    json.dumps(contexto.a_dict())
+                )
+            yield evento_sse("fin", {
+                "conversation_id": conversation_id,
+                "message_id": message_id,
+                "response": respuesta,
+                "sql_query": sql_visible,
+                "expansion_info": expansion_info,
+                "context_info": contexto.get_estado()
+            })
+        except Exception as e:
+            yield evento_sse("error", {"detail": f"Error en chat: {str(e)}"})
+    
+    return StreamingResponse(
+        eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/conversations")
-async def get_conversations(user_id: int = Depends(get_current_user)):
+def get_conversations(user_id: int = Depends(get_current_user)):
     """Obtener conversaciones del usuario - ARREGLADO PARA FRONTEND"""
     try:
-        conn = psycopg2.connect(**db_config)
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        
-        cur.execute(
-            "SELECT id, titulo, created_at FROM conversaciones WHERE user_id = %s ORDER BY created_at DESC",
-            (user_id,)
-        )
-        conversations = cur.fetchall()
-        cur.close()
-        conn.close()
+        with pool.conexion() as conn:
+            cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            
+            cur.execute(
+                "SELECT id, titulo, created_at FROM conversaciones WHERE user_id = %s ORDER BY created_at DESC",
+                (user_id,)
+            )
+            conversations = cur.fetchall()
+            cur.close()
         
         # CAMBIO: Envolver en objeto para que coincida con frontend
         return {"conversations": [dict(conv) for conv in conversations]}
@@ -945,57 +1313,55 @@ async def get_conversations(user_id: int = Depends(get_current_user)):
         raise HTTPException(status_code=500, detail=f"Error de base de datos: {err}")
 
 @app.get("/conversations/{conversation_id}/messages")
-async def get_conversation_messages(conversation_id: str, user_id: int = Depends(get_current_user)):
+def get_conversation_messages(conversation_id: str, user_id: int = Depends(get_current_user)):
     """Obtener mensajes de una conversación"""
     try:
-        conn = psycopg2.connect(**db_config)
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        
-        # Verificar que la conversación pertenece al usuario
-        cur.execute(
-            "SELECT id FROM conversaciones WHERE id = %s AND user_id = %s",
-            (conversation_id, user_id)
-        )
-        if not cur.fetchone():
-            raise HTTPException(status_code=404, detail="Conversación no encontrada")
-        
-        # Obtener mensajes CON ID
-        cur.execute(
-            "SELECT id, pregunta, respuesta, sql_query, created_at FROM mensajes WHERE conversation_id = %s ORDER BY created_at",
-            (conversation_id,)
-        )
-        messages = cur.fetchall()
-        cur.close()
-        conn.close()
+        with pool.conexion() as conn:
+            cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            
+            # Verificar que la conversación pertenece al usuario
+            cur.execute(
+                "SELECT id FROM conversaciones WHERE id = %s AND user_id = %s",
+                (conversation_id, user_id)
+            )
+            if not cur.fetchone():
+                raise HTTPException(status_code=404, detail="Conversación no encontrada")
+            
+            # Obtener mensajes CON ID
+            cur.execute(
+                "SELECT id, pregunta, respuesta, sql_query, created_at FROM mensajes WHERE conversation_id = %s ORDER BY created_at",
+                (conversation_id,)
+            )
+            messages = cur.fetchall()
+            cur.close()
         
         return {"messages": [dict(msg) for msg in messages]}
     except psycopg2.Error as err:
         raise HTTPException(status_code=500, detail=f"Error de base de datos: {err}")
 
 @app.delete("/conversations/{conversation_id}")
-async def delete_conversation(conversation_id: str, user_id: int = Depends(get_current_user)):
+def delete_conversation(conversation_id: str, user_id: int = Depends(get_current_user)):
     """Eliminar conversación"""
     try:
-        conn = psycopg2.connect(**db_config)
-        cur = conn.cursor()
-        
-        # Verificar que la conversación pertenece al usuario
-        cur.execute(
-            "SELECT id FROM conversaciones WHERE id = %s AND user_id = %s",
-            (conversation_id, user_id)
-        )
-        if not cur.fetchone():
-            raise HTTPException(status_code=404, detail="Conversación no encontrada")
-        
-        # Eliminar mensajes primero (por foreign key)
-        cur.execute("DELETE FROM mensajes WHERE conversation_id = %s", (conversation_id,))
-        
-        # Eliminar conversación
-        cur.execute("DELETE FROM conversaciones WHERE id = %s", (conversation_id,))
-        
-        conn.commit()
-        cur.close()
-        conn.close()
+        with pool.conexion() as conn:
+            cur = conn.cursor()
+            
+            # Verificar que la conversación pertenece al usuario
+            cur.execute(
+                "SELECT id FROM conversaciones WHERE id = %s AND user_id = %s",
+                (conversation_id, user_id)
+            )
+            if not cur.fetchone():
+                raise HTTPException(status_code=404, detail="Conversación no encontrada")
+            
+            # Eliminar mensajes primero (por foreign key)
+            cur.execute("DELETE FROM mensajes WHERE conversation_id = %s", (conversation_id,))
+            
+            # Eliminar conversación
+            cur.execute("DELETE FROM conversaciones WHERE id = %s", (conversation_id,))
+            
+            conn.commit()
+            cur.close()
         
         return {"message": "Conversación eliminada exitosamente"}
     except psycopg2.Error as err:
@@ -1005,56 +1371,58 @@ async def delete_conversation(conversation_id: str, user_id: int = Depends(get_c
 async def restart_conversation(conversation_id: str, user_id: int = Depends(get_current_user)):
     """Reiniciar contexto de una conversación"""
     try:
-        # Reiniciar contexto del usuario
-        if user_id in contextos_usuario:
-            contextos_usuario[user_id].reiniciar_sesion()
+        # Reiniciar solo el contexto de esta conversación
+        await reiniciar_contexto_conversacion(user_id, conversation_id)
         
         return {"message": "Contexto reiniciado exitosamente"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 @app.get("/context")
-async def get_context(user_id: int = Depends(get_current_user)):
-    """Obtener contexto actual del usuario"""
-    contexto_usuario = get_contexto_usuario(user_id)
-    return contexto_usuario.get_estado()
+async def get_context(conversation_id: Optional[str] = None, user_id: int = Depends(get_current_user)):
+    """Obtener contexto de una conversación (por defecto, la más reciente del usuario)"""
+    conversation_id = conversation_id or await en_hilo(LIMITE_BD, ultima_conversacion, user_id)
+    if conversation_id is None:
+        return ContextoConversacion().get_estado()
+    contexto = await obtener_contexto_conversacion(user_id, conversation_id)
+    return contexto.get_estado()
 
 @app.post("/context/reset")
-async def reset_context(user_id: int = Depends(get_current_user)):
-    """Reiniciar contexto del usuario"""
-    if user_id in contextos_usuario:
-        contextos_usuario[user_id].reiniciar_sesion()
+async def reset_context(conversation_id: Optional[str] = None, user_id: int = Depends(get_current_user)):
+    """Reiniciar contexto de una conversación (por defecto, la más reciente del usuario)"""
+    conversation_id = conversation_id or await en_hilo(LIMITE_BD, ultima_conversacion, user_id)
+    if conversation_id is not None:
+        await reiniciar_contexto_conversacion(user_id, conversation_id)
     return {"message": "Contexto reiniciado"}
 
 @app.get("/stats")
-async def get_stats():
+def get_stats():
     """Estadísticas básicas del dataset - MEJORADO"""
     try:
-        conn = psycopg2.connect(**db_config)
-        cur = conn.cursor()
-        
-        # Total defunciones
-        cur.execute('SELECT COUNT(*) FROM defunciones_principales')
-        total_defunciones = cur.fetchone()[0]
-        
-        # Total regiones
-        cur.execute('SELECT COUNT(DISTINCT "NOMBRE_REGION") FROM ubicaciones')
-        total_regiones = cur.fetchone()[0]
-        
-        # Total comunas
-        cur.execute('SELECT COUNT(DISTINCT "COMUNA") FROM ubicaciones')
-        total_comunas = cur.fetchone()[0]
-        
-        # Años disponibles
-        cur.execute('SELECT COUNT(DISTINCT "ANIO") FROM defunciones_principales')
-        total_anos = cur.fetchone()[0]
-        
-        # Años específicos
-        cur.execute('SELECT DISTINCT "ANIO" FROM defunciones_principales ORDER BY "ANIO"')
-        anos_lista = [str(row[0]) for row in cur.fetchall()]
-        
-        cur.close()
-        conn.close()
+        with pool.conexion() as conn:
+            cur = conn.cursor()
+            
+            # Total defunciones
+            cur.execute('SELECT COUNT(*) FROM defunciones_principales')
+            total_defunciones = cur.fetchone()[0]
+            
+            # Total regiones
+            cur.execute('SELECT COUNT(DISTINCT "NOMBRE_REGION") FROM ubicaciones')
+            total_regiones = cur.fetchone()[0]
+            
+            # Total comunas
+            cur.execute('SELECT COUNT(DISTINCT "COMUNA") FROM ubicaciones')
+            total_comunas = cur.fetchone()[0]
+            
+            # Años disponibles
+            cur.execute('SELECT COUNT(DISTINCT "ANIO") FROM defunciones_principales')
+            total_anos = cur.fetchone()[0]
+            
+            # Años específicos
+            cur.execute('SELECT DISTINCT "ANIO" FROM defunciones_principales ORDER BY "ANIO"')
+            anos_lista = [str(row[0]) for row in cur.fetchall()]
+            
+            cur.close()
         
         return {
             "total_defunciones": total_defunciones,
@@ -1067,102 +1435,227 @@ async def get_stats():
         raise HTTPException(status_code=500, detail=f"Error de base de datos: {err}")
 
 # === ENDPOINTS PARA EVALUACIÓN 3 (FUNCIONALIDADES AVANZADAS) ===
+# Los endpoints que solo usan la BD son def: FastAPI los ejecuta en su pool de hilos, fuera del event loop
 
 @app.get("/admin/excluded-terms")
-async def get_excluded_terms(user_id: int = Depends(get_current_user)):
+def get_excluded_terms(user_id: int = Depends(get_current_user)):
     """Obtener términos excluidos (Evaluación 3 - E)"""
     try:
-        conn = psycopg2.connect(**db_config)
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        
-        cur.execute("SELECT * FROM terminos_excluidos ORDER BY termino")
-        terms = cur.fetchall()
-        cur.close()
-        conn.close()
+        with pool.conexion() as conn:
+            cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            
+            cur.execute("SELECT * FROM terminos_excluidos ORDER BY termino")
+            terms = cur.fetchall()
+            cur.close()
         
         return {"terms": [dict(term) for term in terms]}
     except psycopg2.Error as err:
         raise HTTPException(status_code=500, detail=f"Error de base de datos: {err}")
 
 @app.post("/admin/excluded-terms")
-async def add_excluded_term(term_data: dict, user_id: int = Depends(get_current_user)):
+def add_excluded_term(term_data: dict, user_id: int = Depends(get_current_user)):
     """Agregar término excluido (Evaluación 3 - E)"""
     try:
-        conn = psycopg2.connect(**db_config)
-        cur = conn.cursor()
-        
-        cur.execute(
-            "INSERT INTO terminos_excluidos (termino, activo, created_at) VALUES (%s, %s, %s)",
-            (term_data["termino"], True, datetime.now())
-        )
-        conn.commit()
-        cur.close()
-        conn.close()
+        with pool.conexion() as conn:
+            cur = conn.cursor()
+            
+            cur.execute(
+                "INSERT INTO terminos_excluidos (termino, activo, created_at) VALUES (%s, %s, %s)",
+                (term_data["termino"], True, datetime.now())
+            )
+            notificar(cur, CANAL_TERMINOS)
+            conn.commit()
+            cur.close()
         
+        recargar_terminos_excluidos()
         return {"message": "Término agregado exitosamente"}
     except psycopg2.Error as err:
         raise HTTPException(status_code=500, detail=f"Error de base de datos: {err}")
 
 @app.delete("/admin/excluded-terms/{term_id}")
-async def delete_excluded_term(term_id: int, user_id: int = Depends(get_current_user)):
+def delete_excluded_term(term_id: int, user_id: int = Depends(get_current_user)):
     """Eliminar término excluido"""
     try:
-        conn = psycopg2.connect(**db_config)
-        cur = conn.cursor()
-        
-        cur.execute("DELETE FROM terminos_excluidos WHERE id = %s", (term_id,))
-        conn.commit()
-        cur.close()
-        conn.close()
+        with pool.conexion() as conn:
+            cur = conn.cursor()
+            
+            cur.execute("DELETE FROM terminos_excluidos WHERE id = %s", (term_id,))
+            notificar(cur, CANAL_TERMINOS)
+            conn.commit()
+            cur.close()
         
+        recargar_terminos_excluidos()
         return {"message": "Término eliminado exitosamente"}
     except psycopg2.Error as err:
         raise HTTPException(status_code=500, detail=f"Error de base de datos: {err}")
 
 @app.get("/admin/prompt-config")
-async def get_prompt_config(user_id: int = Depends(get_current_user)):
+def get_prompt_config(user_id: int = Depends(get_current_user)):
     """Obtener configuración de prompts (Evaluación 3 - F)"""
     try:
-        conn = psycopg2.connect(**db_config)
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        
-        cur.execute("SELECT * FROM configuracion_prompts WHERE activo = true ORDER BY created_at DESC LIMIT 1")
-        config = cur.fetchone()
-        cur.close()
-        conn.close()
+        with pool.conexion() as conn:
+            cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            
+            cur.execute("SELECT * FROM configuracion_prompts WHERE activo = true ORDER BY created_at DESC LIMIT 1")
+            config = cur.fetchone()
+            cur.close()
         
         return {"config": dict(config)} if config else {"message": "Sin configuración activa"}
     except psycopg2.Error as err:
         raise HTTPException(status_code=500, detail=f"Error de base de datos: {err}")
 
 @app.post("/admin/prompt-config")
-async def update_prompt_config(config_data: dict, user_id: int = Depends(get_current_user)):
+def update_prompt_config(config_data: dict, user_id: int = Depends(get_current_user)):
     """Actualizar configuración de prompts (Evaluación 3 - F)"""
     try:
-        conn = psycopg2.connect(**db_config)
-        cur = conn.cursor()
-        
-        # Desactivar configuración anterior
-        cur.execute("UPDATE configuracion_prompts SET activo = false")
+        with pool.conexion() as conn:
+            cur = conn.cursor()
+            
+            # Desactivar configuración anterior
+            cur.execute("UPDATE configuracion_prompts SET activo = false")
+            
+            # Crear nueva configuración
+            cur.execute(
+                "INSERT INTO configuracion_prompts (nombre, configuracion, activo, created_at) VALUES (%s, %s, %s, %s)",
+                (config_data["nombre"], json.dumps(config_data["configuracion"]), True, datetime.now())
+            )
+            notificar(cur, CANAL_CONFIGURACION)
+            conn.commit()
+            cur.close()
         
-        # Crear nueva configuración
-        cur.execute(
-            "INSERT INTO configuracion_prompts (nombre, configuracion, activo, created_at) VALUES (%s, %s, %s, %s)",
-            (config_data["nombre"], json.dumps(config_data["configuracion"]), True, datetime.now())
-        )
-        conn.commit()
-        cur.close()
-        conn.close()
+        # Este worker la aplica de inmediato (y descarta el SQL cacheado); los demás al recibir el NOTIFY
+        config_prompts.refrescar()
         
         return {"message": "Configuración actualizada exitosamente"}
     except psycopg2.Error as err:
         raise HTTPException(status_code=500, detail=f"Error de base de datos: {err}")
 
-@app.get("/chat/details/{message_id}")
-async def get_message_details(message_id: int, user_id: int = Depends(get_current_user)):
-    """Obtener detalles ampliados de un mensaje para MODALES (Evaluación 3 - G)"""
-    try:
-        conn = psycopg2.connect(**db_config)
+@app.get("/admin/notification-stats")
+async def get_notification_stats(user_id: int = Depends(get_current_user)):
+    """Estado de LISTEN/NOTIFY y de las cachés de administración que dependen de él"""
+    return {
+        "escucha": escucha_notificaciones.estadisticas(),
+        "configuracion_prompts": config_prompts.estadisticas(),
+        "terminos_excluidos": automata_terminos.estadisticas() if automata_terminos else None
+    }
+
+@app.get("/admin/context-stats")
+async def get_context_stats(user_id: int = Depends(get_current_user)):
+    """Contextos de conversación en memoria (cantidad, expulsiones y memoria estimada) y extractor de slots"""
+    return {"contextos": contextos_conversacion.estadisticas(), "slots": extractor_activo().estadisticas()}
+
+def metricas_componentes() -> list:
+    """Series leídas de los componentes al exportar /metrics: caches, coalescencia, pool y SQL generado"""
+    series = []
+    caches = [c.estadisticas() for c in (cache_sql, cache_resultados, prefetch_consultas.almacen, guardia_costos.planes)]
+    sql = analizador_activo().estadisticas()
+    memo = sql['memo_aciertos'] + sql['memo_fallos']
+    caches.append({
+        'nombre': 'analisis_sql', 'aciertos': sql['memo_aciertos'], 'fallos': sql['memo_fallos'],
+        'tasa_aciertos': round(sql['memo_aciertos'] / memo, 4) if memo else 0.0, 'entradas': sql['memo_entradas']
+    })
+    for datos in caches:
+        etiquetas = {'cache': datos['nombre']}
+        series += [
+            ("cache_aciertos_total", "counter", "Aciertos por cache", etiquetas, datos['aciertos']),
+            ("cache_fallos_total", "counter", "Fallos por cache", etiquetas, datos['fallos']),
+            ("cache_tasa_aciertos", "gauge", "Aciertos / consultas por cache", etiquetas, datos['tasa_aciertos']),
+            ("cache_entradas", "gauge", "Entradas por cache", etiquetas, datos['entradas']),
+        ]
+    
+    for coalescedor in (coalescedor_sql, coalescedor_resultados, coalescedor_respuestas):
+        datos = coalescedor.estadisticas()
+        for tipo in ('ejecutadas', 'coalescidas'):
+            series.append(("coalescencia_total", "counter", "Llamadas ejecutadas o unidas a una en vuelo",
+                           {'coalescedor': datos['nombre'], 'tipo': tipo}, datos[tipo]))
+    
+    for motivo, cantidad in sql['rechazos'].items():
+        series.append(("sql_rechazos_total", "counter", "SQL generado rechazado por el analizador",
+                       {'motivo': motivo}, cantidad))
+    guardia = guardia_costos.estadisticas()
+    for evento in ('ejecutadas', 'explicadas', 'rechazadas', 'reescritas', 'canceladas'):
+        series.append(("sql_guardia_total", "counter", "Consultas por resultado de la guardia de costo",
+                       {'evento': evento}, guardia[evento]))
+    
+    datos = pool.estadisticas()
+    for estado in ('en_uso', 'libres', 'esperando'):
+        series.append(("pool_conexiones", "gauge", "Conexiones del pool por estado", {'estado': estado}, datos[estado]))
+    series.append(("pool_timeouts_total", "counter", "Adquisiciones que agotaron la espera", {}, datos['timeouts']))
+    return series
+
+registro.agregar_colector(metricas_componentes)
+registro.registrar_histograma("pool_espera_segundos", "Espera para obtener una conexión del pool", pool.histograma_espera)
+
+@app.get("/metrics")
+async def get_metrics():
+    """Métricas en formato Prometheus (sin autenticación, para el scraper): etapas, tokens, caches, pool y SQL"""
+    return PlainTextResponse(registro.exportar(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/admin/pool-stats")
+async def get_pool_stats(user_id: int = Depends(get_current_user)):
+    """Métricas del pool de conexiones (en uso, en espera, tiempos de espera)"""
+    return {"pool": pool.estadisticas()}
+
+@app.get("/admin/cache-stats")
+async def get_cache_stats(user_id: int = Depends(get_current_user)):
+    """Métricas de las caches del pipeline de chat"""
+    return {
+        "caches": [cache_sql.estadisticas(), cache_resultados.estadisticas()],
+        "coalescencia": [
+            coalescedor_sql.estadisticas(),
+            coalescedor_resultados.estadisticas(),
+            coalescedor_respuestas.estadisticas()
+        ],
+        "version_dataset": _version_dataset['valor']
+    }
+
+@app.get("/admin/intent-stats")
+async def get_intent_stats(user_id: int = Depends(get_current_user)):
+    """Cobertura del atajo por intenciones (preguntas resueltas sin generar SQL con el LLM)"""
+    return {"intenciones": motor_intenciones.estadisticas(), "activo": INTENCIONES_ACTIVAS}
+
+@app.get("/admin/prefetch-stats")
+async def get_prefetch_stats(user_id: int = Depends(get_current_user)):
+    """Prefetch especulativo de seguimientos: programadas, ejecutadas, aciertos y omitidas por presupuesto/carga"""
+    return {"prefetch": prefetch_consultas.estadisticas(), "activo": PREFETCH_ACTIVO, "k": PREFETCH_K}
+
+@app.get("/admin/followup-stats")
+async def get_followup_stats(user_id: int = Depends(get_current_user)):
+    """Seguimientos respondidos con las filas de la respuesta anterior (sin LLM ni BD)"""
+    return {"seguimiento": estadisticas_seguimiento, "activo": SEGUIMIENTO_LOCAL_ACTIVO, "max_filas": SEGUIMIENTO_MAX_FILAS}
+
+@app.get("/admin/expansion-stats")
+async def get_expansion_stats(user_id: int = Depends(get_current_user)):
+    """Reglas de expansión de preguntas de continuación: cuántas veces aplicó cada una"""
+    return {"expansion": motor_activo().estadisticas()}
+
+@app.get("/admin/sql-stats")
+async def get_sql_stats(user_id: int = Depends(get_current_user)):
+    """Validación del SQL generado (rechazos por motivo, memo del análisis) y guardia de costo/timeout"""
+    return {"sql": analizador_activo().estadisticas(), "guardia": guardia_costos.estadisticas()}
+
+@app.get("/admin/rollup-stats")
+async def get_rollup_stats(user_id: int = Depends(get_current_user)):
+    """Uso de los cubos pre-agregados (consultas reescritas, verificadas y discrepancias)"""
+    with _lock_rollups:
+        contadores = dict(estadisticas_rollups)
+    return {
+        "rollups": contadores,
+        "activo": ROLLUPS_ACTIVOS,
+        "verificar": ROLLUP_VERIFICAR,
+        "cubos": sorted(cubos_disponibles),
+        "version_dataset": _version_dataset['valor'],
+        "version_rollups": _version_dataset['rollups']
+    }
+
+@app.get("/admin/columnar-stats")
+async def get_columnar_stats(user_id: int = Depends(get_current_user)):
+    """Estado del motor columnar en memoria (filas, memoria, consultas resueltas)"""
+    return {"motor_columnar": motor_columnar.estadisticas(), "activo": MOTOR_COLUMNAR_ACTIVO}
+
+def obtener_mensaje_y_conversacion(message_id: int, user_id: int):
+    """Mensaje del usuario y estadísticas de su conversación (bloqueante: se llama con en_hilo)"""
+    with pool.conexion() as conn:
         cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
         
         # Obtener mensaje con datos adicionales
@@ -1177,6 +1670,25 @@ async def get_message_details(message_id: int, user_id: int = Depends(get_curren
         if not message:
             raise HTTPException(status_code=404, detail="Mensaje no encontrado")
         
+        # Contexto de la conversación
+        cur.execute("""
+            SELECT COUNT(*) as total_mensajes,
+                   MIN(created_at) as inicio_conversacion,
+                   MAX(created_at) as ultimo_mensaje
+            FROM mensajes 
+            WHERE conversation_id = %s
+        """, (message['conversation_id'],))
+        
+        conv_stats = cur.fetchone()
+        cur.close()
+    return message, conv_stats
+
+@app.get("/chat/details/{message_id}")
+async def get_message_details(message_id: int, user_id: int = Depends(get_current_user)):
+    """Obtener detalles ampliados de un mensaje para MODALES (Evaluación 3 - G)"""
+    try:
+        message, conv_stats = await en_hilo(LIMITE_BD, obtener_mensaje_y_conversacion, message_id, user_id)
+        
         # Construir detalles ampliados para modal
         details = dict(message)
         
@@ -1200,8 +1712,9 @@ async def get_message_details(message_id: int, user_id: int = Depends(get_curren
                 'complejidad': 'ALTA' if sql.count('JOIN') > 1 else 'MEDIA' if 'JOIN' in sql else 'BÁSICA'
             }
             
-            # Ejecutar SQL de nuevo para datos actualizados
-            resultado_actual = ejecutar_sql(sql)
+            # Ejecutar SQL de nuevo para datos actualizados (fuera del bloque anterior
+            # para no retener dos conexiones del pool a la vez)
+            resultado_actual = await ejecutar_sql_async(sql)
             details['datos_actualizados'] = resultado_actual
             
             # Información estadística adicional si es numérica
@@ -1216,21 +1729,8 @@ async def get_message_details(message_id: int, user_id: int = Depends(get_curren
                             'porcentaje_del_total': round((valor / 303779) * 100, 2) if valor < 303779 else 100
                         }
         
-        # Contexto de la conversación
-        cur.execute("""
-            SELECT COUNT(*) as total_mensajes,
-                   MIN(created_at) as inicio_conversacion,
-                   MAX(created_at) as ultimo_mensaje
-            FROM mensajes 
-            WHERE conversation_id = %s
-        """, (message['conversation_id'],))
-        
-        conv_stats = cur.fetchone()
         details['contexto_conversacion'] = dict(conv_stats)
         
-        cur.close()
-        conn.close()
-        
         return details
         
     except psycopg2.Error as err:
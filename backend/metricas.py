@@ -0,0 +1,213 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+# Límites por defecto (segundos) para histogramas de latencia
+LIMITES_LATENCIA = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histograma:
+    """Histograma acumulativo simple y seguro entre hilos"""
+
+    def __init__(self, limites=LIMITES_LATENCIA):
+        self.limites = tuple(sorted(limites))
+        self._cubetas = [0] * (len(self.limites) + 1)
+        self._suma = 0.0
+        self._cantidad = 0
+        self._lock = threading.Lock()
+
+    def observar(self, valor: float):
+        """Registrar una observación"""
+        indice = len(self.limites)
+        for i, limite in enumerate(self.limites):
+            if valor <= limite:
+                indice = i
+                break
+        with self._lock:
+            self._cubetas[indice] += 1
+            self._suma += valor
+            self._cantidad += 1
+
+    def resumen(self) -> dict:
+        """Obtener cubetas acumuladas, suma y cantidad"""
+        with self._lock:
+            cubetas = list(self._cubetas)
+            suma = self._suma
+            cantidad = self._cantidad
+
+        acumulado = 0
+        cubetas_acumuladas = {}
+        for limite, valor in zip(self.limites, cubetas):
+            acumulado += valor
+            cubetas_acumuladas[str(limite)] = acumulado
+        cubetas_acumuladas["+Inf"] = cantidad
+
+        return {
+            "cubetas": cubetas_acumuladas,
+            "suma": round(suma, 6),
+            "cantidad": cantidad,
+            "promedio": round(suma / cantidad, 6) if cantidad else 0.0
+        }
+
+
+# Límites para etapas del chat: las llamadas al LLM pueden tardar más de 10 s
+LIMITES_ETAPAS = LIMITES_LATENCIA + (20.0, 30.0)
+
+
+def _etiquetas(etiquetas: dict) -> str:
+    if not etiquetas:
+        return ""
+    partes = []
+    for clave, valor in sorted(etiquetas.items()):
+        valor = str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        partes.append(f'{clave}="{valor}"')
+    return "{" + ",".join(partes) + "}"
+
+
+def _numero(valor) -> str:
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return str(valor)
+
+
+class RegistroMetricas:
+    """Histogramas y contadores con etiquetas, exportables en el formato de texto de Prometheus"""
+
+    def __init__(self, prefijo: str = "defunciones"):
+        self.prefijo = prefijo
+        self._ayuda = {}            # nombre -> (tipo, ayuda)
+        self._histogramas = {}      # (nombre, etiquetas) -> Histograma
+        self._contadores = {}       # (nombre, etiquetas) -> valor
+        self._colectores = []       # funciones que entregan [(nombre, tipo, ayuda, etiquetas, valor)] al exportar
+        self._lock = threading.Lock()
+
+    def histograma(self, nombre: str, ayuda: str = "", limites=LIMITES_LATENCIA, **etiquetas) -> Histograma:
+        """Histograma con esas etiquetas (se crea la primera vez)"""
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            histograma = self._histogramas.get(clave)
+            if histograma is None:
+                histograma = self._histogramas[clave] = Histograma(limites)
+                self._ayuda.setdefault(nombre, ('histogram', ayuda))
+            return histograma
+
+    def registrar_histograma(self, nombre: str, ayuda: str, histograma: Histograma, **etiquetas):
+        """Exportar un histograma que ya mantiene otro componente (ej. espera del pool)"""
+        with self._lock:
+            self._histogramas[(nombre, tuple(sorted(etiquetas.items())))] = histograma
+            self._ayuda.setdefault(nombre, ('histogram', ayuda))
+
+    def incrementar(self, nombre: str, valor: float = 1, ayuda: str = "", **etiquetas):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            self._contadores[clave] = self._contadores.get(clave, 0) + valor
+            self._ayuda.setdefault(nombre, ('counter', ayuda))
+
+    def agregar_colector(self, colector):
+        """Registrar una función que lee métricas ya existentes (caches, pool...) al momento de exportar"""
+        with self._lock:
+            self._colectores.append(colector)
+
+    def exportar(self) -> str:
+        """Todas las métricas en formato de exposición de texto de Prometheus (versión 0.0.4)"""
+        with self._lock:
+            ayuda = dict(self._ayuda)
+            histogramas = sorted(self._histogramas.items(), key=lambda e: e[0])
+            contadores = sorted(self._contadores.items(), key=lambda e: e[0])
+            colectores = list(self._colectores)
+
+        series = {}     # nombre -> líneas
+        for (nombre, etiquetas), valor in contadores:
+            series.setdefault(nombre, []).append(f"{self.prefijo}_{nombre}{_etiquetas(dict(etiquetas))} {_numero(valor)}")
+
+        for (nombre, etiquetas), histograma in histogramas:
+            etiquetas = dict(etiquetas)
+            resumen = histograma.resumen()
+            lineas = series.setdefault(nombre, [])
+            for limite, acumulado in resumen["cubetas"].items():
+                lineas.append(f"{self.prefijo}_{nombre}_bucket{_etiquetas({**etiquetas, 'le': limite})} {acumulado}")
+            lineas.append(f"{self.prefijo}_{nombre}_sum{_etiquetas(etiquetas)} {resumen['suma']}")
+            lineas.append(f"{self.prefijo}_{nombre}_count{_etiquetas(etiquetas)} {resumen['cantidad']}")
+
+        for colector in colectores:
+            for nombre, tipo, texto_ayuda, etiquetas, valor in colector():
+                ayuda.setdefault(nombre, (tipo, texto_ayuda))
+                series.setdefault(nombre, []).append(
+                    f"{self.prefijo}_{nombre}{_etiquetas(etiquetas)} {_numero(valor)}"
+                )
+
+        salida = []
+        for nombre in sorted(series):
+            tipo, texto_ayuda = ayuda.get(nombre, ('untyped', ''))
+            if texto_ayuda:
+                salida.append(f"# HELP {self.prefijo}_{nombre} {texto_ayuda}")
+            salida.append(f"# TYPE {self.prefijo}_{nombre} {tipo}")
+            salida.extend(series[nombre])
+        return "\n".join(salida) + "\n"
+
+
+registro = RegistroMetricas()
+
+
+# === TRAZAS POR SOLICITUD ===
+
+class Traza:
+    """Duración de cada etapa de una solicitud (para Server-Timing y el log de la solicitud)"""
+
+    def __init__(self, nombre: str):
+        self.nombre = nombre
+        self.inicio = time.perf_counter()
+        self.etapas = {}            # etapa -> segundos (acumulados si se repite)
+        self._lock = threading.Lock()
+
+    def registrar(self, etapa: str, segundos: float):
+        with self._lock:
+            self.etapas[etapa] = self.etapas.get(etapa, 0.0) + segundos
+
+    def total(self) -> float:
+        return time.perf_counter() - self.inicio
+
+    def server_timing(self) -> str:
+        """Valor del encabezado Server-Timing (milisegundos)"""
+        with self._lock:
+            etapas = list(self.etapas.items())
+        partes = [f"{etapa};dur={segundos * 1000:.1f}" for etapa, segundos in etapas]
+        partes.append(f"total;dur={self.total() * 1000:.1f}")
+        return ", ".join(partes)
+
+
+# La traza viaja con el contexto de la solicitud; asyncio.to_thread lo copia a los hilos de en_hilo
+_traza_actual = contextvars.ContextVar("traza_actual", default=None)
+
+
+def iniciar_traza(nombre: str):
+    """Crear la traza de la solicitud actual; retorna (traza, token para terminar_traza)"""
+    traza = Traza(nombre)
+    return traza, _traza_actual.set(traza)
+
+
+def terminar_traza(token):
+    _traza_actual.reset(token)
+
+
+def traza_actual() -> Optional[Traza]:
+    return _traza_actual.get()
+
+
+@contextmanager
+def etapa(nombre: str):
+    """Medir una etapa del pipeline: histograma etapa_duracion_segundos{etapa} y traza de la solicitud"""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        segundos = time.perf_counter() - inicio
+        registro.histograma(
+            "etapa_duracion_segundos", "Duración de cada etapa del pipeline de chat",
+            limites=LIMITES_ETAPAS, etapa=nombre
+        ).observar(segundos)
+        traza = _traza_actual.get()
+        if traza is not None:
+            traza.registrar(nombre, segundos)
@@ -0,0 +1,252 @@
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from rollups import analizar_consulta
+
+# NumPy es opcional: sin él el motor queda deshabilitado y todo se consulta en PostgreSQL
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+NUMPY_DISPONIBLE = np is not None
+
+
+@dataclass
+class _Columna:
+    """Columna codificada por diccionario: codigos[i] es el índice en valores (None incluido)"""
+    valores: list
+    codigos: "np.ndarray"
+
+
+@dataclass
+class _Instantanea:
+    """Datos en memoria de una versión del dataset (inmutable una vez construida)"""
+    version: object
+    filas: int
+    columnas: dict                      # dimensión -> _Columna
+    con_ubicacion: "np.ndarray"
+    con_diagnostico: "np.ndarray"
+    joins_validos: set                  # tablas cuyo JOIN no multiplica filas
+
+
+def _codificar(valores) -> _Columna:
+    """Codificación por diccionario de una columna"""
+    diccionario = {}
+    codigos = np.fromiter(
+        (diccionario.setdefault(v, len(diccionario)) for v in valores),
+        dtype=np.int32,
+        count=len(valores)
+    )
+    return _Columna(list(diccionario), codigos)
+
+
+def _derivar(base: _Columna, valor_de) -> _Columna:
+    """Columna derivada de otra aplicando valor_de a cada entrada de su diccionario"""
+    derivada = _codificar([valor_de(v) for v in base.valores])
+    return _Columna(derivada.valores, derivada.codigos[base.codigos])
+
+
+def _literal(texto: str):
+    """Literal SQL (entero o cadena) a valor Python"""
+    texto = texto.strip()
+    if texto.startswith("'"):
+        return texto[1:-1].replace("''", "'")
+    return int(texto)
+
+
+_OPERADORES = {
+    '=': lambda v, a: v == a,
+    '<>': lambda v, a: v != a,
+    '!=': lambda v, a: v != a,
+    '<': lambda v, a: v < a,
+    '>': lambda v, a: v > a,
+    '<=': lambda v, a: v <= a,
+    '>=': lambda v, a: v >= a,
+}
+
+
+class MotorColumnar:
+    """
+    Copia en memoria de defunciones_principales (con ubicaciones y diagnosticos resueltos)
+    que responde los conteos filtrados/agrupados del catálogo de patrones sin consultar PostgreSQL
+    """
+
+    def __init__(self):
+        self._datos: Optional[_Instantanea] = None
+        self.cargas = 0
+        self.segundos_carga = 0.0
+        self.resueltas = 0
+        self.no_soportadas = 0
+
+    @property
+    def version(self):
+        return self._datos.version if self._datos else None
+
+    def cargar(self, conn, version):
+        """Construir la instantánea desde las tres tablas y reemplazar la anterior"""
+        inicio = time.perf_counter()
+        cur = conn.cursor()
+        # Las tres lecturas deben ver el mismo estado del dataset
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        cur.execute("""
+            SELECT "ANIO", EXTRACT(MONTH FROM "FECHA_DEF")::int, "SEXO_NOMBRE",
+                   "COD_COMUNA", "DIAG1", "LUGAR_DEFUNCION"
+            FROM defunciones_principales
+        """)
+        filas = cur.fetchall()
+        anios, meses, sexos, comunas, diags, lugares = zip(*filas) if filas else ((),) * 6
+        cur.execute('SELECT "COD_COMUNA", "COMUNA", "NOMBRE_REGION" FROM ubicaciones')
+        ubicaciones = cur.fetchall()
+        cur.execute("SELECT codigo_diagnostico, capitulo, descripcion_capitulo FROM diagnosticos")
+        diagnosticos = cur.fetchall()
+        cur.close()
+        conn.rollback()
+
+        columnas = {
+            'ANIO': _codificar(anios),
+            'MES': _codificar(meses),
+            'SEXO_NOMBRE': _codificar(sexos),
+            'LUGAR_DEFUNCION': _codificar(lugares),
+        }
+        cod_comuna = _codificar(comunas)
+        diag1 = _codificar(diags)
+        columnas['DIAG1'] = diag1
+
+        # Un JOIN con llaves repetidas multiplica filas: esas consultas se dejan a PostgreSQL
+        joins_validos = set()
+        por_comuna = {fila[0]: fila for fila in ubicaciones}
+        if len(por_comuna) == len(ubicaciones):
+            joins_validos.add('ubicaciones')
+        por_diagnostico = {fila[0]: fila for fila in diagnosticos}
+        if len(por_diagnostico) == len(diagnosticos):
+            joins_validos.add('diagnosticos')
+
+        def campo(tabla, i):
+            return lambda v: tabla[v][i] if v in tabla else None
+
+        columnas['COMUNA'] = _derivar(cod_comuna, campo(por_comuna, 1))
+        columnas['NOMBRE_REGION'] = _derivar(cod_comuna, campo(por_comuna, 2))
+        columnas['capitulo'] = _derivar(diag1, campo(por_diagnostico, 1))
+        columnas['descripcion_capitulo'] = _derivar(diag1, campo(por_diagnostico, 2))
+        columnas['LETRA_DIAG1'] = _derivar(diag1, lambda v: v[:1] if v is not None else None)
+
+        con_ubicacion = np.array([v in por_comuna for v in cod_comuna.valores], dtype=bool)[cod_comuna.codigos]
+        con_diagnostico = np.array([v in por_diagnostico for v in diag1.valores], dtype=bool)[diag1.codigos]
+
+        self._datos = _Instantanea(
+            version=version,
+            filas=len(anios),
+            columnas=columnas,
+            con_ubicacion=con_ubicacion,
+            con_diagnostico=con_diagnostico,
+            joins_validos=joins_validos
+        )
+        self.cargas += 1
+        self.segundos_carga = round(time.perf_counter() - inicio, 3)
+
+    def _permitidos(self, columna: _Columna, operador: str, literales: list):
+        """Máscara sobre el diccionario: qué valores cumplen la condición (NULL nunca la cumple)"""
+        valores = [_literal(l) for l in literales]
+        numerica = any(isinstance(v, int) for v in columna.valores if v is not None)
+        if numerica:
+            valores = [int(v) for v in valores]
+        elif any(isinstance(v, int) for v in valores):
+            return None
+
+        if operador == 'IN':
+            cumple = lambda v: v in valores
+        elif operador == 'BETWEEN':
+            cumple = lambda v: valores[0] <= v <= valores[1]
+        else:
+            comparar = _OPERADORES[operador]
+            cumple = lambda v: comparar(v, valores[0])
+        return np.array([v is not None and cumple(v) for v in columna.valores], dtype=bool)
+
+    def ejecutar(self, sql: str) -> Optional[list]:
+        """Ejecutar un conteo filtrado/agrupado; retorna None si la consulta no es soportada"""
+        datos = self._datos
+        consulta = analizar_consulta(sql) if datos is not None else None
+        if consulta is None or (consulta.tablas - {'defunciones_principales'}) - datos.joins_validos:
+            self.no_soportadas += 1
+            return None
+
+        mascara = np.ones(datos.filas, dtype=bool)
+        if 'ubicaciones' in consulta.tablas:
+            mascara &= datos.con_ubicacion
+        if 'diagnosticos' in consulta.tablas:
+            mascara &= datos.con_diagnostico
+        try:
+            for dimension, operador, literales in consulta.filtros:
+                columna = datos.columnas[dimension]
+                permitidos = self._permitidos(columna, operador, literales)
+                if permitidos is None:
+                    self.no_soportadas += 1
+                    return None
+                mascara &= permitidos[columna.codigos]
+        except ValueError:
+            self.no_soportadas += 1
+            return None
+
+        # ORDER BY sobre columnas no agrupadas es un error en PostgreSQL: que lo reporte él
+        if any(c[0] == 'dimension' and c[1] not in consulta.agrupacion for c, _ in consulta.orden):
+            self.no_soportadas += 1
+            return None
+
+        grupos = self._agrupar(datos, consulta.agrupacion, mascara)
+
+        # Orden estable: aplicar las llaves de la última a la primera (NULL al final en ASC, al inicio en DESC)
+        for (tipo, dimension, _), direccion in reversed(consulta.orden):
+            if tipo == 'conteo':
+                grupos.sort(key=lambda g: g[1], reverse=direccion == 'DESC')
+            else:
+                indice = consulta.agrupacion.index(dimension)
+                grupos.sort(key=lambda g: (g[0][indice] is None, g[0][indice]), reverse=direccion == 'DESC')
+        if consulta.limite is not None:
+            grupos = grupos[:consulta.limite]
+
+        resultado = []
+        for valores, total in grupos:
+            fila = {}
+            for tipo, dimension, alias in consulta.columnas:
+                nombre = alias.strip('"')
+                fila[nombre] = total if tipo == 'conteo' else valores[consulta.agrupacion.index(dimension)]
+            resultado.append(fila)
+        self.resueltas += 1
+        return resultado
+
+    def _agrupar(self, datos: _Instantanea, agrupacion: list, mascara) -> list:
+        """Conteo por grupo: [(valores de las dimensiones, total)]"""
+        if not agrupacion:
+            return [((), int(np.count_nonzero(mascara)))]
+
+        # Llave compuesta en base mixta a partir de los códigos de cada dimensión
+        columnas = [datos.columnas[d] for d in agrupacion]
+        llave = np.zeros(int(np.count_nonzero(mascara)), dtype=np.int64)
+        for columna in columnas:
+            llave = llave * len(columna.valores) + columna.codigos[mascara]
+        llaves, totales = np.unique(llave, return_counts=True)
+
+        grupos = []
+        for llave_grupo, total in zip(llaves.tolist(), totales.tolist()):
+            valores = []
+            for columna in reversed(columnas):
+                llave_grupo, codigo = divmod(llave_grupo, len(columna.valores))
+                valores.append(columna.valores[codigo])
+            grupos.append((tuple(reversed(valores)), total))
+        return grupos
+
+    def estadisticas(self) -> dict:
+        datos = self._datos
+        return {
+            "disponible": NUMPY_DISPONIBLE,
+            "cargado": datos is not None,
+            "version": datos.version if datos else None,
+            "filas": datos.filas if datos else 0,
+            "bytes": sum(c.codigos.nbytes for c in datos.columnas.values()) if datos else 0,
+            "cargas": self.cargas,
+            "segundos_ultima_carga": self.segundos_carga,
+            "resueltas": self.resueltas,
+            "no_soportadas": self.no_soportadas
+        }
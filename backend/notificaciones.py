@@ -0,0 +1,102 @@
+import logging
+import select
+import threading
+
+import psycopg2
+import psycopg2.extensions
+
+log = logging.getLogger(__name__)
+
+
+def notificar(cur, canal: str, mensaje: str = ""):
+    """Emitir NOTIFY dentro de la transacción del cursor (se entrega al hacer commit)"""
+    cur.execute("SELECT pg_notify(%s, %s)", (canal, mensaje))
+
+
+class EscuchaNotificaciones:
+    """
+    Hilo con una conexión dedicada (fuera del pool) que hace LISTEN en los canales
+    suscritos y despacha cada NOTIFY al callback del canal
+    """
+
+    def __init__(self, db_config: dict, reintento: float = 5.0, espera: float = 1.0):
+        self.db_config = db_config
+        self.reintento = reintento
+        self.espera = espera
+        self._suscripciones = {}
+        self._detener = threading.Event()
+        self._hilo = None
+        self.recibidas = 0
+        self.reconexiones = 0
+        self.conectado = False
+
+    def suscribir(self, canal: str, callback):
+        """Registrar callback(mensaje) para un canal (antes de iniciar)"""
+        self._suscripciones.setdefault(canal, []).append(callback)
+
+    def iniciar(self):
+        if self._hilo is not None or not self._suscripciones:
+            return
+        self._hilo = threading.Thread(target=self._ejecutar, name="escucha-notificaciones", daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout=self.espera * 2)
+            self._hilo = None
+
+    def _despachar(self, canal: str, mensaje: str):
+        for callback in self._suscripciones.get(canal, []):
+            try:
+                callback(mensaje)
+            except Exception as e:
+                log.warning("⚠️ Error procesando notificación '%s': %s", canal, e)
+
+    def _ejecutar(self):
+        primera = True
+        while not self._detener.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**self.db_config)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                cur = conn.cursor()
+                for canal in self._suscripciones:
+                    cur.execute(f'LISTEN "{canal}"')
+                cur.close()
+                self.conectado = True
+
+                # Tras una reconexión se pudieron perder avisos: despachar todos los canales
+                if not primera:
+                    self.reconexiones += 1
+                    for canal in self._suscripciones:
+                        self._despachar(canal, "")
+                primera = False
+
+                while not self._detener.is_set():
+                    if select.select([conn], [], [], self.espera) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        aviso = conn.notifies.pop(0)
+                        self.recibidas += 1
+                        self._despachar(aviso.channel, aviso.payload)
+            except psycopg2.Error as err:
+                self.conectado = False
+                log.warning("⚠️ Escucha de notificaciones desconectada: %s", err)
+                self._detener.wait(self.reintento)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except psycopg2.Error:
+                        pass
+        self.conectado = False
+
+    def estadisticas(self) -> dict:
+        return {
+            "canales": sorted(self._suscripciones),
+            "conectado": self.conectado,
+            "recibidas": self.recibidas,
+            "reconexiones": self.reconexiones
+        }
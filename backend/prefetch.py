@@ -0,0 +1,170 @@
+import logging
+import queue
+import threading
+import time
+from typing import Optional
+
+from contexto import ContextoConversacion
+from formateador import responder_seguimiento
+from reglas_expansion import motor_activo
+
+log = logging.getLogger(__name__)
+
+# Seguimientos frecuentes según los registros de uso: (slot de la sesión que los activa, pregunta probable),
+# en orden de probabilidad. "y en hombres" / "y en mujeres" no están: su expansión sigue el tema de la
+# pregunta anterior ("muertes en hombres en ...") y la resuelve el LLM con el contexto, no una plantilla
+PREDICCIONES_SEGUIMIENTO = (
+    ('ultima_region', "cuál es la principal causa"),
+    ('ultimo_año', "qué mes tuvo más muertes?"),
+)
+
+
+def predecir_consultas(contexto: ContextoConversacion, motor_intenciones, k: int) -> list:
+    """
+    SQL de los k seguimientos más probables: se simula el turno siguiente (slots, expansión y plantilla)
+    sobre una copia de la sesión. Solo se predicen los que resolvería una plantilla, no el LLM.
+    """
+    anterior = contexto.resultado_anterior()
+    consultas = []
+    for slot, pregunta in PREDICCIONES_SEGUIMIENTO:
+        if len(consultas) >= k:
+            break
+        if not contexto.sesion_actual.get(slot):
+            continue
+        # Se respondería con las filas de la respuesta anterior, sin BD
+        if anterior is not None and responder_seguimiento(anterior['resultado'], pregunta, anterior.get('completo', False)) is not None:
+            continue
+
+        simulado = ContextoConversacion()
+        simulado.sesion_actual = dict(contexto.sesion_actual)
+        simulado.historial_sesion = list(contexto.historial_sesion)
+        simulado.detectar_contexto_en_pregunta(pregunta)
+        expandida, _ = motor_activo().expandir(pregunta, simulado.sesion_actual, simulado.historial_sesion, contar=False)
+
+        intencion = motor_intenciones.clasificar(expandida, original=pregunta)
+        if intencion is None or intencion.confianza < motor_intenciones.umbral:
+            continue
+        if intencion.sql not in consultas:
+            consultas.append(intencion.sql)
+    return consultas
+
+
+class PrefetchConsultas:
+    """
+    Ejecuta en segundo plano, con baja prioridad, consultas que probablemente se pidan en el turno
+    siguiente y guarda sus resultados en un almacén acotado que ejecutar_sql consulta primero.
+    Un solo hilo, un presupuesto global de consultas por minuto y nada si el pool tiene poca holgura.
+    """
+
+    def __init__(self, ejecutar, clave, cacheado, almacen, holgura, presupuesto_minuto: int = 60,
+                 holgura_minima: int = 2, max_pendientes: int = 32):
+        # ejecutar(sql) -> resultado (lista) o None; clave(sql) -> clave del almacén;
+        # cacheado(clave) -> si ya está en la cache de resultados; holgura() -> conexiones libres del pool
+        self._ejecutar = ejecutar
+        self._clave = clave
+        self._cacheado = cacheado
+        self.almacen = almacen
+        self._holgura = holgura
+        self.presupuesto_minuto = presupuesto_minuto
+        self.holgura_minima = holgura_minima
+        self._cola = queue.Queue(maxsize=max_pendientes)
+        self._lock = threading.Lock()
+        self._hilo = None
+        # Presupuesto como token bucket: se recarga de forma continua hasta presupuesto_minuto
+        self._fichas = float(presupuesto_minuto)
+        self._recarga = time.monotonic()
+        self.programadas = 0
+        self.ejecutadas = 0
+        self.omitidas_cacheadas = 0
+        self.omitidas_presupuesto = 0
+        self.omitidas_carga = 0
+        self.descartadas_cola = 0
+        self.errores = 0
+        self.aciertos = 0
+
+    def programar(self, consultas: list) -> int:
+        """Encolar consultas sin bloquear (las que no caben se descartan); retorna cuántas se encolaron"""
+        encoladas = 0
+        for sql in consultas:
+            try:
+                self._cola.put_nowait(sql)
+                encoladas += 1
+            except queue.Full:
+                with self._lock:
+                    self.descartadas_cola += 1
+        if encoladas:
+            with self._lock:
+                self.programadas += encoladas
+                if self._hilo is None:
+                    self._hilo = threading.Thread(target=self._trabajar, name="prefetch-consultas", daemon=True)
+                    self._hilo.start()
+        return encoladas
+
+    def obtener(self, clave) -> Optional[list]:
+        """Resultado precargado (se retira del almacén: pasa a la cache de resultados normal)"""
+        resultado = self.almacen.obtener(clave)
+        if resultado is not None:
+            self.almacen.eliminar(clave)
+            with self._lock:
+                self.aciertos += 1
+        return resultado
+
+    def _consumir_ficha(self) -> bool:
+        with self._lock:
+            ahora = time.monotonic()
+            self._fichas = min(
+                float(self.presupuesto_minuto),
+                self._fichas + (ahora - self._recarga) * self.presupuesto_minuto / 60.0
+            )
+            self._recarga = ahora
+            if self._fichas < 1.0:
+                return False
+            self._fichas -= 1.0
+            return True
+
+    def _trabajar(self):
+        while True:
+            sql = self._cola.get()
+            try:
+                clave = self._clave(sql)
+                if self._cacheado(clave) or self.almacen.obtener(clave) is not None:
+                    with self._lock:
+                        self.omitidas_cacheadas += 1
+                    continue
+                # Baja prioridad: no competir con las consultas de los usuarios
+                if self._holgura() < self.holgura_minima:
+                    with self._lock:
+                        self.omitidas_carga += 1
+                    continue
+                if not self._consumir_ficha():
+                    with self._lock:
+                        self.omitidas_presupuesto += 1
+                    continue
+                resultado = self._ejecutar(sql)
+                with self._lock:
+                    self.ejecutadas += 1
+                if resultado is not None:
+                    self.almacen.guardar(clave, resultado)
+            except Exception as e:
+                with self._lock:
+                    self.errores += 1
+                log.warning("⚠️ Error en prefetch de consulta: %s", e)
+            finally:
+                self._cola.task_done()
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            datos = {
+                "programadas": self.programadas,
+                "ejecutadas": self.ejecutadas,
+                "aciertos": self.aciertos,
+                "omitidas_cacheadas": self.omitidas_cacheadas,
+                "omitidas_presupuesto": self.omitidas_presupuesto,
+                "omitidas_carga": self.omitidas_carga,
+                "descartadas_cola": self.descartadas_cola,
+                "errores": self.errores,
+                "pendientes": self._cola.qsize(),
+                "presupuesto_minuto": self.presupuesto_minuto
+            }
+        datos["almacen"] = self.almacen.estadisticas()
+        return datos
@@ -0,0 +1,294 @@
+import json
+import re
+import threading
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
+from slots import extraer_slots, normalizar_slots
+from terminos import AutomataTerminos
+
+# === GRUPOS DE FRASES ===
+# Se buscan como subcadenas de la pregunta en minúsculas; un grupo se cumple si aparece cualquiera de sus frases.
+# Se respetan las tildes: "cuántas" marca una pregunta corta, pero "cuantas muertes hubo en 2024" no se reescribe
+
+PREGUNTAS_CORTAS = (
+    'cuántos?', 'cuántas?', 'cuántos', 'cuántas', 'qué cantidad?', 'total?', 'cantidad?',
+    'y en que mes hubo mas muerte?', 'y en qué mes hubo más muerte?', 'en que mes hubo mas muertes?',
+    'qué mes tuvo más muertes?'
+)
+PREGUNTA_POR_MES = ('en que mes', 'qué mes', 'mes hubo mas', 'mes tuvo más')
+REFERENCIAS_TEMPORALES = ('de este último', 'de ese', 'de este', 'del último', 'del mes', 'de ese período')
+TOTAL_DATASET = ('dame la cantidad total', 'total de datos', 'cantidad total')
+PIDE_LISTA = ('lista', 'listado', 'cuáles son', 'dame la', 'muéstrame')
+PIDE_SUMA = ('suma', 'total', 'sumar', 'coincide', 'da el conjunto')
+PIDE_CONTEO = ('cuántos son', 'cuántas son', 'puedes contarlas', 'contarlos')
+MAS_COMUN = ('cuál es la más común', 'cuál es la principal')
+
+
+@dataclass(frozen=True)
+class ReglaExpansion:
+    """
+    Regla de expansión de preguntas de continuación. Se aplica si aparece cada grupo de `frases`,
+    las variables de `requiere` tienen valor y las de `excluye` no. La plantilla usa {variable},
+    {a|b|'literal'} (primera con valor) y [partes opcionales]; si falta una variable obligatoria, no aplica.
+    """
+    nombre: str
+    prioridad: int
+    plantilla: str
+    frases: tuple = ()
+    requiere: tuple = ()
+    excluye: tuple = ()
+
+
+# Reglas por defecto, de mayor a menor prioridad (la primera que aplica define la expansión).
+# Variables: pregunta; region/comuna/año/mes/sexo/causa de la sesión; año_anterior/mes_anterior
+# (pregunta anterior); mes_reciente/año_reciente (última de las 3 interacciones previas con mes);
+# mes_respuesta/año_respuesta/region_respuesta (interacción anterior completa) y las banderas
+# historial, anterior_<tema> y respuesta_<tema> (temas: region, lista, comuna, causa, diagnostico).
+REGLAS_EXPANSION = (
+    # Preguntas ultra-cortas: siempre se expanden (aunque no haya contexto)
+    ReglaExpansion('corta_mes_y_año_anterior', 100, "cuántas defunciones hubo en {mes_anterior} de {año_anterior}",
+                   frases=(PREGUNTAS_CORTAS,), requiere=('historial',)),
+    ReglaExpansion('corta_año_anterior', 99, "cuántas defunciones hubo en {año_anterior}",
+                   frases=(PREGUNTAS_CORTAS,), requiere=('historial',)),
+    ReglaExpansion('corta_mes_reciente', 98, "cuántas defunciones hubo en {mes_reciente} de {año|año_reciente|'2024'}",
+                   frases=(PREGUNTAS_CORTAS,), requiere=('historial',)),
+    ReglaExpansion('corta_region', 97, "cuántas defunciones hubo en {region}[ en {año}]",
+                   frases=(PREGUNTAS_CORTAS,), requiere=('historial',)),
+    ReglaExpansion('corta_causa', 96, "cuántas muertes por {causa} hubo[ en {año}]",
+                   frases=(PREGUNTAS_CORTAS,), requiere=('historial',)),
+    ReglaExpansion('corta_mes_con_mas', 95, "en qué mes de {año|'2024'} hubo más defunciones",
+                   frases=(PREGUNTAS_CORTAS, PREGUNTA_POR_MES), requiere=('historial',)),
+    ReglaExpansion('corta_general', 94, "cuántas defunciones hay en total",
+                   frases=(PREGUNTAS_CORTAS,)),
+
+    # Referencias temporales a la respuesta anterior ("de ese mes")
+    ReglaExpansion('dia_semana_referencia', 80,
+                   "día de la semana con más defunciones en {mes_respuesta}[ de {año_respuesta}][ en {region_respuesta}]",
+                   frases=(REFERENCIAS_TEMPORALES, ('día de la semana',))),
+
+    # Totales, listas y conteos sobre la interacción anterior
+    ReglaExpansion('total_dataset', 70, "total de defunciones en el dataset", frases=(TOTAL_DATASET,)),
+    ReglaExpansion('lista_regiones_anterior', 60, "lista de todas las regiones con número de defunciones",
+                   frases=(PIDE_LISTA,), requiere=('respuesta_region',)),
+    ReglaExpansion('lista_regiones', 59, "lista de regiones de Chile con defunciones", frases=(('lista',),)),
+    ReglaExpansion('suma_regiones', 50, "total de defunciones en todo el dataset",
+                   frases=(PIDE_SUMA,), requiere=('historial', 'anterior_region')),
+    ReglaExpansion('suma_lista', 50, "total de defunciones en todo el dataset",
+                   frases=(PIDE_SUMA,), requiere=('historial', 'anterior_lista')),
+    ReglaExpansion('suma_general', 49, "total general de defunciones",
+                   frases=(PIDE_SUMA,), requiere=('historial',)),
+    ReglaExpansion('conteo_regiones', 40, "cuántas regiones diferentes hay en el dataset",
+                   frases=(PIDE_CONTEO, ('cuántos son', 'cuántas son', 'contarlas')), requiere=('anterior_region',)),
+    ReglaExpansion('conteo_comunas', 39, "cuántas comunas diferentes hay en el dataset",
+                   frases=(PIDE_CONTEO,), requiere=('anterior_comuna',), excluye=('anterior_region',)),
+    ReglaExpansion('conteo_causas', 38, "cuántas causas de muerte diferentes hay",
+                   frases=(PIDE_CONTEO,), requiere=('anterior_causa',), excluye=('anterior_region', 'anterior_comuna')),
+    ReglaExpansion('conteo_diagnosticos', 38, "cuántas causas de muerte diferentes hay",
+                   frases=(PIDE_CONTEO,), requiere=('anterior_diagnostico',), excluye=('anterior_region', 'anterior_comuna')),
+
+    # Continuaciones que reutilizan la sesión
+    ReglaExpansion('principal_causa_region', 30, "cuál es la principal causa de muerte en {region}",
+                   frases=(MAS_COMUN,)),
+    ReglaExpansion('principal_causa_sin_region', 29, "{pregunta}", frases=(MAS_COMUN,)),
+    ReglaExpansion('hombres_causa', 20, "muertes por {causa} en hombres[ en {region}]", frases=(('y en hombres',),)),
+    ReglaExpansion('hombres', 19, "muertes en hombres[ en {region}]", frases=(('y en hombres',),)),
+    ReglaExpansion('mujeres_causa', 18, "muertes por {causa} en mujeres[ en {region}]", frases=(('y en mujeres',),)),
+    ReglaExpansion('mujeres', 17, "muertes en mujeres[ en {region}]", frases=(('y en mujeres',),)),
+)
+
+# Temas que se buscan (sin tildes) en la interacción anterior
+TEMAS = ('region', 'lista', 'comuna', 'causa', 'diagnostico')
+
+
+# === ÍNDICE DEL HISTORIAL ===
+
+@dataclass(frozen=True)
+class IndiceInteraccion:
+    slots_pregunta: dict
+    slots_completos: dict               # Pregunta + SQL generado
+    temas_pregunta: frozenset
+    temas_completos: frozenset
+
+
+@lru_cache(maxsize=4096)
+def indexar_interaccion(pregunta: str, sql: str) -> IndiceInteraccion:
+    """Slots y temas de una interacción; se calcula una vez por (pregunta, sql)"""
+    texto_pregunta = normalizar_slots(pregunta)
+    texto_completo = texto_pregunta + "\n" + normalizar_slots(sql or "")
+    return IndiceInteraccion(
+        slots_pregunta=extraer_slots(pregunta),
+        slots_completos=extraer_slots(pregunta + "\n" + (sql or "")),
+        temas_pregunta=frozenset(t for t in TEMAS if t in texto_pregunta),
+        temas_completos=frozenset(t for t in TEMAS if t in texto_completo)
+    )
+
+
+def variables_expansion(pregunta: str, sesion: dict, historial: list) -> dict:
+    """Variables disponibles para las plantillas (sesión actual + historial indexado)"""
+    variables = {
+        'pregunta': pregunta,
+        'region': sesion.get('ultima_region'),
+        'comuna': sesion.get('ultima_comuna'),
+        'año': sesion.get('ultimo_año'),
+        'mes': sesion.get('ultimo_mes'),
+        'sexo': sesion.get('ultimo_sexo'),
+        'causa': sesion.get('ultima_causa'),
+        'historial': bool(historial)
+    }
+    if not historial:
+        return variables
+
+    anterior = indexar_interaccion(historial[-1]['pregunta'], historial[-1].get('sql'))
+    variables['año_anterior'] = anterior.slots_pregunta.get('año')
+    variables['mes_anterior'] = anterior.slots_pregunta.get('mes')
+    variables['mes_respuesta'] = anterior.slots_completos.get('mes')
+    variables['año_respuesta'] = anterior.slots_completos.get('año')
+    variables['region_respuesta'] = anterior.slots_completos.get('region')
+    for tema in anterior.temas_pregunta:
+        variables[f'anterior_{tema}'] = True
+    for tema in anterior.temas_completos:
+        variables[f'respuesta_{tema}'] = True
+
+    for item in reversed(historial[-3:]):
+        indice = indexar_interaccion(item['pregunta'], item.get('sql'))
+        if 'mes' in indice.slots_completos:
+            variables['mes_reciente'] = indice.slots_completos['mes']
+            variables['año_reciente'] = indice.slots_completos.get('año')
+            break
+    return variables
+
+
+# === PLANTILLAS ===
+
+_SEGMENTO = re.compile(r"\[([^\[\]]*)\]|\{([^{}]+)\}")
+_CAMPO = re.compile(r"\{([^{}]+)\}")
+
+
+def _resolver(expresion: str, variables: dict) -> Optional[str]:
+    for alternativa in expresion.split('|'):
+        alternativa = alternativa.strip()
+        if len(alternativa) >= 2 and alternativa[0] == alternativa[-1] == "'":
+            return alternativa[1:-1]
+        valor = variables.get(alternativa)
+        if valor:
+            return str(valor)
+    return None
+
+
+def renderizar(plantilla: str, variables: dict) -> Optional[str]:
+    """Aplicar la plantilla; None si falta una variable obligatoria (una sola pasada: los valores no se reinterpretan)"""
+    falta = False
+
+    def opcional(interior: str) -> str:
+        valores = [_resolver(m.group(1), variables) for m in _CAMPO.finditer(interior)]
+        if any(v is None for v in valores):
+            return ""
+        partes = iter(valores)
+        return _CAMPO.sub(lambda _: next(partes), interior)
+
+    def segmento(m) -> str:
+        nonlocal falta
+        if m.group(1) is not None:
+            return opcional(m.group(1))
+        valor = _resolver(m.group(2), variables)
+        if valor is None:
+            falta = True
+            return ""
+        return valor
+
+    texto = _SEGMENTO.sub(segmento, plantilla)
+    return None if falta else texto
+
+
+# === MOTOR ===
+
+class MotorExpansion:
+    """Evalúa las reglas en orden de prioridad sobre las frases detectadas en una sola pasada"""
+
+    def __init__(self, reglas=REGLAS_EXPANSION):
+        # sorted es estable: a igual prioridad se respeta el orden de definición
+        self.reglas = sorted(reglas, key=lambda r: -r.prioridad)
+        self._grupos = [
+            [frozenset(f.lower() for f in grupo) for grupo in regla.frases]
+            for regla in self.reglas
+        ]
+        self._automata = AutomataTerminos({f for grupos in self._grupos for grupo in grupos for f in grupo})
+        # Si toda regla exige alguna frase, una pregunta sin frases conocidas no se expande
+        self._siempre_frases = all(self._grupos)
+        self._lock = threading.Lock()
+        self.evaluadas = 0
+        self.sin_regla = 0
+        self.aciertos = {regla.nombre: 0 for regla in self.reglas}
+
+    def expandir(self, pregunta: str, sesion: dict, historial: list, contar: bool = True) -> tuple:
+        """(pregunta expandida, nombre de la regla aplicada o None); contar=False para simulaciones"""
+        presentes = self._automata.buscar_todos(pregunta)
+        resultado = (pregunta, None)
+        if presentes or not self._siempre_frases:
+            variables = None
+            for regla, grupos in zip(self.reglas, self._grupos):
+                if not all(grupo & presentes for grupo in grupos):
+                    continue
+                if variables is None:
+                    variables = variables_expansion(pregunta, sesion, historial)
+                if not all(variables.get(v) for v in regla.requiere) or any(variables.get(v) for v in regla.excluye):
+                    continue
+                texto = renderizar(regla.plantilla, variables)
+                if texto is not None:
+                    resultado = (texto, regla.nombre)
+                    break
+
+        if not contar:
+            return resultado
+        with self._lock:
+            self.evaluadas += 1
+            if resultado[1] is None:
+                self.sin_regla += 1
+            else:
+                self.aciertos[resultado[1]] += 1
+        return resultado
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {
+                "reglas": len(self.reglas),
+                "evaluadas": self.evaluadas,
+                "sin_regla": self.sin_regla,
+                "aciertos": {nombre: n for nombre, n in self.aciertos.items() if n}
+            }
+
+
+def cargar_reglas(ruta: str) -> list:
+    """Reglas adicionales desde un archivo JSON (lista de objetos con los campos de ReglaExpansion)"""
+    with open(ruta, encoding="utf-8") as archivo:
+        datos = json.load(archivo)
+    return [
+        ReglaExpansion(
+            nombre=r['nombre'],
+            prioridad=int(r['prioridad']),
+            plantilla=r['plantilla'],
+            frases=tuple(tuple(grupo) for grupo in r.get('frases', ())),
+            requiere=tuple(r.get('requiere', ())),
+            excluye=tuple(r.get('excluye', ()))
+        )
+        for r in datos
+    ]
+
+
+# Motor activo; se reemplaza al configurar reglas adicionales
+_motor = MotorExpansion()
+
+
+def configurar_reglas(adicionales=()) -> MotorExpansion:
+    """Recompilar el motor con las reglas por defecto más las adicionales (una regla adicional reemplaza a la del mismo nombre)"""
+    global _motor
+    por_nombre = {regla.nombre: regla for regla in REGLAS_EXPANSION}
+    por_nombre.update({regla.nombre: regla for regla in adicionales})
+    _motor = MotorExpansion(list(por_nombre.values()))
+    return _motor
+
+
+def motor_activo() -> MotorExpansion:
+    return _motor
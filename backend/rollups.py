@@ -0,0 +1,380 @@
+import re
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Optional
+
+# Cubos pre-agregados (vistas materializadas creadas por database.crear_rollups)
+CUBO_REGION = "mv_cubo_region"
+CUBO_COMUNA = "mv_cubo_comuna"
+CUBOS = (CUBO_REGION, CUBO_COMUNA)
+
+# Columna -> tabla de origen
+TABLA_COLUMNA = {
+    'ANIO': 'defunciones_principales',
+    'FECHA_DEF': 'defunciones_principales',
+    'SEXO_NOMBRE': 'defunciones_principales',
+    'DIAG1': 'defunciones_principales',
+    'LUGAR_DEFUNCION': 'defunciones_principales',
+    'NOMBRE_REGION': 'ubicaciones',
+    'COMUNA': 'ubicaciones',
+    'capitulo': 'diagnosticos',
+    'descripcion_capitulo': 'diagnosticos',
+}
+
+# Dimensión -> (expresión en el cubo, cubos que la contienen).
+# DIAG1 y LUGAR_DEFUNCION no están en ningún cubo: solo las resuelve motor_columnar.
+DIMENSIONES = {
+    'ANIO': ('"ANIO"', CUBOS),
+    'MES': ('"MES"', CUBOS),
+    'SEXO_NOMBRE': ('"SEXO_NOMBRE"', CUBOS),
+    'NOMBRE_REGION': ('"NOMBRE_REGION"', CUBOS),
+    'COMUNA': ('"COMUNA"', (CUBO_COMUNA,)),
+    'capitulo': ('capitulo', (CUBO_REGION,)),
+    'descripcion_capitulo': ('descripcion_capitulo', (CUBO_REGION,)),
+    'LETRA_DIAG1': ('"LETRA_DIAG1"', (CUBO_REGION,)),
+    'DIAG1': ('"DIAG1"', ()),
+    'LUGAR_DEFUNCION': ('"LUGAR_DEFUNCION"', ()),
+}
+
+# Condición de JOIN esperada para cada tabla
+JOINS_VALIDOS = {
+    'ubicaciones': ('COD_COMUNA', 'COD_COMUNA'),
+    'diagnosticos': ('DIAG1', 'codigo_diagnostico'),
+}
+
+_REF = r'(?:\w+\.)?(?:"[^"]+"|\w+)'
+_LITERAL = r"(?:-?\d+|'(?:[^']|'')*')"
+
+_PATRON_CONSULTA = re.compile(
+    r"^SELECT (?P<select>.+?) FROM defunciones_principales"
+    r"(?: (?!(?:JOIN|INNER|LEFT|RIGHT|WHERE|GROUP|ORDER|LIMIT)\b)(?:AS )?(?P<alias>\w+))?"
+    r"(?P<joins>(?: (?:INNER )?JOIN \w+(?: (?!ON\b)(?:AS )?\w+)? ON " + _REF + r" ?= ?" + _REF + r")*)"
+    r"(?: WHERE (?P<where>.+?))?"
+    r"(?: GROUP BY (?P<group>.+?))?"
+    r"(?: ORDER BY (?P<order>.+?))?"
+    r"(?: LIMIT (?P<limit>\d+))?$",
+    re.IGNORECASE
+)
+_PATRON_JOIN = re.compile(
+    r"(?:INNER )?JOIN (\w+)(?: (?!ON\b)(?:AS )?(\w+))? ON (" + _REF + r") ?= ?(" + _REF + r")",
+    re.IGNORECASE
+)
+_PATRON_MES = re.compile(
+    r"^(?:EXTRACT\( ?MONTH FROM (" + _REF + r") ?\)|DATE_PART\( ?'month' ?, ?(" + _REF + r") ?\))$",
+    re.IGNORECASE
+)
+_PATRON_CONTEO = re.compile(r"^COUNT\( ?(?:\*|1) ?\)$", re.IGNORECASE)
+_PATRON_ALIAS = re.compile(r"^(.+?)(?: AS)? (\"[^\"]+\"|\w+)$", re.IGNORECASE)
+_PATRON_CONDICION = re.compile(
+    r"^(?P<izq>.+?) ?(?:(?P<op><>|!=|>=|<=|=|<|>) ?(?P<lit>" + _LITERAL + r")"
+    r"|(?P<in> IN ?\((?P<lista>" + _LITERAL + r"(?: ?, ?" + _LITERAL + r")*)\))"
+    r"|(?P<between> BETWEEN (?P<desde>" + _LITERAL + r") AND (?P<hasta>" + _LITERAL + r"))"
+    r"|(?P<like> LIKE '(?P<letra>[A-Z])%'))$",
+    re.IGNORECASE
+)
+_PALABRAS_RESERVADAS = re.compile(r"\b(DISTINCT|HAVING|OR|NOT|UNION|OVER|CASE|SELECT)\b", re.IGNORECASE)
+
+
+@dataclass
+class ConsultaAgregada:
+    """Consulta de conteo agrupado sobre defunciones_principales, en términos de dimensiones del cubo"""
+    columnas: list                      # [(tipo, dimensión o None, alias de salida)]
+    filtros: list                       # [(dimensión, operador, valores)]
+    agrupacion: list                    # [dimensión]
+    orden: list                         # [(referencia de salida, 'ASC'|'DESC')]
+    limite: Optional[int]
+    tablas: set = field(default_factory=set)
+
+    @property
+    def dimensiones(self) -> set:
+        usadas = {c[1] for c in self.columnas if c[0] == 'dimension'}
+        usadas.update(f[0] for f in self.filtros)
+        usadas.update(self.agrupacion)
+        return usadas
+
+
+def _dividir(texto: str, separador: str = ",") -> list:
+    """Dividir por separador ignorando los que están dentro de paréntesis o comillas"""
+    partes, actual, nivel, comillas = [], "", 0, None
+    for c in texto:
+        if comillas:
+            if c == comillas:
+                comillas = None
+        elif c in "'\"":
+            comillas = c
+        elif c == "(":
+            nivel += 1
+        elif c == ")":
+            nivel -= 1
+        elif c == separador and nivel == 0:
+            partes.append(actual.strip())
+            actual = ""
+            continue
+        actual += c
+    partes.append(actual.strip())
+    return partes
+
+
+def _dividir_and(texto: str) -> list:
+    """Dividir condiciones por AND de nivel superior (respetando BETWEEN x AND y)"""
+    partes = []
+    tokens = re.split(r"( AND )", texto, flags=re.IGNORECASE)
+    actual = tokens[0]
+    for i in range(1, len(tokens), 2):
+        if re.search(r" BETWEEN " + _LITERAL + r"$", actual, re.IGNORECASE):
+            actual += tokens[i] + tokens[i + 1]
+        else:
+            partes.append(actual.strip())
+            actual = tokens[i + 1]
+    partes.append(actual.strip())
+    return partes
+
+
+class _Resolutor:
+    """Resolver referencias de columnas según los alias de la consulta"""
+
+    def __init__(self, alias_tabla: dict):
+        # alias -> tabla
+        self.alias_tabla = alias_tabla
+
+    def columna(self, ref: str) -> Optional[str]:
+        m = re.match(r'^(?:(\w+)\.)?(?:"([^"]+)"|(\w+))$', ref.strip())
+        if not m:
+            return None
+        alias, citada, simple = m.groups()
+        nombre = citada if citada is not None else simple.lower()
+        tabla = TABLA_COLUMNA.get(nombre)
+        if tabla is None or tabla not in self.alias_tabla.values():
+            return None
+        if alias is not None and self.alias_tabla.get(alias) != tabla:
+            return None
+        return nombre
+
+    def dimension(self, expr: str) -> Optional[str]:
+        """Expresión -> dimensión del cubo (None si no corresponde)"""
+        expr = expr.strip()
+        m = _PATRON_MES.match(expr)
+        if m:
+            ref = m.group(1) or m.group(2)
+            return 'MES' if self.columna(ref) == 'FECHA_DEF' else None
+        nombre = self.columna(expr)
+        return nombre if nombre in DIMENSIONES else None
+
+
+def _identificador(alias: str) -> str:
+    """Alias de salida como identificador citado (los alias sin comillas se pasan a minúsculas)"""
+    if alias.startswith('"'):
+        return alias
+    return '"' + alias.lower() + '"'
+
+
+def _nombre_salida(expr: str, dimension: Optional[str]) -> str:
+    """Nombre de columna que PostgreSQL asigna a una expresión sin alias"""
+    if _PATRON_CONTEO.match(expr):
+        return "count"
+    if dimension == 'MES':
+        return "date_part" if expr.upper().startswith("DATE_PART") else "extract"
+    return dimension
+
+
+def analizar_consulta(sql: str) -> Optional[ConsultaAgregada]:
+    """Analizar SQL generado; retorna None si no es un conteo agrupado reescribible"""
+    sql = " ".join(sql.split()).rstrip(";").strip()
+    if _PALABRAS_RESERVADAS.search(re.sub(r"^SELECT ", "", sql, flags=re.IGNORECASE)):
+        return None
+
+    m = _PATRON_CONSULTA.match(sql)
+    if not m:
+        return None
+
+    alias_tabla = {m.group('alias') or 'defunciones_principales': 'defunciones_principales'}
+    joins = []
+    for j in _PATRON_JOIN.finditer(m.group('joins') or ""):
+        tabla, alias, izq, der = j.group(1).lower(), j.group(2), j.group(3), j.group(4)
+        if tabla not in JOINS_VALIDOS or tabla in alias_tabla.values():
+            return None
+        alias_tabla[alias or tabla] = tabla
+        joins.append((tabla, izq, der))
+
+    resolutor = _Resolutor(alias_tabla)
+
+    # Validar que cada JOIN use la llave esperada
+    for tabla, izq, der in joins:
+        col_d, col_t = JOINS_VALIDOS[tabla]
+        lado_izq = re.sub(r'^\w+\.', '', izq).strip('"')
+        lado_der = re.sub(r'^\w+\.', '', der).strip('"')
+        if {lado_izq, lado_der} != {col_d, col_t}:
+            return None
+        referencia_d = izq if lado_izq == col_d else der
+        referencia_t = der if lado_izq == col_d else izq
+        if '.' in referencia_d and alias_tabla.get(referencia_d.split('.')[0]) != 'defunciones_principales':
+            return None
+        if '.' in referencia_t and alias_tabla.get(referencia_t.split('.')[0]) != tabla:
+            return None
+
+    # SELECT: dimensiones y COUNT(*)
+    columnas = []
+    for item in _dividir(m.group('select')):
+        expr, alias = item, None
+        ma = _PATRON_ALIAS.match(item)
+        if ma and not _PATRON_CONTEO.match(item) and not _PATRON_MES.match(item) and resolutor.dimension(item) is None:
+            expr, alias = ma.group(1), ma.group(2)
+        if _PATRON_CONTEO.match(expr.strip()):
+            columnas.append(('conteo', None, _identificador(alias or _nombre_salida(expr.strip(), None))))
+            continue
+        dimension = resolutor.dimension(expr)
+        if dimension is None:
+            return None
+        salida = _identificador(alias) if alias else '"' + _nombre_salida(expr.strip(), dimension) + '"'
+        columnas.append(('dimension', dimension, salida))
+    if not any(c[0] == 'conteo' for c in columnas):
+        return None
+
+    # WHERE: conjunción de condiciones simples
+    filtros = []
+    if m.group('where'):
+        for condicion in _dividir_and(m.group('where')):
+            condicion = condicion.strip()
+            if condicion.startswith("(") and condicion.endswith(")"):
+                condicion = condicion[1:-1].strip()
+            mc = _PATRON_CONDICION.match(condicion)
+            if not mc:
+                return None
+            if mc.group('like'):
+                if resolutor.columna(mc.group('izq')) != 'DIAG1':
+                    return None
+                filtros.append(('LETRA_DIAG1', '=', [f"'{mc.group('letra')}'"]))
+                continue
+            dimension = resolutor.dimension(mc.group('izq'))
+            if dimension is None or dimension == 'LETRA_DIAG1':
+                return None
+            if mc.group('op'):
+                filtros.append((dimension, mc.group('op'), [mc.group('lit')]))
+            elif mc.group('in'):
+                filtros.append((dimension, 'IN', _dividir(mc.group('lista'))))
+            else:
+                filtros.append((dimension, 'BETWEEN', [mc.group('desde'), mc.group('hasta')]))
+
+    alias_salida = {c[2]: c for c in columnas}
+
+    def referencia_salida(expr: str):
+        """GROUP BY / ORDER BY pueden usar posición, alias de salida o la expresión"""
+        expr = expr.strip()
+        if expr.isdigit():
+            indice = int(expr) - 1
+            return columnas[indice] if 0 <= indice < len(columnas) else None
+        if _identificador(expr) in alias_salida and not resolutor.dimension(expr):
+            return alias_salida[_identificador(expr)]
+        if _PATRON_CONTEO.match(expr):
+            return next((c for c in columnas if c[0] == 'conteo'), None)
+        dimension = resolutor.dimension(expr)
+        if dimension is None:
+            return None
+        return next((c for c in columnas if c[1] == dimension), ('dimension', dimension, None))
+
+    agrupacion = []
+    if m.group('group'):
+        for item in _dividir(m.group('group')):
+            columna = referencia_salida(item)
+            if columna is None or columna[0] != 'dimension':
+                return None
+            agrupacion.append(columna[1])
+    # Todas las dimensiones seleccionadas deben estar agrupadas
+    if {c[1] for c in columnas if c[0] == 'dimension'} - set(agrupacion):
+        return None
+
+    orden = []
+    if m.group('order'):
+        for item in _dividir(m.group('order')):
+            mo = re.match(r"^(.+?)(?: (ASC|DESC))?$", item.strip(), re.IGNORECASE)
+            columna = referencia_salida(mo.group(1))
+            if columna is None:
+                return None
+            orden.append((columna, (mo.group(2) or 'ASC').upper()))
+
+    return ConsultaAgregada(
+        columnas=columnas,
+        filtros=filtros,
+        agrupacion=agrupacion,
+        orden=orden,
+        limite=int(m.group('limit')) if m.group('limit') else None,
+        tablas=set(alias_tabla.values())
+    )
+
+
+def elegir_cubo(consulta: ConsultaAgregada, disponibles) -> Optional[str]:
+    """Cubo más pequeño que contiene todas las dimensiones usadas"""
+    for cubo in (CUBO_REGION, CUBO_COMUNA):
+        if cubo in disponibles and all(cubo in DIMENSIONES[d][1] for d in consulta.dimensiones):
+            return cubo
+    return None
+
+
+def reescribir_con_rollup(sql: str, disponibles) -> Optional[str]:
+    """Reescribir el SQL para leer del cubo pre-agregado; None si no es elegible"""
+    consulta = analizar_consulta(sql)
+    if consulta is None:
+        return None
+    cubo = elegir_cubo(consulta, disponibles)
+    if cubo is None:
+        return None
+
+    agrupada = bool(consulta.agrupacion)
+    suma = "SUM(total)::bigint" if agrupada else "COALESCE(SUM(total), 0)::bigint"
+
+    select = []
+    for tipo, dimension, alias in consulta.columnas:
+        expresion = suma if tipo == 'conteo' else DIMENSIONES[dimension][0]
+        select.append(f"{expresion} AS {alias}")
+
+    # Los JOIN internos descartan filas sin ubicación/diagnóstico; el cubo las marca
+    condiciones = []
+    if 'ubicaciones' in consulta.tablas:
+        condiciones.append("con_ubicacion")
+    if 'diagnosticos' in consulta.tablas:
+        condiciones.append("con_diagnostico")
+    for dimension, operador, valores in consulta.filtros:
+        expresion = DIMENSIONES[dimension][0]
+        if operador == 'IN':
+            condiciones.append(f"{expresion} IN ({', '.join(valores)})")
+        elif operador == 'BETWEEN':
+            condiciones.append(f"{expresion} BETWEEN {valores[0]} AND {valores[1]}")
+        else:
+            condiciones.append(f"{expresion} {operador} {valores[0]}")
+
+    partes = [f"SELECT {', '.join(select)} FROM {cubo}"]
+    if condiciones:
+        partes.append("WHERE " + " AND ".join(condiciones))
+    if agrupada:
+        partes.append("GROUP BY " + ", ".join(DIMENSIONES[d][0] for d in consulta.agrupacion))
+    if consulta.orden:
+        items = []
+        for (tipo, dimension, alias), direccion in consulta.orden:
+            if tipo == 'conteo':
+                items.append(f"{suma} {direccion}")
+            else:
+                items.append(f"{DIMENSIONES[dimension][0]} {direccion}")
+        partes.append("ORDER BY " + ", ".join(items))
+    if consulta.limite is not None:
+        partes.append(f"LIMIT {consulta.limite}")
+    return " ".join(partes)
+
+
+def _normalizar_fila(fila: dict) -> tuple:
+    """EXTRACT retorna numeric/double y el cubo int: comparar valores numéricos como float"""
+    return tuple(
+        (columna, float(valor) if isinstance(valor, (int, float, Decimal)) and not isinstance(valor, bool) else valor)
+        for columna, valor in fila.items()
+    )
+
+
+def resultados_equivalentes(original, reescrito, ordenado: bool) -> bool:
+    """Comparar resultados de la consulta original y la reescrita (verificación)"""
+    if not isinstance(original, list) or not isinstance(reescrito, list):
+        return original == reescrito
+    filas_a = [_normalizar_fila(f) for f in original]
+    filas_b = [_normalizar_fila(f) for f in reescrito]
+    if not ordenado:
+        filas_a = sorted(filas_a, key=repr)
+        filas_b = sorted(filas_b, key=repr)
+    return filas_a == filas_b
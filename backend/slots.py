@@ -0,0 +1,250 @@
+import re
+import unicodedata
+from typing import Iterable
+
+# Vocabularios usados para detectar contexto (slots) en las preguntas
+
+REGIONES_MAP = {
+    'santiago': 'Metropolitana de Santiago',
+    'metropolitana': 'Metropolitana de Santiago',
+    'valparaíso': 'De Valparaíso',
+    'valpo': 'De Valparaíso',
+    'biobío': 'Del Biobío',
+    'bio bio': 'Del Biobío',
+    'araucanía': 'De La Araucanía',
+    'temuco': 'De La Araucanía',
+    'antofagasta': 'De Antofagasta',
+    'coquimbo': 'De Coquimbo',
+    'tarapacá': 'De Tarapacá',
+    'atacama': 'De Atacama',
+    'ohiggins': 'Del Libertador B. O\'Higgins',
+    'maule': 'Del Maule',
+    'los ríos': 'De Los Ríos',
+    'los lagos': 'De Los Lagos',
+    'aysén': 'De Aysén',
+    'magallanes': 'De Magallanes'
+}
+
+AÑOS = ['2023', '2024', '2025']
+
+MESES_MAP = {
+    'enero': '01', 'febrero': '02', 'marzo': '03', 'abril': '04',
+    'mayo': '05', 'junio': '06', 'julio': '07', 'agosto': '08',
+    'septiembre': '09', 'octubre': '10', 'noviembre': '11', 'diciembre': '12'
+}
+
+# Sinónimos de sexo y de grupo de causas (en orden de prioridad si aparecen varios)
+SEXOS_MAP = {
+    'hombre': 'Hombre', 'masculino': 'Hombre',
+    'mujer': 'Mujer', 'femenino': 'Mujer'
+}
+
+CAUSAS_MAP = {
+    'cáncer': 'cáncer', 'tumor': 'cáncer',
+    'cardiovascular': 'cardiovascular', 'corazón': 'cardiovascular',
+    'respiratorio': 'respiratorio', 'pulmón': 'respiratorio',
+    'diabetes': 'diabetes'
+}
+
+# Filtro SQL por grupo de causas (mismos patrones que el prompt)
+CAUSAS_SQL = {
+    'cáncer': "d.\"DIAG1\" LIKE 'C%'",
+    'cardiovascular': "d.\"DIAG1\" LIKE 'I%'",
+    'respiratorio': "d.\"DIAG1\" LIKE 'J%'",
+    'diabetes': "SUBSTRING(d.\"DIAG1\", 1, 3) BETWEEN 'E10' AND 'E14'"
+}
+
+# Comunas con nombre de palabra común ("la primavera", "la independencia", "pica el pecho"): solo son
+# comuna con contexto, "comuna de X" o "en X" con mayúscula en la pregunta original
+COMUNAS_AMBIGUAS = frozenset((
+    'independencia', 'victoria', 'navidad', 'constitucion', 'primavera', 'pica', 'porvenir', 'canela',
+    'laja', 'paredones', 'cabildo', 'empedrado', 'algarrobo', 'la estrella', 'la union', 'la granja',
+    'el bosque', 'la florida'
+))
+
+_CONTEXTO_COMUNA = re.compile(r'\bcomuna(?:\s+de)?\s+$')
+_CONTEXTO_EN = re.compile(r'\ben\s+$')
+
+# Cada letra base acepta sus variantes con tilde: el patrón se aplica a la pregunta
+# solo en minúsculas, sin normalizarla (normalizar costaba más que la búsqueda misma)
+_VARIANTES = {'a': '[aáàâ]', 'e': '[eéèê]', 'i': '[iíìî]', 'o': '[oóòô]', 'u': '[uúùûü]', 'n': '[nñ]'}
+
+_APOSTROFES = ("'", "’")
+
+
+def normalizar_slots(texto: str) -> str:
+    """Minúsculas y sin tildes ni apóstrofes (forma de las claves del vocabulario)"""
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    return "".join(c for c in texto if not unicodedata.combining(c) and c not in _APOSTROFES)
+
+
+def _sin_apostrofes(texto: str) -> str:
+    """Texto sin apóstrofes ("O'Higgins" -> "OHiggins"); en minúsculas es el que reciben los patrones"""
+    for apostrofe in _APOSTROFES:
+        if apostrofe in texto:
+            texto = texto.replace(apostrofe, "")
+    return texto
+
+
+def es_comuna_ambigua(comuna: str) -> bool:
+    """La comuna tiene nombre de palabra común (ver COMUNAS_AMBIGUAS)"""
+    return " ".join(normalizar_slots(comuna or "").split()) in COMUNAS_AMBIGUAS
+
+
+def patron_sin_tildes(termino: str) -> str:
+    """Regex para un término normalizado que también acepta sus letras con tilde"""
+    return "".join(_VARIANTES.get(c) or re.escape(c) for c in termino)
+
+
+def _regex_trie(nodo: dict) -> str:
+    """Alternativa factorizada por prefijos: en cada posición solo se prueban las ramas de ese carácter"""
+    ramas = [patron_sin_tildes(c) + _regex_trie(hijo) for c, hijo in sorted(nodo.items()) if c != '']
+    # Fin de término al final: las ramas más largas se prueban primero
+    if '' in nodo:
+        ramas.append(nodo[''])
+    if len(ramas) == 1:
+        return ramas[0]
+    return '(?:' + '|'.join(ramas) + ')'
+
+
+# Fin de término: palabra completa, o con su plural ("hombres", "tumores") sin incluirlo en la coincidencia
+FIN_PALABRA = r'(?!\w)'
+FIN_PALABRA_O_PLURAL = r'(?=(?:e?s)?(?!\w))'
+_PLURAL = re.compile(r'e?s(?!\w)')
+
+
+def patron_trie(terminos: Iterable[str], finales=None) -> str:
+    """Regex (sin anclas) que reconoce cualquiera de los términos normalizados, prefiriendo el más largo;
+    `finales` asigna a cada término lo que debe seguirlo (por defecto nada: calza como subcadena)"""
+    finales = finales or {}
+    trie = {}
+    for termino in terminos:
+        nodo = trie
+        for c in termino:
+            nodo = nodo.setdefault(c, {})
+        nodo[''] = finales.get(termino, '')
+    return _regex_trie(trie)
+
+
+class ExtractorSlots:
+    """
+    Todos los vocabularios (regiones, comunas, años, meses, sexo y causas) compilados en una
+    sola expresión regular sobre el texto normalizado: los slots se extraen en una pasada
+    """
+
+    def __init__(self, comunas: Iterable[str] = ()):
+        # término normalizado -> [(slot, valor, prioridad)]; con varios del mismo slot gana la menor prioridad
+        self._entradas = {}
+        vocabularios = [
+            ('region', REGIONES_MAP),
+            ('año', {año: año for año in AÑOS}),
+            ('mes', {mes: mes for mes in MESES_MAP}),
+            ('sexo', SEXOS_MAP),
+            ('causa', CAUSAS_MAP),
+        ]
+        for slot, mapa in vocabularios:
+            for prioridad, (termino, valor) in enumerate(mapa.items()):
+                self._entradas.setdefault(normalizar_slots(termino), []).append((slot, valor, prioridad))
+
+        # Todo término calza como palabra completa ("mayo" no está en "mayor"); el vocabulario admite
+        # además su plural y las comunas deben calzar exactas ("pica" no está en "típica").
+        # Si el nombre de una comuna ya es una clave de región ("santiago", "maule") se mantiene como región
+        finales = dict.fromkeys(self._entradas, FIN_PALABRA_O_PLURAL)
+        self.comunas = 0
+        self._ambiguas = set()
+        for comuna in comunas:
+            termino = " ".join(normalizar_slots(comuna or "").split())
+            if not termino or termino in self._entradas:
+                continue
+            self._entradas[termino] = [('comuna', comuna, 0)]
+            finales[termino] = FIN_PALABRA
+            self.comunas += 1
+            if termino in COMUNAS_AMBIGUAS:
+                self._ambiguas.add(termino)
+
+        self._patron = re.compile(r'\b' + patron_trie(self._entradas, finales))
+        # Coincidencias con tilde -> entradas (se normalizan una sola vez)
+        self._variantes = {}
+
+    def extraer(self, pregunta: str) -> dict:
+        """Slots encontrados en la pregunta (mismo formato que extraer_slots)"""
+        encontrados = {}
+        original = _sin_apostrofes(pregunta)
+        texto = original.lower()
+        for posicion, m in enumerate(self._coincidencias(texto, original)):
+            for slot, valor, prioridad in self._entradas.get(m.group(0)) or self._variante(m.group(0)):
+                # Comunas: gana la primera mencionada
+                orden = posicion if slot == 'comuna' else prioridad
+                if slot not in encontrados or orden < encontrados[slot][1]:
+                    encontrados[slot] = (valor, orden)
+
+        slots = {slot: valor for slot, (valor, _) in encontrados.items()}
+        if 'mes' in slots:
+            slots['mes_num'] = MESES_MAP[slots['mes']]
+        return slots
+
+    def separar(self, pregunta: str) -> tuple:
+        """
+        Pregunta en minúsculas sin los términos del vocabulario (ni su plural) y todos los valores
+        mencionados por slot, no solo el que gana: {'region': {'De Valparaíso', 'Del Maule'}, ...}
+        """
+        original = _sin_apostrofes(pregunta)
+        texto = original.lower()
+        partes = []
+        valores = {}
+        inicio = 0
+        for m in self._coincidencias(texto, original):
+            for slot, valor, _ in self._entradas.get(m.group(0)) or self._variante(m.group(0)):
+                valores.setdefault(slot, set()).add(valor)
+            plural = _PLURAL.match(texto, m.end())
+            partes.append(texto[inicio:m.start()])
+            inicio = plural.end() if plural else m.end()
+        partes.append(texto[inicio:])
+        return " ".join(partes), valores
+
+    def _coincidencias(self, texto: str, original: str):
+        """Coincidencias del patrón, sin las comunas ambiguas mencionadas sin contexto"""
+        for m in self._patron.finditer(texto):
+            if self._ambiguas and " ".join(normalizar_slots(m.group(0)).split()) in self._ambiguas:
+                antes = texto[max(0, m.start() - 12):m.start()]
+                # lower() puede cambiar el largo (raro); entonces no se sabe si había mayúscula
+                mayuscula = len(original) == len(texto) and original[m.start()].isupper()
+                if not (_CONTEXTO_COMUNA.search(antes) or (mayuscula and _CONTEXTO_EN.search(antes))):
+                    continue
+            yield m
+
+    def _variante(self, texto: str) -> list:
+        entradas = self._variantes.get(texto)
+        if entradas is None:
+            entradas = self._entradas.get(" ".join(normalizar_slots(texto).split()), [])
+            if len(self._variantes) < 10000:
+                self._variantes[texto] = entradas
+        return entradas
+
+    def estadisticas(self) -> dict:
+        return {"terminos": len(self._entradas), "comunas": self.comunas}
+
+
+# Extractor activo; se reemplaza (sin lock, asignación atómica) al cargar las comunas
+_extractor = ExtractorSlots()
+
+
+def configurar_comunas(comunas: Iterable[str]) -> ExtractorSlots:
+    """Recompilar el extractor incluyendo las comunas (ubicaciones."COMUNA")"""
+    global _extractor
+    _extractor = ExtractorSlots(comunas)
+    return _extractor
+
+
+def extractor_activo() -> ExtractorSlots:
+    return _extractor
+
+
+def extraer_slots(pregunta: str) -> dict:
+    """Extraer región, comuna, año, mes, sexo y causa mencionados en la pregunta (solo los encontrados)"""
+    return _extractor.extraer(pregunta)
+
+
+def separar_slots(pregunta: str) -> tuple:
+    """Pregunta sin los términos de los slots y todos los valores mencionados (ver ExtractorSlots.separar)"""
+    return _extractor.separar(pregunta)
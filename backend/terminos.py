@@ -0,0 +1,81 @@
+from collections import deque
+from typing import Optional
+
+
+class AutomataTerminos:
+    """
+    Autómata Aho-Corasick sobre los términos excluidos: detecta cualquiera de ellos
+    en una sola pasada por la pregunta, sin importar cuántos términos haya
+    """
+
+    def __init__(self, terminos):
+        # Mismo criterio que la búsqueda original: subcadena, sin distinguir mayúsculas
+        self.terminos = sorted({t.lower() for t in terminos if t})
+        self._transiciones = [{}]
+        self._fallo = [0]
+        self._salida = [None]
+        # Todos los términos que terminan en cada estado (propio + los de la cadena de fallos)
+        self._todas = [()]
+
+        for termino in self.terminos:
+            estado = 0
+            for c in termino:
+                siguiente = self._transiciones[estado].get(c)
+                if siguiente is None:
+                    siguiente = len(self._transiciones)
+                    self._transiciones[estado][c] = siguiente
+                    self._transiciones.append({})
+                    self._fallo.append(0)
+                    self._salida.append(None)
+                    self._todas.append(())
+                estado = siguiente
+            self._salida[estado] = termino
+            self._todas[estado] = (termino,)
+
+        # Enlaces de fallo por anchura; la salida hereda el término más corto reconocible por sufijo
+        cola = deque(self._transiciones[0].values())
+        while cola:
+            estado = cola.popleft()
+            for c, siguiente in self._transiciones[estado].items():
+                cola.append(siguiente)
+                fallo = self._fallo[estado]
+                while fallo and c not in self._transiciones[fallo]:
+                    fallo = self._fallo[fallo]
+                self._fallo[siguiente] = self._transiciones[fallo].get(c, 0)
+                if self._salida[siguiente] is None:
+                    self._salida[siguiente] = self._salida[self._fallo[siguiente]]
+                self._todas[siguiente] = self._todas[siguiente] + self._todas[self._fallo[siguiente]]
+
+    def buscar(self, texto: str) -> Optional[str]:
+        """Primer término excluido encontrado en el texto (None si no hay ninguno)"""
+        transiciones, fallo, salida = self._transiciones, self._fallo, self._salida
+        estado = 0
+        for c in texto.lower():
+            while estado and c not in transiciones[estado]:
+                estado = fallo[estado]
+            estado = transiciones[estado].get(c, 0)
+            if salida[estado] is not None:
+                return salida[estado]
+        return None
+
+    def buscar_todos(self, texto: str) -> set:
+        """Todos los términos presentes en el texto (incluidos los que se solapan)"""
+        transiciones, fallo, todas = self._transiciones, self._fallo, self._todas
+        encontrados = set()
+        estado = 0
+        for c in texto.lower():
+            while estado and c not in transiciones[estado]:
+                estado = fallo[estado]
+            estado = transiciones[estado].get(c, 0)
+            if todas[estado]:
+                encontrados.update(todas[estado])
+        return encontrados
+
+    def contiene(self, texto: str) -> bool:
+        return self.buscar(texto) is not None
+
+    def __len__(self):
+        return len(self.terminos)
+
+    def estadisticas(self) -> dict:
+        return {"terminos": len(self.terminos), "estados": len(self._transiciones)}
@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+# Los módulos del backend son planos (se importan como en main.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analizador_sql import AnalizadorSQL, esquema_desde_estructura  # noqa: E402
+
+# Mismas tablas que ESTRUCTURA_TABLA en main.py
+ESTRUCTURA = """
+1. defunciones_principales (id, "ANIO", "FECHA_DEF", "SEXO_NOMBRE", "EDAD_TIPO", "EDAD_CANT", "COD_COMUNA", "DIAG1", "DIAG2", "LUGAR_DEFUNCION")
+2. ubicaciones ("COD_COMUNA", "COMUNA", "NOMBRE_REGION")
+3. diagnosticos (codigo_diagnostico, capitulo, descripcion_capitulo, subcategoria, descripcion_subcategoria)
+"""
+
+
+@pytest.fixture
+def analizador():
+    return AnalizadorSQL(esquema_desde_estructura(ESTRUCTURA), limite_filas=1000)
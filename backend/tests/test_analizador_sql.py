@@ -0,0 +1,97 @@
+import pytest
+
+from analizador_sql import esquema_desde_estructura, extraer_sql
+from conftest import ESTRUCTURA
+
+POR_REGION = ('SELECT u."NOMBRE_REGION", COUNT(*) FROM defunciones_principales d '
+              'JOIN ubicaciones u ON d."COD_COMUNA" = u."COD_COMUNA" GROUP BY u."NOMBRE_REGION" ORDER BY COUNT(*) DESC')
+
+
+def test_esquema_desde_estructura():
+    esquema = esquema_desde_estructura(ESTRUCTURA)
+    assert set(esquema) == {'defunciones_principales', 'ubicaciones', 'diagnosticos'}
+    assert 'NOMBRE_REGION' in esquema['ubicaciones']
+
+
+# === EXTRACCIÓN ===
+
+def test_explicacion_en_la_linea_siguiente_se_descarta(analizador):
+    texto = "SELECT COUNT(*) FROM defunciones_principales\nEsta consulta cuenta todo"
+    assert extraer_sql(texto) == "SELECT COUNT(*) FROM defunciones_principales"
+    consulta = analizador.analizar(texto)
+    assert consulta.valida, consulta.error
+
+
+def test_consulta_en_varias_lineas_con_explicacion():
+    texto = ("SELECT\n  u.\"NOMBRE_REGION\",\n  COUNT(*) AS total\nFROM defunciones_principales d\n"
+             "JOIN ubicaciones u ON d.\"COD_COMUNA\" = u.\"COD_COMUNA\"\nGROUP BY u.\"NOMBRE_REGION\"\n"
+             "Agrupa las defunciones por región.")
+    sql = extraer_sql(texto)
+    assert sql.startswith("SELECT") and sql.endswith('GROUP BY u."NOMBRE_REGION"')
+
+
+def test_linea_incompleta_continua_aunque_no_empiece_con_palabra_clave():
+    assert extraer_sql("SELECT a FROM t WHERE\nx = 1\nNota: filtra") == "SELECT a FROM t WHERE\nx = 1"
+
+
+def test_parrafos_de_la_consulta_y_explicacion():
+    texto = "SELECT a,\nb\nFROM t\n\nWHERE x = (\nSELECT 1\n)\n\nLa consulta filtra"
+    assert extraer_sql(texto) == "SELECT a,\nb\nFROM t\nWHERE x = (\nSELECT 1\n)"
+
+
+def test_bloque_de_codigo():
+    texto = "Aquí está la consulta:\n```sql\nSELECT COUNT(*)\nFROM defunciones_principales\n```\nExplicación"
+    assert extraer_sql(texto) == "SELECT COUNT(*)\nFROM defunciones_principales"
+
+
+def test_sin_select():
+    assert extraer_sql("NO_SE_PUEDE_GENERAR") is None
+
+
+# === VALIDACIÓN ===
+
+@pytest.mark.parametrize("texto, motivo", [
+    ("NO_SE_PUEDE_GENERAR", 'sin_select'),
+    ("SELECT 1; DROP TABLE usuarios", 'sentencias'),
+    ("SELECT * FROM usuarios", 'tabla'),
+    ("SELECT pg_sleep(10) FROM defunciones_principales", 'funcion'),
+    ('SELECT "CLAVE" FROM defunciones_principales', 'columna'),
+    ("SELECT * FROM defunciones_principales FOR UPDATE", 'operacion'),
+    ("SELECT 'sin cerrar FROM defunciones_principales", 'sintaxis'),
+])
+def test_rechazos(analizador, texto, motivo):
+    consulta = analizador.analizar(texto)
+    assert not consulta.valida
+    assert consulta.motivo == motivo
+
+
+def test_texto_tras_punto_y_coma_se_tolera(analizador):
+    assert analizador.analizar("SELECT COUNT(*) FROM defunciones_principales; Esto cuenta todo").valida
+
+
+def test_tablas_y_alias(analizador):
+    consulta = analizador.analizar(POR_REGION)
+    assert consulta.valida, consulta.error
+    assert consulta.tablas == {'defunciones_principales', 'ubicaciones'}
+
+
+# === LIMIT Y FORMA CANÓNICA ===
+
+def test_limit_agregado_y_recortado(analizador):
+    sin_limite = analizador.analizar("SELECT * FROM defunciones_principales")
+    assert sin_limite.sql.endswith("LIMIT 1000") and sin_limite.limite_ajustado
+    grande = analizador.analizar("SELECT * FROM defunciones_principales LIMIT 50000")
+    assert grande.sql.endswith("LIMIT 1000") and grande.limite_ajustado
+    chico = analizador.analizar("SELECT * FROM defunciones_principales LIMIT 10")
+    assert chico.sql.endswith("LIMIT 10") and not chico.limite_ajustado
+
+
+def test_forma_canonica_unifica_variantes(analizador):
+    a = analizador.analizar('select count(*)  from   defunciones_principales d where d."ANIO" = 2024')
+    b = analizador.analizar('SELECT COUNT(*) FROM DEFUNCIONES_PRINCIPALES D\nWHERE d."ANIO"=2024')
+    assert a.sql == b.sql
+
+
+def test_forma_canonica_es_idempotente(analizador):
+    canonica = analizador.analizar(POR_REGION).sql
+    assert analizador.analizar(canonica).sql == canonica
@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+from coalescencia import Coalescedor
+
+
+def test_una_ejecucion_por_clave_y_copias_para_los_demas():
+    async def escenario():
+        coalescedor = Coalescedor("prueba")
+        llamadas = 0
+
+        async def fabrica():
+            nonlocal llamadas
+            llamadas += 1
+            await asyncio.sleep(0.01)
+            return [1, 2]
+
+        resultados = await asyncio.gather(*(coalescedor.ejecutar("k", fabrica, copiar=list) for _ in range(3)))
+        return coalescedor, llamadas, resultados
+
+    coalescedor, llamadas, resultados = asyncio.run(escenario())
+    assert llamadas == 1 and resultados == [[1, 2]] * 3
+    assert len({id(r) for r in resultados}) == 3
+    assert coalescedor.estadisticas()["coalescidas"] == 2
+    assert coalescedor.estadisticas()["en_vuelo"] == 0
+
+
+def test_cancelar_al_lider_no_cancela_a_los_demas():
+    async def escenario():
+        coalescedor = Coalescedor("prueba")
+
+        async def fabrica():
+            await asyncio.sleep(0.02)
+            return 42
+
+        lider = asyncio.ensure_future(coalescedor.ejecutar("k", fabrica))
+        await asyncio.sleep(0)
+        seguidor = asyncio.ensure_future(coalescedor.ejecutar("k", fabrica))
+        await asyncio.sleep(0)
+        lider.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await lider
+        return await seguidor
+
+    assert asyncio.run(escenario()) == 42
+
+
+def test_error_se_entrega_a_todos_y_libera_la_clave():
+    async def escenario():
+        coalescedor = Coalescedor("prueba")
+
+        async def fabrica():
+            await asyncio.sleep(0.01)
+            raise ValueError("falla")
+
+        resultados = await asyncio.gather(coalescedor.ejecutar("k", fabrica), coalescedor.ejecutar("k", fabrica),
+                                          return_exceptions=True)
+        return coalescedor, resultados
+
+    coalescedor, resultados = asyncio.run(escenario())
+    assert all(isinstance(r, ValueError) for r in resultados)
+    assert coalescedor.estadisticas()["en_vuelo"] == 0
@@ -0,0 +1,27 @@
+from contexto import ContextoConversacion
+
+SQL = 'SELECT diag.descripcion_capitulo, COUNT(*) AS total FROM defunciones_principales d ... LIMIT 10'
+
+
+def _contexto_con_filas(n: int, limite):
+    contexto = ContextoConversacion()
+    contexto.agregar_interaccion("principales causas de muerte", SQL)
+    filas = [{"descripcion_capitulo": f"Capítulo {i}", "total": 100 - i} for i in range(n)]
+    assert contexto.registrar_resultado(SQL, filas, max_filas=100, limite=limite)
+    return contexto
+
+
+def test_resultado_que_alcanza_el_limit_no_es_completo():
+    assert _contexto_con_filas(10, 10).resultado_anterior()['completo'] is False
+    assert _contexto_con_filas(7, 10).resultado_anterior()['completo'] is True
+    assert _contexto_con_filas(7, None).resultado_anterior()['completo'] is False
+
+
+def test_seguimiento_hereda_si_el_resultado_es_completo():
+    contexto = _contexto_con_filas(10, 10)
+    anterior = contexto.resultado_anterior()
+    contexto.agregar_interaccion("suma", anterior['sql'], anterior['resultado'], anterior['completo'])
+    assert contexto.resultado_anterior()['completo'] is False
+    contexto.agregar_interaccion("otra pregunta", "SELECT 1")
+    assert contexto.resultado_anterior() is None
+    assert all('completo' not in item for item in contexto.historial_sesion)
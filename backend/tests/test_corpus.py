@@ -0,0 +1,20 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+from replay_corpus import CORPUS, Reproductor, reporte, reproducir  # noqa: E402
+from slots import configurar_comunas  # noqa: E402
+
+
+def test_corpus_de_conversaciones():
+    # Mismo criterio que benchmarks/replay_corpus.py: cualquier diferencia con lo esperado es una regresión
+    with open(CORPUS, encoding="utf-8") as archivo:
+        corpus = json.load(archivo)
+    configurar_comunas(corpus.get("comunas", ()))
+    try:
+        resultados, latencias = reproducir(corpus, Reproductor(umbral=0.8), repeticiones=1)
+    finally:
+        configurar_comunas(())
+    assert reporte(resultados, latencias)["fallas"] == []
@@ -0,0 +1,85 @@
+from decimal import Decimal
+
+import pytest
+
+from formateador import clasificar_seguimiento, formatear_respuesta, responder_seguimiento
+
+POR_REGION = [
+    {"NOMBRE_REGION": "Metropolitana de Santiago", "total_defunciones": 15432},
+    {"NOMBRE_REGION": "De Valparaíso", "total_defunciones": 4210},
+    {"NOMBRE_REGION": "Del Biobío", "total_defunciones": 3876},
+]
+CONTEO = [{"total_defunciones": 4210}]
+POR_MES = [{"mes": Decimal(3), "total_defunciones": 1200}, {"mes": Decimal(7), "total_defunciones": 1500}]
+PROMEDIOS = [{"NOMBRE_REGION": "De Valparaíso", "edad_promedio": 75.5},
+             {"NOMBRE_REGION": "Del Biobío", "edad_promedio": 74.2}]
+
+
+@pytest.mark.parametrize("pregunta, operacion", [
+    ("cuántas son", "conteo"),
+    ("suma", "suma"),
+    ("cuál es la mayor", "maximo"),
+    ("cuál es la menor", "minimo"),
+    ("hola", None),
+    ("cuál es la mayor y cuál es la menor", None),
+    ("cuál es la mayor de todas las regiones del país considerando solo 2024", None),
+])
+def test_clasificar_seguimiento(pregunta, operacion):
+    assert clasificar_seguimiento(pregunta) == operacion
+
+
+def test_operaciones_sobre_lista_de_regiones():
+    assert responder_seguimiento(POR_REGION, "cuál es la mayor", completo=True) == \
+        ("maximo", "Metropolitana de Santiago (15,432 muertes)")
+    assert responder_seguimiento(POR_REGION, "cuál es la menor", completo=True) == ("minimo", "Del Biobío (3,876 muertes)")
+    assert responder_seguimiento(POR_REGION, "suma", completo=True) == ("suma", "En total, 23,518 muertes.")
+    assert responder_seguimiento(POR_REGION, "cuántas son", completo=True) == ("conteo", "Son 3.")
+
+
+def test_dimension_de_la_etiqueta_se_responde_localmente():
+    assert responder_seguimiento(POR_REGION, "qué región es la mayor", completo=True)[0] == "maximo"
+    assert responder_seguimiento(POR_MES, "qué mes es el mayor", completo=True) == ("maximo", "Julio (1,500 muertes)")
+
+
+@pytest.mark.parametrize("resultado", [POR_REGION, CONTEO])
+def test_otra_dimension_no_se_responde_localmente(resultado):
+    # "la principal causa" tras una lista de regiones o un conteo pide otra consulta
+    assert responder_seguimiento(resultado, "cuál es la principal causa de muerte", completo=True) is None
+    assert responder_seguimiento(resultado, "qué mes es el mayor", completo=True) is None
+
+
+def test_sin_etiqueta_no_hay_operaciones_locales():
+    # "cuántas son" tras un conteo pide otra consulta, no el número de filas
+    for pregunta in ("cuál es la mayor", "suma", "cuántas son"):
+        assert responder_seguimiento(CONTEO, pregunta, completo=True) is None
+
+
+def test_lista_de_etiquetas_solo_se_cuenta():
+    regiones = [{"NOMBRE_REGION": fila["NOMBRE_REGION"]} for fila in POR_REGION]
+    assert responder_seguimiento(regiones, "cuántas son", completo=True) == ("conteo", "Son 3.")
+    assert responder_seguimiento(regiones, "cuál es la mayor", completo=True) is None
+
+
+def test_resultado_recortado_por_limit():
+    # Top 10 de causas (LIMIT 10): contar, sumar o elegir el mínimo respondería sobre las filas mostradas
+    top_10 = [{"descripcion_capitulo": f"Capítulo {i}", "total_defunciones": 100 - i} for i in range(10)]
+    for pregunta in ("cuántas son", "suma", "cuál es la mayor", "cuál es la menor"):
+        assert responder_seguimiento(top_10, pregunta) is None
+    assert responder_seguimiento(top_10, "suma", completo=True) == ("suma", "En total, 955 muertes.")
+
+
+def test_no_se_suman_promedios():
+    assert responder_seguimiento(PROMEDIOS, "suma", completo=True) is None
+    assert responder_seguimiento(PROMEDIOS, "cuál es la mayor", completo=True) == ("maximo", "De Valparaíso (75.50)")
+
+
+def test_formas_no_reconocidas():
+    assert responder_seguimiento([], "suma", completo=True) is None
+    assert responder_seguimiento([{"a": 1}, {"b": 2}], "cuántas son", completo=True) is None
+
+
+def test_formatear_respuesta():
+    assert formatear_respuesta(CONTEO, "cuántas defunciones hubo") == "4,210 defunciones"
+    assert formatear_respuesta(POR_MES, "por mes") == "1. Marzo: 1,200\n2. Julio: 1,500"
+    assert formatear_respuesta([{"descripcion_capitulo": "Tumores [neoplasias]", "total": 10}], "causa") == \
+        "Cáncer (10 muertes)"
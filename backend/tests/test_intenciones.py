@@ -0,0 +1,103 @@
+import pytest
+
+from intenciones import MotorIntenciones
+from slots import configurar_comunas
+
+
+@pytest.fixture
+def motor():
+    return MotorIntenciones(umbral=0.8)
+
+
+@pytest.fixture
+def comunas():
+    configurar_comunas(["Puente Alto", "Pica"])
+    yield
+    configurar_comunas(())
+
+
+@pytest.mark.parametrize("pregunta", [
+    "cuántas muertes por covid hubo en 2024",
+    "cuántas muertes por suicidio hubo en 2024",
+    "cuántas muertes por infarto hubo en 2024",
+    "cuántas muertes de niños hubo en 2024",
+    "cuántas muertes de menores de 5 años hubo en 2024",
+    "cuántas muertes en el primer semestre hubo en 2024",
+    "cuántas muertes de mayores de 80 hubo en 2024",
+    "cuál es la edad promedio de muerte",
+    "cuántas muertes hubo en 2019",
+    "cuántas muertes hubo en 2023 y 2024",
+    "cuántas muertes hubo en Valparaíso y en el Maule",
+    "cuántas muertes por comuna",
+])
+def test_filtros_sin_plantilla_van_al_llm(motor, pregunta):
+    intencion = motor.clasificar(pregunta)
+    assert intencion is None or intencion.confianza < motor.umbral
+    assert motor.resolver(pregunta) is None
+
+
+def test_mayores_no_es_mayo(motor):
+    intencion = motor.clasificar("cuántas muertes de mayores de 80 hubo en 2024")
+    assert "EXTRACT(MONTH" not in intencion.sql
+
+
+@pytest.mark.parametrize("pregunta, nombre, fragmentos", [
+    ("¿Cuántas muertes hubo en 2024?", "conteo", ['"ANIO" = 2024']),
+    ("¿Cuántas defunciones hubo en Valparaíso en marzo de 2023?", "conteo",
+     ['EXTRACT(MONTH FROM d."FECHA_DEF") = 3', "'De Valparaíso'", '"ANIO" = 2023']),
+    ("cuántas muertes por cáncer hubo en 2023", "conteo", ["LIKE 'C%'", '"ANIO" = 2023']),
+    ("muertes por región", "por_region", ['GROUP BY u."NOMBRE_REGION"']),
+    ("¿Qué mes tuvo más muertes en 2025?", "por_mes", ["LIMIT 1", '"ANIO" = 2025']),
+    ("principales causas de muerte en la Región del Libertador B. O'Higgins", "principales_causas",
+     ["'Del Libertador B. O''Higgins'", "LIMIT 10"]),
+    ("muertes de hombres y mujeres", "por_sexo", ['GROUP BY d."SEXO_NOMBRE"']),
+])
+def test_plantillas(motor, pregunta, nombre, fragmentos):
+    intencion = motor.resolver(pregunta)
+    assert intencion is not None and intencion.nombre == nombre
+    for fragmento in fragmentos:
+        assert fragmento in intencion.sql
+
+
+def test_agrupar_por_sexo_no_filtra_sexo(motor):
+    assert "WHERE" not in motor.resolver("muertes de hombres y mujeres").sql
+
+
+def test_comuna_con_su_nombre(motor, comunas):
+    intencion = motor.resolver("cuántas muertes hubo en la comuna de Puente Alto en 2024")
+    assert "u.\"COMUNA\" = 'Puente Alto'" in intencion.sql
+
+
+def test_comuna_ambigua_va_al_llm(motor, comunas):
+    assert motor.resolver("cuántas muertes hubo en la comuna de Pica en 2024") is None
+
+
+@pytest.mark.parametrize("original, fragmento", [
+    ("¿Cuántas muertes hubo en 2024?", '"ANIO" = 2024'),
+    ("¿Cuántas defunciones hubo en Valparaíso en marzo de 2023?", "'De Valparaíso'"),
+    ("cuántas muertes por cáncer hubo en 2023", "LIKE 'C%'"),
+])
+def test_expansion_que_pierde_slots_usa_la_original(motor, original, fragmento):
+    # "cuántas" activa la expansión general aunque la pregunta ya traiga sus filtros
+    intencion = motor.resolver("cuántas defunciones hay en total", original=original)
+    assert fragmento in intencion.sql
+
+
+def test_expansion_no_descarta_filtros_de_la_original(motor):
+    # "cuántas" tras una pregunta con año se expande a "cuántas defunciones hubo en 2024"
+    original = "cuántas muertes de mayores de 80 hubo en 2024"
+    assert motor.resolver("cuántas defunciones hubo en 2024", original=original) is None
+    assert motor.resolver("cuántas defunciones hubo en 2023", original="cuántas?") is not None
+
+
+def test_expansion_que_conserva_slots(motor):
+    intencion = motor.resolver("cuántas muertes hubo en hombres en De Valparaíso en 2024", original="y en hombres")
+    assert "'Hombre'" in intencion.sql and "'De Valparaíso'" in intencion.sql
+
+
+def test_telemetria(motor):
+    motor.resolver("muertes por región")
+    motor.resolver("cuántas muertes por covid hubo en 2024")
+    motor.resolver("cuál es la capital de Francia")
+    stats = motor.estadisticas()
+    assert (stats["evaluadas"], stats["resueltas"], stats["bajo_umbral"], stats["sin_intencion"]) == (3, 1, 1, 1)
@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+from reglas_expansion import MotorExpansion, cargar_reglas, configurar_reglas, renderizar
+
+
+@pytest.fixture
+def motor():
+    return MotorExpansion()
+
+
+def historial(*pares):
+    return [{"pregunta": pregunta, "sql": sql} for pregunta, sql in pares]
+
+
+def test_y_en_hombres_sigue_el_tema_anterior(motor):
+    # Tras "principales causas en X" no se reescribe como un conteo
+    sesion = {"ultima_region": "De La Araucanía", "ultimo_año": "2024"}
+    previo = historial(("principales causas de muerte en la Araucanía", "SELECT ..."))
+    assert motor.expandir("y en hombres", sesion, previo) == ("muertes en hombres en De La Araucanía", "hombres")
+    assert motor.expandir("y en mujeres", sesion, previo) == ("muertes en mujeres en De La Araucanía", "mujeres")
+
+
+def test_y_en_hombres_con_causa(motor):
+    sesion = {"ultima_causa": "cáncer"}
+    assert motor.expandir("y en hombres", sesion, []) == ("muertes por cáncer en hombres", "hombres_causa")
+
+
+def test_pregunta_corta_usa_el_año_anterior(motor):
+    previo = historial(("muertes en el Biobío en 2023", None))
+    assert motor.expandir("cuántas?", {}, previo) == ("cuántas defunciones hubo en 2023", "corta_año_anterior")
+
+
+def test_conteo_de_regiones_tras_una_lista(motor):
+    previo = historial(("lista de regiones", 'SELECT DISTINCT "NOMBRE_REGION" FROM ubicaciones'))
+    assert motor.expandir("puedes contarlas", {}, previo) == \
+        ("cuántas regiones diferentes hay en el dataset", "conteo_regiones")
+
+
+def test_sin_frases_no_se_expande(motor):
+    assert motor.expandir("muertes por región", {}, []) == ("muertes por región", None)
+    assert motor.estadisticas()["sin_regla"] == 1
+
+
+def test_simulacion_no_cuenta(motor):
+    motor.expandir("y en hombres", {"ultima_region": "Del Maule"}, [], contar=False)
+    assert motor.estadisticas()["evaluadas"] == 0
+
+
+@pytest.mark.parametrize("plantilla, variables, esperado", [
+    ("muertes en {region}", {"region": "Del Maule"}, "muertes en Del Maule"),
+    ("muertes en {region}", {}, None),
+    ("muertes[ en {region}][ en {año}]", {"año": "2024"}, "muertes en 2024"),
+    ("mes de {año|año_reciente|'2024'}", {"año_reciente": "2023"}, "mes de 2023"),
+    ("mes de {año|año_reciente|'2024'}", {}, "mes de 2024"),
+    ("{pregunta}", {"pregunta": "{region}"}, "{region}"),
+])
+def test_renderizar(plantilla, variables, esperado):
+    assert renderizar(plantilla, variables) == esperado
+
+
+def test_reglas_adicionales_reemplazan_por_nombre(tmp_path):
+    ruta = tmp_path / "reglas.json"
+    ruta.write_text(json.dumps([{"nombre": "hombres", "prioridad": 19, "plantilla": "defunciones masculinas",
+                                 "frases": [["y en hombres"]]}]), encoding="utf-8")
+    try:
+        motor = configurar_reglas(cargar_reglas(str(ruta)))
+        assert motor.expandir("y en hombres", {}, []) == ("defunciones masculinas", "hombres")
+    finally:
+        configurar_reglas()
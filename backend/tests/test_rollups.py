@@ -0,0 +1,48 @@
+from decimal import Decimal
+
+from rollups import CUBO_COMUNA, CUBO_REGION, CUBOS, reescribir_con_rollup, resultados_equivalentes
+
+POR_REGION = ('SELECT u."NOMBRE_REGION", COUNT(*) FROM defunciones_principales d '
+              'JOIN ubicaciones u ON d."COD_COMUNA" = u."COD_COMUNA" GROUP BY u."NOMBRE_REGION" ORDER BY COUNT(*) DESC')
+
+CONTEO_2024 = 'SELECT COUNT(*) AS total_defunciones FROM defunciones_principales d WHERE d."ANIO" = 2024'
+POR_COMUNA = ('SELECT u."COMUNA", COUNT(*) FROM defunciones_principales d JOIN ubicaciones u '
+              'ON d."COD_COMUNA" = u."COD_COMUNA" WHERE d."ANIO" = 2024 GROUP BY u."COMUNA"')
+
+
+def test_conteo_con_filtro():
+    assert reescribir_con_rollup(CONTEO_2024, CUBOS) == (
+        'SELECT COALESCE(SUM(total), 0)::bigint AS "total_defunciones" FROM mv_cubo_region WHERE "ANIO" = 2024'
+    )
+
+
+def test_agrupacion_con_join_conserva_filtro_de_ubicacion():
+    sql = reescribir_con_rollup(POR_REGION, CUBOS)
+    assert sql.startswith('SELECT "NOMBRE_REGION" AS "NOMBRE_REGION", SUM(total)::bigint AS "count" FROM mv_cubo_region')
+    assert "WHERE con_ubicacion" in sql
+    assert sql.endswith("ORDER BY SUM(total)::bigint DESC")
+
+
+def test_comuna_requiere_su_cubo():
+    assert f"FROM {CUBO_COMUNA}" in reescribir_con_rollup(POR_COMUNA, CUBOS)
+    assert reescribir_con_rollup(POR_COMUNA, {CUBO_REGION}) is None
+
+
+def test_consultas_no_elegibles():
+    assert reescribir_con_rollup('SELECT AVG("EDAD_CANT") FROM defunciones_principales', CUBOS) is None
+    assert reescribir_con_rollup('SELECT "SEXO_NOMBRE", COUNT(*) FROM defunciones_principales '
+                                 'GROUP BY "SEXO_NOMBRE" HAVING COUNT(*) > 5', CUBOS) is None
+    assert reescribir_con_rollup(CONTEO_2024, ()) is None
+
+
+def test_sql_canonico_sigue_siendo_elegible(analizador):
+    canonico = analizador.analizar(POR_REGION).sql
+    assert canonico.endswith("LIMIT 1000")
+    assert reescribir_con_rollup(canonico, CUBOS).endswith("LIMIT 1000")
+
+
+def test_resultados_equivalentes_tipos_numericos():
+    original = [{"mes": Decimal("1"), "total": 10}, {"mes": Decimal("2"), "total": 5}]
+    reescrito = [{"mes": 2, "total": 5}, {"mes": 1, "total": 10}]
+    assert resultados_equivalentes(original, reescrito, ordenado=False)
+    assert not resultados_equivalentes(original, reescrito, ordenado=True)
@@ -0,0 +1,66 @@
+import pytest
+
+from slots import ExtractorSlots
+
+
+@pytest.fixture
+def extractor():
+    return ExtractorSlots(["Pica", "Puente Alto", "Santiago"])
+
+
+@pytest.mark.parametrize("pregunta", ["cuál es la mayor", "mayores de 80", "cuál es el mayor", "la típica"])
+def test_terminos_no_calzan_como_prefijo(extractor, pregunta):
+    assert extractor.extraer(pregunta) == {}
+
+
+def test_mes_como_palabra_completa(extractor):
+    assert extractor.extraer("muertes en mayo, 2024") == {'mes': 'mayo', 'mes_num': '05', 'año': '2024'}
+
+
+@pytest.mark.parametrize("pregunta, slot, valor", [
+    ("y en hombres", 'sexo', 'Hombre'),
+    ("y en mujeres", 'sexo', 'Mujer'),
+    ("muertes por tumores", 'causa', 'cáncer'),
+    ("enfermedades cardiovasculares", 'causa', 'cardiovascular'),
+])
+def test_plurales(extractor, pregunta, slot, valor):
+    assert extractor.extraer(pregunta)[slot] == valor
+
+
+def test_tildes_y_apostrofes(extractor):
+    slots = extractor.extraer("Defunciones en Valparaiso y O'Higgins por cancer")
+    assert slots['region'] == 'De Valparaíso'
+    assert slots['causa'] == 'cáncer'
+
+
+def test_comunas_exactas(extractor):
+    assert extractor.extraer("muertes en Pica")['comuna'] == 'Pica'
+    assert extractor.extraer("muertes en Picas") == {}
+    assert extractor.extraer("Puente Alto en 2024") == {'comuna': 'Puente Alto', 'año': '2024'}
+
+
+def test_comuna_con_nombre_de_region_queda_como_region(extractor):
+    assert extractor.extraer("muertes en Santiago") == {'region': 'Metropolitana de Santiago'}
+
+
+@pytest.mark.parametrize("pregunta", [
+    "muertes en primavera",
+    "muertes en la Primavera de 2024",
+    "día de la Independencia",
+    "qué causa pica más en 2024",
+])
+def test_comunas_ambiguas_sin_contexto(pregunta):
+    extractor = ExtractorSlots(["Primavera", "Independencia", "Pica"])
+    assert 'comuna' not in extractor.extraer(pregunta)
+    assert 'comuna' not in extractor.separar(pregunta)[1]
+
+
+@pytest.mark.parametrize("pregunta, comuna", [
+    ("muertes en Primavera", "Primavera"),
+    ("muertes en la comuna de independencia", "Independencia"),
+    ("defunciones en la comuna Pica en 2024", "Pica"),
+])
+def test_comunas_ambiguas_con_contexto(pregunta, comuna):
+    extractor = ExtractorSlots(["Primavera", "Independencia", "Pica"])
+    assert extractor.extraer(pregunta)['comuna'] == comuna
+    assert extractor.separar(pregunta)[1]['comuna'] == {comuna}